@@ -14,9 +14,24 @@ import argparse
 import os
 import re
 import bz2
+import lzma
+import zlib
 import copy
-from scipy import stats
+import io
+import mmap
+import time
 import reprlib
+from collections import OrderedDict
+try:
+    import zstandard
+    have_zstandard = True
+except ImportError:
+    have_zstandard = False
+try:
+    import lz4.frame
+    have_lz4 = True
+except ImportError:
+    have_lz4 = False
 
 # only potential dual head systems need to be included here.
 sonar_translator = {'em124': [None, 'tx', 'rx', None],
@@ -30,20 +45,531 @@ sonar_translator = {'em124': [None, 'tx', 'rx', None],
                     'em2045_dual': [None, 'txrx_port', 'txrx_stbd', None],
                     'em3020': [None, 'tx', 'rx', None], 'em3020_dual': [None, 'txrx_port', 'txrx_stbd', None]}
 
+# structured dtype matching the "1H8B1H6f2H18f4H" EMdgmMRZ_sounding struct (120 bytes), used to decode the whole
+#  sounding table of a ping in one np.frombuffer call, see kmall.read_EMdgmMRZ_sounding_block
+mrz_sounding_dtype = np.dtype([('soundingIndex', '<u2'), ('txSectorNumb', 'u1'), ('detectionType', 'u1'),
+                               ('detectionMethod', 'u1'), ('rejectionInfo1', 'u1'), ('rejectionInfo2', 'u1'),
+                               ('postProcessingInfo', 'u1'), ('detectionClass', 'u1'),
+                               ('detectionConfidenceLevel', 'u1'), ('padding', '<u2'), ('rangeFactor', '<f4'),
+                               ('qualityFactor', '<f4'), ('detectionUncertaintyVer_m', '<f4'),
+                               ('detectionUncertaintyHor_m', '<f4'), ('detectionWindowLength_sec', '<f4'),
+                               ('echoLength_sec', '<f4'), ('WCBeamNumb', '<u2'), ('WCrange_samples', '<u2'),
+                               ('WCNomBeamAngleAcross_deg', '<f4'), ('meanAbsCoeff_dbPerkm', '<f4'),
+                               ('reflectivity1_dB', '<f4'), ('reflectivity2_dB', '<f4'),
+                               ('receiverSensitivityApplied_dB', '<f4'), ('sourceLevelApplied_dB', '<f4'),
+                               ('BScalibration_dB', '<f4'), ('TVG_dB', '<f4'), ('beamAngleReRx_deg', '<f4'),
+                               ('beamAngleCorrection_deg', '<f4'), ('twoWayTravelTime_sec', '<f4'),
+                               ('twoWayTravelTimeCorrection_sec', '<f4'), ('deltaLatitude_deg', '<f4'),
+                               ('deltaLongitude_deg', '<f4'), ('z_reRefPoint_m', '<f4'), ('y_reRefPoint_m', '<f4'),
+                               ('x_reRefPoint_m', '<f4'), ('beamIncAngleAdj_deg', '<f4'),
+                               ('realTimeCleanInfo', '<u2'), ('SIstartRange_samples', '<u2'),
+                               ('SIcentreSample', '<u2'), ('SInumSamples', '<u2')])
+
+# the general datagram header, "1I4s2B1H2I", see kmall.read_EMdgmHeader
+kmall_header_dtype = np.dtype([('numBytesDgm', '<u4'), ('dgmType', 'S4'), ('dgmVersion', 'u1'), ('systemID', 'u1'),
+                               ('echoSounderID', '<u2'), ('time_sec', '<u4'), ('time_nanosec', '<u4')])
+
+# the water column beam header, "1f4H", see kmall.read_EMdgmMWCrxBeamData
+mwc_beam_dtype = np.dtype([('beamPointAngReVertical_deg', '<f4'), ('startRangeSampleNum', '<u2'),
+                           ('detectedRangeInSamples', '<u2'), ('beamTxSectorNum', '<u2'), ('numSampleData', '<u2')])
+# fill value for the samples past numSampleData in the padded amplitude array of kmall.read_EMdgmMWCrxBeamData_block
+mwc_amplitude_fill = -128
+
+# one SKM sample, KMbinary ("4B" + "2H3I" + "2d" + "21f", 120 bytes) followed by KMdelayedHeave ("2I1f", 12 bytes), see
+#  kmall.read_EMdgmSKMsample_block
+skm_sample_dtype = np.dtype([('dgmType', 'S4'), ('numBytesDgm', '<u2'), ('dgmVersion', '<u2'), ('time_sec', '<u4'),
+                             ('time_nanosec', '<u4'), ('status', '<u4'), ('latitude_deg', '<f8'),
+                             ('longitude_deg', '<f8'), ('ellipsoidHeight_m', '<f4'), ('roll_deg', '<f4'),
+                             ('pitch_deg', '<f4'), ('heading_deg', '<f4'), ('heave_m', '<f4'), ('rollRate', '<f4'),
+                             ('pitchRate', '<f4'), ('yawRate', '<f4'), ('velNorth', '<f4'), ('velEast', '<f4'),
+                             ('velDown', '<f4'), ('latitudeError_m', '<f4'), ('longitudeError_m', '<f4'),
+                             ('ellipsoidalHeightError_m', '<f4'), ('rollError_deg', '<f4'), ('pitchError_deg', '<f4'),
+                             ('headingError_deg', '<f4'), ('heaveError_m', '<f4'), ('northAcceleration', '<f4'),
+                             ('eastAcceleration', '<f4'), ('downAcceleration', '<f4'),
+                             ('delayedHeave_time_sec', '<u4'), ('delayedHeave_time_nanosec', '<u4'),
+                             ('delayedHeave_m', '<f4')])
+
+# the MRZ blocks before the soundings, used to go straight to the wanted fields of a MRZ datagram with offset arithmetic,
+#  see kmall.extract_point_cloud and kmall.compile_mrz_decoder
+# EMdgmMbody, "2H8B", see kmall.read_EMdgmMbody
+mrz_cmnpart_dtype = np.dtype([('numBytesCmnPart', '<u2'), ('pingCnt', '<u2'), ('rxFansPerPing', 'u1'),
+                              ('rxFanIndex', 'u1'), ('swathsPerPing', 'u1'), ('swathAlongPosition', 'u1'),
+                              ('txTransducerInd', 'u1'), ('rxTransducerInd', 'u1'), ('numRxTransducers', 'u1'),
+                              ('algorithmType', 'u1')])
+# EMdgmMRZ_pingInfo, "2H1f6B1H11f2h2B1H1I3f2H1f2H6f4B" + "2d1f", see kmall.read_EMdgmMRZ_pingInfo
+mrz_pinginfo_dtype = np.dtype([('numBytesInfoData', '<u2'), ('padding0', '<u2'), ('pingRate_Hz', '<f4'),
+                               ('beamSpacing', 'u1'), ('depthMode', 'u1'), ('subDepthMode', 'u1'),
+                               ('distanceBtwSwath', 'u1'), ('detectionMode', 'u1'), ('pulseForm', 'u1'),
+                               ('padding1', '<u2'), ('frequencyMode_Hz', '<f4'), ('freqRangeLowLim_Hz', '<f4'),
+                               ('freqRangeHighLim_Hz', '<f4'), ('maxTotalTxPulseLength_sec', '<f4'),
+                               ('maxEffTxPulseLength_sec', '<f4'), ('maxEffTxBandWidth_Hz', '<f4'),
+                               ('absCoeff_dBPerkm', '<f4'), ('portSectorEdge_deg', '<f4'),
+                               ('starbSectorEdge_deg', '<f4'), ('portMeanCov_deg', '<f4'), ('stbdMeanCov_deg', '<f4'),
+                               ('portMeanCov_m', '<i2'), ('starbMeanCov_m', '<i2'), ('modeAndStabilisation', 'u1'),
+                               ('runtimeFilter1', 'u1'), ('runtimeFilter2', '<u2'), ('pipeTrackingStatus', '<u4'),
+                               ('transmitArraySizeUsed_deg', '<f4'), ('receiveArraySizeUsed_deg', '<f4'),
+                               ('transmitPower_dB', '<f4'), ('SLrampUpTimeRemaining', '<u2'), ('padding2', '<u2'),
+                               ('yawAngle_deg', '<f4'), ('numTxSectors', '<u2'), ('numBytesPerTxSector', '<u2'),
+                               ('headingVessel_deg', '<f4'), ('soundSpeedAtTxDepth_mPerSec', '<f4'),
+                               ('txTransducerDepth_m', '<f4'), ('z_waterLevelReRefPoint_m', '<f4'),
+                               ('x_kmallToall_m', '<f4'), ('y_kmallToall_m', '<f4'), ('latLongInfo', 'u1'),
+                               ('posSensorStatus', 'u1'), ('attitudeSensorStatus', 'u1'), ('padding3', 'u1'),
+                               ('latitude_deg', '<f8'), ('longitude_deg', '<f8'),
+                               ('ellipsoidHeightReRefPoint_m', '<f4')])
+# EMdgmMRZ_txSectorInfo, "4B7f2B1H" (the version 1 part), see kmall.read_EMdgmMRZ_txSectorInfo
+mrz_txsector_dtype = np.dtype([('txSectorNumb', 'u1'), ('txArrNumber', 'u1'), ('txSubArray', 'u1'), ('padding0', 'u1'),
+                               ('sectorTransmitDelay_sec', '<f4'), ('tiltAngleReTx_deg', '<f4'),
+                               ('txNominalSourceLevel_dB', '<f4'), ('txFocusRange_m', '<f4'), ('centreFreq_Hz', '<f4'),
+                               ('signalBandWidth_Hz', '<f4'), ('totalSignalLength_sec', '<f4'),
+                               ('pulseShading', 'u1'), ('signalWaveForm', 'u1'), ('padding1', '<u2')])
+# EMdgmMRZ_rxInfo, "4H4f4H", see kmall.read_EMdgmMRZ_rxInfo
+mrz_rxinfo_dtype = np.dtype([('numBytesRxInfo', '<u2'), ('numSoundingsMaxMain', '<u2'),
+                             ('numSoundingsValidMain', '<u2'), ('numBytesPerSounding', '<u2'), ('WCSampleRate', '<f4'),
+                             ('seabedImageSampleRate', '<f4'), ('BSnormal_dB', '<f4'), ('BSoblique_dB', '<f4'),
+                             ('extraDetectionAlarmFlag', '<u2'), ('numExtraDetections', '<u2'),
+                             ('numExtraDetectionClasses', '<u2'), ('numBytesPerClass', '<u2')])
+# beam flag fields returned by kmall.extract_point_cloud with include_flags=True
+point_cloud_flag_fields = ['detectionType', 'detectionMethod', 'rejectionInfo1', 'rejectionInfo2']
+
+# version of the sidecar index written by kmall.save_index_sidecar, increment when the contents change
+kmall_index_version = 1
+
+# compress/decompress functions for the sounding and imagery blocks of the CZ0/CZ1 datagrams, see
+#  kmall.compressSoundings.  Decompression recognizes the codec from the start of the block (see _decompress_block), so
+#  any of these can be read back without knowing which one was used.
+sounding_codecs = {'bz2': (bz2.compress, bz2.decompress),
+                   'zlib': (zlib.compress, zlib.decompress),
+                   'lzma': (lzma.compress, lzma.decompress)}
+if have_zstandard:
+    sounding_codecs['zstd'] = (lambda buffer: zstandard.ZstdCompressor().compress(buffer),
+                               lambda buffer: zstandard.ZstdDecompressor().decompress(buffer))
+if have_lz4:
+    sounding_codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+# magic bytes at the start of the compressed block for each codec, zlib is the fallback
+sounding_codec_magic = [(b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'lzma'), (b'\x28\xb5\x2f\xfd', 'zstd'), (b'\x04\x22\x4d\x18', 'lz4')]
+# codec used by the CZ0/CZ1 writers when none is given
+default_sounding_codec = 'bz2'
+# the sounding columns (and their struct format) in the order they are packed by kmall.compressSoundings
+compressed_sounding_columns = [('soundingIndex', 'H'), ('txSectorNumb', 'B'), ('detectionType', 'B'),
+                               ('detectionMethod', 'B'), ('rejectionInfo1', 'B'), ('rejectionInfo2', 'B'),
+                               ('postProcessingInfo', 'B'), ('detectionClass', 'B'), ('detectionConfidenceLevel', 'B'),
+                               ('padding', 'H'), ('rangeFactor', 'f'), ('qualityFactor', 'f'),
+                               ('detectionUncertaintyVer_m', 'f'), ('detectionUncertaintyHor_m', 'f'),
+                               ('detectionWindowLength_sec', 'f'), ('echoLength_sec', 'f'), ('WCBeamNumb', 'H'),
+                               ('WCrange_samples', 'H'), ('WCNomBeamAngleAcross_deg', 'f'), ('meanAbsCoeff_dbPerkm', 'f'),
+                               ('reflectivity1_dB', 'f'), ('reflectivity2_dB', 'f'),
+                               ('receiverSensitivityApplied_dB', 'f'), ('sourceLevelApplied_dB', 'f'),
+                               ('BScalibration_dB', 'f'), ('TVG_dB', 'f'), ('beamAngleReRx_deg', 'f'),
+                               ('beamAngleCorrection_deg', 'f'), ('twoWayTravelTime_sec', 'f'),
+                               ('twoWayTravelTimeCorrection_sec', 'f'), ('deltaLatitude_deg', 'f'),
+                               ('deltaLongitude_deg', 'f'), ('z_reRefPoint_m', 'f'), ('y_reRefPoint_m', 'f'),
+                               ('x_reRefPoint_m', 'f'), ('beamIncAngleAdj_deg', 'f'), ('realTimeCleanInfo', 'H'),
+                               ('SIstartRange_samples', 'H'), ('SIcentreSample', 'H'), ('SInumSamples', 'H')]
+
+# files written by compress_kmall_file, ex: 0000_20200101_000000.kmall.0z (compression level 0), with an optional _01
+#  before the level when that name was taken
+compressed_kmall_regex = re.compile(r'(?P<basename>.*\.kmall)(_\d+)?\.(?P<level>\d+)z$')
+# approximate number of bytes of the input file converted by each task of compress_kmall_file/decompress_kmall_file
+archive_task_bytes = 16 * 1024 * 1024
+
+# size of the windows read by kmall.find_next_datagram when scanning a file (that is not memory mapped) for a datagram
+resync_window_size = 4 * 1024 * 1024
+
+
 class CorruptPacketError(Exception):
     pass
 
 
+class MappedKmallFile:
+    """
+    Read only file-like object over a memory mapped kmall file, used as kmall.FID when kmall is constructed with
+    use_mmap=True.  read returns memoryview slices of the map instead of new bytes objects, so struct.unpack and
+    np.frombuffer in the read_EMdgm methods decode straight from the mapped pages without an intermediate copy.
+
+    The map is shared between clones (see clone), each clone only carries its own position.  This lets several
+    threads decode different datagrams of the same file at the same time, see kmall.decode_datagram_at.
+
+    Arrays returned by the vectorized readers are read only views into the map.  The map is only unmapped once all
+    of them are released, close will not invalidate data you still hold.
+    """
+
+    def __init__(self, filename: str = None, shared: 'MappedKmallFile' = None):
+        if shared is not None:
+            self.name = shared.name
+            self._fileobj = shared._fileobj
+            self.mmap = shared.mmap
+            self._view = shared._view
+        else:
+            self.name = filename
+            self._fileobj = open(filename, 'rb')
+            if os.fstat(self._fileobj.fileno()).st_size:
+                self.mmap = mmap.mmap(self._fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self.mmap)
+            else:  # can't map an empty file
+                self.mmap = None
+                self._view = memoryview(b'')
+        self._pos = 0
+        self.closed = False
+
+    def clone(self):
+        """
+        Return a new MappedKmallFile sharing this map, with its own independent position
+        """
+        return MappedKmallFile(shared=self)
+
+    def fileno(self):
+        return self._fileobj.fileno()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int = 0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError('MappedKmallFile: invalid whence ({}, should be 0, 1 or 2)'.format(whence))
+        if self._pos < 0:
+            raise OSError('MappedKmallFile: negative seek position {}'.format(self._pos))
+        return self._pos
+
+    def read(self, size: int = -1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(self._pos + size, len(self._view))
+        start = min(self._pos, end)
+        self._pos = max(self._pos, end)
+        return self._view[start:end]
+
+    def close(self):
+        """
+        Close the file handle and release the map.  Clones share the map, closing any of them closes it for all.
+        """
+        if not self.closed:
+            self.closed = True
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+            if self.mmap is not None:
+                try:
+                    self.mmap.close()
+                except BufferError:  # arrays still reference the map, it is unmapped when they are garbage collected
+                    pass
+            self._fileobj.close()
+
+
+class KmallWaterColumn:
+    """
+    Lazy water column accessor for a kmall file, see kmall.watercolumn.  Uses the datagram index to find the MWC
+    datagrams of each ping and only decodes them when asked for (read_EMdgmMWC with vectorized=True), keeping the
+    cache_size most recently used pings in memory.
+
+    km = kmall.kmall(r"C:\\Users\\zzzz\\Downloads\\0007_20190513_154724_ASVBEN.kmall", use_mmap=True)
+    ping = km.watercolumn[100]
+    amplitude = ping['beamData']['sampleAmplitude05dB_p']  # int8 (beams, samples)
+
+    Pings are numbered in time order.  If a ping has more than one MWC datagram (dual head systems), the beamData and
+    phaseInfo arrays of all of them are concatenated along the beam axis, the other records are from the first one.
+    """
+
+    def __init__(self, km: 'kmall', cache_size: int = 8):
+        self.km = km
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        if km.Index is None:
+            km.index_file()
+        mwc_mask = np.array(km.msgtype, dtype=str) == "b'#MWC'"
+        offsets = np.asarray(km.msgoffset, dtype=np.int64)[mwc_mask]
+        times = np.asarray(km.msgtime, dtype=np.float64)[mwc_mask]
+        # pings are the unique times, in time order, then the datagrams of each ping in file order
+        self.times, ping_number = np.unique(times, return_inverse=True)
+        order = np.argsort(ping_number, kind='stable')
+        self._offsets = offsets[order]
+        self._ping_start = np.searchsorted(ping_number[order], np.arange(len(self.times) + 1))
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, ping_index):
+        if isinstance(ping_index, slice):
+            return [self[idx] for idx in range(*ping_index.indices(len(self)))]
+        ping_index = int(ping_index)
+        if ping_index < 0:
+            ping_index += len(self)
+        if not 0 <= ping_index < len(self):
+            raise IndexError('KmallWaterColumn: ping index {} out of range for {} pings'.format(ping_index, len(self)))
+        if ping_index in self._cache:
+            self._cache.move_to_end(ping_index)
+            return self._cache[ping_index]
+
+        ping = self._decode_ping(ping_index)
+        if self.cache_size > 0:
+            self._cache[ping_index] = ping
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ping
+
+    def datagram_offsets(self, ping_index: int):
+        """
+        Return the byte offsets of the MWC datagrams that make up the given ping
+        """
+        return self._offsets[self._ping_start[ping_index]:self._ping_start[ping_index + 1]]
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _decode_ping(self, ping_index: int):
+        dgrams = [self.km.decode_datagram_at(int(offset), vectorized=True) for offset in self.datagram_offsets(ping_index)]
+        ping = dgrams[0]
+        if len(dgrams) > 1:
+            ping = dict(ping)
+            ping['beamData'] = {}
+            for ky in dgrams[0]['beamData']:
+                ping['beamData'][ky] = _concatenate_padded([dg['beamData'][ky] for dg in dgrams], mwc_amplitude_fill)
+            if 'phaseInfo' in dgrams[0]:
+                ping['phaseInfo'] = {'rxBeamPhase': _concatenate_padded([dg['phaseInfo']['rxBeamPhase'] for dg in dgrams], 0)}
+            ping['rxInfo'] = dict(ping['rxInfo'])
+            ping['rxInfo']['numBeams'] = sum(dg['rxInfo']['numBeams'] for dg in dgrams)
+        return ping
+
+
+def _concatenate_padded(arrays: list, fill):
+    """
+    Concatenate 1d arrays, or 2d (beams, samples) arrays with differing number of samples padded with fill
+    """
+    if arrays[0].ndim == 1:
+        return np.concatenate(arrays)
+    maxsamples = max(arr.shape[1] for arr in arrays)
+    out = np.full((sum(arr.shape[0] for arr in arrays), maxsamples), fill, dtype=arrays[0].dtype)
+    start = 0
+    for arr in arrays:
+        out[start:start + arr.shape[0], :arr.shape[1]] = arr
+        start += arr.shape[0]
+    return out
+
+
+class ColumnAccumulator:
+    """
+    Growable typed column used by sequential_read_records to collect the values of one record (ex: ping traveltime)
+    without building a list of small arrays.  Values are appended into a preallocated numpy buffer that doubles in
+    capacity when full.
+
+    A column is either scalar (one value per row, ex: ping time) or ragged (one 1d array per row, ex: the beam values
+    of a ping, with a varying number of beams), decided by the first value appended.  Ragged columns store all values
+    end to end, with offsets giving the start of each row, and are padded to a 2d array in to_array.
+
+    The dtype is taken from the first value, and promoted if a later value needs it.
+    """
+
+    def __init__(self, initial_capacity: int = 64):
+        self.ragged = None
+        self.num_rows = 0
+        self.num_values = 0
+        self._initial_capacity = max(int(initial_capacity), 1)
+        self._values = None
+        self._offsets = None
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getstate__(self):
+        # only pickle the used part of the buffers, see kmall.parallel_read_records
+        state = self.__dict__.copy()
+        if self._values is not None:
+            state['_values'] = self.values.copy()
+        if self._offsets is not None:
+            state['_offsets'] = self.offsets.copy()
+        return state
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_array(dtype=dtype)
+
+    @property
+    def values(self):
+        """
+        All values appended so far, for a ragged column the rows concatenated end to end
+        """
+        if self._values is None:
+            return np.zeros(0)
+        return self._values[:self.num_values]
+
+    @property
+    def offsets(self):
+        """
+        For a ragged column, the start of each row in values, plus the end of the last row (num_rows + 1 values)
+        """
+        if self._offsets is None:
+            return np.zeros(1, dtype=np.int64)
+        return self._offsets[:self.num_rows + 1]
+
+    def row_lengths(self):
+        """
+        Number of values in each row, 1 for each row of a scalar column
+        """
+        if self.ragged:
+            return np.diff(self.offsets)
+        return np.ones(self.num_rows, dtype=np.int64)
+
+    def _reserve(self, buffer: np.ndarray, needed: int):
+        if buffer.shape[0] >= needed:
+            return buffer
+        newbuffer = np.empty(max(needed, 2 * buffer.shape[0]), dtype=buffer.dtype)
+        newbuffer[:buffer.shape[0]] = buffer
+        return newbuffer
+
+    def append(self, value):
+        """
+        Add a row, a scalar for scalar columns, a 1d array (or list) for ragged columns
+        """
+        value = np.asarray(value)
+        if self.ragged is None:
+            self.ragged = value.ndim > 0
+            self._values = np.empty(self._initial_capacity * (max(value.size, 1) if self.ragged else 1), dtype=value.dtype)
+            if self.ragged:
+                self._offsets = np.zeros(self._initial_capacity + 1, dtype=np.int64)
+        elif (value.ndim > 0) != self.ragged:
+            raise ValueError('ColumnAccumulator: got a value of shape {} for a {} column'.format(
+                value.shape, 'ragged' if self.ragged else 'scalar'))
+        if value.dtype != self._values.dtype:
+            newtype = np.promote_types(self._values.dtype, value.dtype)
+            if newtype != self._values.dtype:
+                self._values = self._values.astype(newtype)
+
+        if self.ragged:
+            value = value.ravel()
+            self._values = self._reserve(self._values, self.num_values + value.size)
+            self._values[self.num_values:self.num_values + value.size] = value
+            self.num_values += value.size
+            self._offsets = self._reserve(self._offsets, self.num_rows + 2)
+            self._offsets[self.num_rows + 1] = self.num_values
+        else:
+            self._values = self._reserve(self._values, self.num_values + 1)
+            self._values[self.num_values] = value
+            self.num_values += 1
+        self.num_rows += 1
+
+    def extend(self, other: 'ColumnAccumulator'):
+        """
+        Add all the rows of another column to the end of this one
+        """
+        if other.ragged is None:
+            return
+        if self.ragged is None:
+            self.ragged = other.ragged
+            self._values = other.values.copy()
+            self._offsets = other.offsets.copy() if other.ragged else None
+            self.num_rows = other.num_rows
+            self.num_values = other.num_values
+            return
+        if self.ragged != other.ragged:
+            raise ValueError('ColumnAccumulator: can not extend a {} column with a {} column'.format(
+                'ragged' if self.ragged else 'scalar', 'ragged' if other.ragged else 'scalar'))
+        newtype = np.promote_types(self._values.dtype, other._values.dtype)
+        if newtype != self._values.dtype:
+            self._values = self._values.astype(newtype)
+        self._values = self._reserve(self._values, self.num_values + other.num_values)
+        self._values[self.num_values:self.num_values + other.num_values] = other.values
+        if self.ragged:
+            self._offsets = self._reserve(self._offsets, self.num_rows + other.num_rows + 1)
+            self._offsets[self.num_rows + 1:self.num_rows + other.num_rows + 1] = other.offsets[1:] + self.num_values
+        self.num_values += other.num_values
+        self.num_rows += other.num_rows
+
+    def max_row_length(self):
+        """
+        Length of the longest row
+        """
+        if not self.num_rows:
+            return 0
+        return int(self.row_lengths().max())
+
+    def to_array(self, dtype=None, maxlen: int = None, fill=0):
+        """
+        Return the column as a numpy array, 1d (rows) for a scalar column, 2d (rows, maxlen) for a ragged column with
+        rows shorter than maxlen padded with fill.
+
+        Parameters
+        ----------
+        dtype
+            dtype of the returned array, defaults to the column dtype
+        maxlen
+            number of columns for the ragged 2d array, defaults to (and is at least) the longest row
+        fill
+            value for the padding of short rows
+
+        Returns
+        -------
+        np.ndarray
+            new array holding the column values
+        """
+        values = self.values
+        if dtype is None:
+            dtype = values.dtype
+        if not self.ragged:
+            return values.astype(dtype)
+        lengths = self.row_lengths()
+        maxlen = max(maxlen or 0, self.max_row_length())
+        if (lengths == maxlen).all():
+            return values.astype(dtype).reshape(self.num_rows, maxlen)
+        out = np.full((self.num_rows, maxlen), fill, dtype=dtype)
+        row_idx = np.repeat(np.arange(self.num_rows), lengths)
+        col_idx = np.arange(self.num_values) - np.repeat(self.offsets[:-1], lengths)
+        out[row_idx, col_idx] = values
+        return out
+
+
+def _compress_block(buffer: bytes, codec: str = None):
+    """
+    Compress a CZ0/CZ1 sounding or imagery block with one of sounding_codecs, default_sounding_codec if codec is None
+    """
+    codec = default_sounding_codec if codec is None else codec
+    if codec not in sounding_codecs:
+        raise ValueError('Unknown codec {}, expected one of {}'.format(codec, list(sounding_codecs.keys())))
+    return sounding_codecs[codec][0](buffer)
+
+
+def _decompress_block(buffer: bytes):
+    """
+    Decompress a CZ0/CZ1 sounding or imagery block, the codec is recognized by its magic bytes (see
+    sounding_codec_magic)
+    """
+    codec = 'zlib'
+    for magic, magic_codec in sounding_codec_magic:
+        if bytes(buffer[:len(magic)]) == magic:
+            codec = magic_codec
+            break
+    if codec not in sounding_codecs:
+        raise ValueError('Compressed block uses {}, which is not installed'.format(codec))
+    return sounding_codecs[codec][1](buffer)
+
+
 class kmall():
-    """ A class for reading a Kongsberg KMALL data file. """
+    """
+    A class for reading a Kongsberg KMALL data file.
+
+    Set use_mmap to True to read through a memory map of the file (see MappedKmallFile) instead of a regular file
+    handle.  The datagram dicts are the same, but the vectorized blocks are views into the map rather than copies,
+    and decode_datagram_at can be called from several threads at once.
+    """
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, use_mmap: bool = False):
         self.verbose = 0
         self.filename = filename
+        self.use_mmap = use_mmap
         self.FID = None
         self.file_size = None
         self.header_size = None
         self.Index = None
+        # datagram table filled in by index_file, see _index_headers
+        self.msgtime = None
+        self.msgoffset = None
+        self.msgsize = None
+        self.msgtype = None
 
         self.pingDataCheck = None
         self.navDataCheck = None
@@ -55,18 +581,19 @@ class kmall():
         self.datagram_data = None
         self.read_method = None
         self.eof = False
-        self.time_buffer = []
 
         self.datagram_version = None
+        self._watercolumn = None
+        self.follow_offset = 0  # offset of the next datagram to read in follow mode, see follow
         self.validate_inputs()
 
     def validate_inputs(self):
         """
-        Ensure that the file passed in is a valid .kmall file
+        Ensure that the file passed in is a valid .kmall file (or a compressed kmall file, see compress_kmall_file)
         """
         if not os.path.exists(self.filename):
             raise ValueError('File provided does not exist: {}'.format(self.filename))
-        if os.path.splitext(self.filename)[1] != '.kmall':
+        if os.path.splitext(self.filename)[1] != '.kmall' and not compressed_kmall_regex.search(self.filename):
             raise ValueError('File provided does not have the kmall extension: {}'.format(self.filename))
 
     ###########################################################
@@ -75,41 +602,14 @@ class kmall():
 
     def scanToDatagram(self):
         """
-        A method to scan to the next datagram header.
-        """
-        foundDatagram = False
-        bufferSize = 64
-        format_to_unpack = str(bufferSize) + 's'
-        while not foundDatagram:
-            # Get position in the file.
-            # startPtr = FID.tell()
-            # Read some bytes.
-            buffer = self.FID.read(struct.Struct(format_to_unpack).size)
-
-            # If we didn't get a full buffer, we've read to EOF.
-            # Break out of loop next go, and reset the format to unpack
-            # for what we did read.
-            if len(buffer) < bufferSize:
-                foundDatagram = True
-                format_to_unpack = str(len(buffer)) + 's'
-
-            # print(buffer)
-
-            # Search for the datagram header ID.
-            m = re.search(b'\\#[A-Z]{3}',
-                          struct.unpack(format_to_unpack, buffer)[0])
-            if m:
-                print(m)
-                # If a header was found seek to the ID, minus
-                # 4 bytes to get to the start of the datagram.
-                self.FID.seek(-bufferSize + m.span()[0] - 4, 1)
-                foundDatagram = True
-            else:
-                if self.file_size - self.FID.tell() > bufferSize:
-                    # Seek backward 4 bytes if we didn't get a match
-                    # This handles the case when the ID is split
-                    # between two buffer reads.
-                    self.FID.seek(-4, 1)
+        A method to scan to the next datagram header.  Leaves the file pointer at the start of the next valid datagram
+        (see find_next_datagram) or at the end of the file if there are none.
+        """
+        next_offset = self.find_next_datagram(self.FID.tell())
+        if next_offset is None:
+            self.FID.seek(0, 2)
+        else:
+            self.FID.seek(next_offset)
 
     def decode_datagram(self, warn_no_definition: bool = False):
         """
@@ -138,7 +638,7 @@ class kmall():
             # dgram passes first check, starts with # and is 3 capital letters after
             if is_valid_identifier:
                 # now compare dgram identifier with the last three letters of each read method to find the right one
-                self.datagram_ident = dgram[-3:].decode()
+                self.datagram_ident = bytes(dgram[-3:]).decode()
                 read_method = [rm for rm in self.read_methods if rm[-3:] == self.datagram_ident]  # @TODO just make a dictionary of the 3 character codes to the read functions
                 if len(read_method) == 0:
                     self.read_method = None
@@ -157,11 +657,15 @@ class kmall():
         else:
             self.eof = True
     
-    def read_datagram(self):
+    def read_datagram(self, vectorized: bool = False):
         """
         Reads the datagram data and stores the data in self.datagram_data
         Will always translate the installation parameters record (translate=True)
-        
+
+        If vectorized is True, datagrams that have a numpy decode path (MRZ, MWC, SKM) are read with it, returning
+        numpy arrays instead of lists/tuples for the repeated blocks.  See read_EMdgmMRZ, read_EMdgmMWC and
+        read_EMdgmSKM.
+
         To get the first record:
         
         km = kmall.kmall(r"C:\\Users\\zzzz\\Downloads\\0007_20190513_154724_ASVBEN.kmall")
@@ -183,6 +687,8 @@ class kmall():
         if self.read_method is not None:  # is None when decode fails or is at the end of file
             if self.read_method in ['read_EMdgmIIP', 'read_EMdgmIOP']:
                 self.datagram_data = getattr(self, self.read_method)(translate=True)
+            elif vectorized and self.read_method in ['read_EMdgmMRZ', 'read_EMdgmMWC', 'read_EMdgmSKM']:
+                self.datagram_data = getattr(self, self.read_method)(vectorized=True)
             else:
                 self.datagram_data = getattr(self, self.read_method)()
 
@@ -222,6 +728,158 @@ class kmall():
             print('Unable to find {} in file'.format(datagram_identifier))
         return self.datagram_data
 
+    @property
+    def watercolumn(self):
+        """
+        Lazy water column accessor, km.watercolumn[ping_index] returns the decoded MWC datagram for that ping, see
+        KmallWaterColumn.  The file is indexed on first use if index_file has not been run.
+        """
+        if self._watercolumn is None:
+            self._watercolumn = KmallWaterColumn(self)
+        return self._watercolumn
+
+    def decode_datagram_at(self, offset: int, vectorized: bool = False):
+        """
+        Decode and read the datagram starting at offset (for instance a value from self.msgoffset after index_file)
+        without touching the position or datagram state of this object.
+
+        With use_mmap=True the read goes through a clone of the shared map with its own position, so this is safe to
+        call from several threads at once for different (or the same) datagrams of the file:
+
+        km = kmall.kmall(r"C:\\Users\\zzzz\\Downloads\\0007_20190513_154724_ASVBEN.kmall", use_mmap=True)
+        km.index_file()
+        mrz_offsets = km.msgoffset[np.array(km.msgtype) == "b'#MRZ'"]
+        with ThreadPoolExecutor() as pool:
+            pings = list(pool.map(lambda off: km.decode_datagram_at(off, vectorized=True), mrz_offsets))
+
+        Without the map a separate file handle is opened for the read.
+
+        Parameters
+        ----------
+        offset
+            byte offset of the start of the datagram (the numBytesDgm field)
+        vectorized
+            passed to read_datagram
+
+        Returns
+        -------
+        dict
+            the datagram dict, same as read_datagram would store in datagram_data, None if there is no read method
+            for this datagram
+        """
+
+        if self.FID is None:
+            self.OpenFiletoRead()
+        reader = copy.copy(self)
+        if isinstance(self.FID, MappedKmallFile):
+            reader.FID = self.FID.clone()
+        else:
+            reader.FID = open(self.filename, 'rb')
+        try:
+            if reader.file_size is None:
+                reader.file_size = reader.FID.seek(0, 2)
+            reader.FID.seek(offset)
+            reader.datagram_data = None
+            reader.decode_datagram()
+            reader.read_datagram(vectorized=vectorized)
+            return reader.datagram_data
+        finally:
+            if not isinstance(reader.FID, MappedKmallFile):
+                reader.FID.close()
+
+    def follow(self, poll_interval: float = 1.0, start_ptr: int = None, datagram_types: list = None,
+               vectorized: bool = True, idle_timeout: float = None):
+        """
+        Generator that follows a kmall file that is still being written (by SIS while logging), yielding each datagram
+        once it is completely written.  The file size is polled every poll_interval seconds, a datagram is only read
+        once all of it (up to and including the trailing length field matching the size field) is on disk.  Nothing
+        is read twice, the offset of the next datagram is kept in self.follow_offset so that a later call picks up
+        where the last one stopped.
+
+        km = kmall.kmall(r"C:\\Users\\zzzz\\Downloads\\0007_20190513_154724_ASVBEN.kmall")
+        for offset, dgram_type, dgram in km.follow(poll_interval=0.5, datagram_types=['MRZ']):
+            print(dgram['header']['dgtime'], dgram['sounding']['z_reRefPoint_m'].mean())
+
+        Corrupt data is skipped using find_next_datagram.  The file is read through its own handle (a memory map can't
+        follow a growing file), the position and datagram state of this object are not touched.
+
+        Parameters
+        ----------
+        poll_interval
+            seconds to wait between checks for new data
+        start_ptr
+            byte offset to start from, defaults to self.follow_offset (the start of the file on the first call)
+        datagram_types
+            list of datagram identifiers to read (ex: ['MRZ', 'SKM']), the others are skipped.  Default is all of them.
+        vectorized
+            passed to read_datagram
+        idle_timeout
+            stop once no new data has been written for this many seconds, if None, follow until the generator is
+            closed
+
+        Returns
+        -------
+        tuple
+            (byte offset, datagram identifier, datagram dict) for each completed datagram
+        """
+
+        if start_ptr is not None:
+            self.follow_offset = start_ptr
+        reader = copy.copy(self)
+        reader.FID = open(self.filename, 'rb')
+        try:
+            last_data = time.monotonic()
+            corrupt_offset = None
+            while True:
+                reader.file_size = os.fstat(reader.FID.fileno()).st_size
+                found_data = False
+                while self.follow_offset + 8 <= reader.file_size:
+                    offset = self.follow_offset
+                    reader.FID.seek(offset)
+                    start = reader.FID.read(8)
+                    numbytes = struct.unpack('<I', start[:4])[0]
+                    # only wait on a size past the end of the file if it is the size of a datagram, not garbage
+                    is_datagram = numbytes >= 24 and reader.datagram_ident_search.match(start, 4) is not None
+                    if is_datagram and offset + numbytes > reader.file_size:
+                        break  # partially written datagram, wait for the rest of it
+                    trailing = None
+                    if is_datagram:
+                        reader.FID.seek(offset + numbytes - 4)
+                        trailing = struct.unpack('<I', reader.FID.read(4))[0]
+                    if trailing != numbytes:
+                        if offset != corrupt_offset:  # only report once, we retry on each poll until data follows
+                            print('follow: corrupt datagram at byte offset {} in {}'.format(offset, self.filename))
+                            corrupt_offset = offset
+                        next_offset = reader.find_next_datagram(offset + 1)
+                        if next_offset is None:
+                            break  # nothing valid yet past the corrupt data, try again on the next poll
+                        self.follow_offset = next_offset
+                        continue
+
+                    found_data = True
+                    self.follow_offset = offset + numbytes
+                    reader.FID.seek(offset)
+                    reader.datagram_data = None
+                    try:
+                        reader.decode_datagram()
+                        if reader.read_method is None or reader.read_method == 'error':
+                            continue
+                        if datagram_types is not None and reader.datagram_ident not in datagram_types:
+                            continue
+                        reader.read_datagram(vectorized=vectorized)
+                    except CorruptPacketError as e:
+                        print(e)
+                        continue
+                    yield offset, reader.datagram_ident, reader.datagram_data
+
+                if found_data:
+                    last_data = time.monotonic()
+                elif idle_timeout is not None and time.monotonic() - last_data >= idle_timeout:
+                    return
+                time.sleep(poll_interval)
+        finally:
+            reader.FID.close()
+
     ###########################################################
     # Reading datagrams
     ###########################################################
@@ -286,7 +944,7 @@ class kmall():
 
         # Installation settings as text format. Parameters separated by ; and lines separated by , delimiter.
         tmp = self.FID.read(dg['numBytesCmnPart'] - struct.Struct(format_to_unpack).size)
-        i_text = tmp.decode('UTF-8')
+        i_text = bytes(tmp).decode('UTF-8')
 
         if translate:
             i_text = self.translate_installation_parameters_todict(i_text)
@@ -327,7 +985,7 @@ class kmall():
         # Runtime parameters as text format. Parameters separated by ; and lines separated by , delimiter.
         # Text strings refer to names in menus of the K-Controller/SIS.
         tmp = self.FID.read(dg['numBytesCmnPart'] - struct.Struct(format_to_unpack).size)
-        rt_text = tmp.decode('UTF-8')
+        rt_text = bytes(tmp).decode('UTF-8')
         # print(rt_text)
         if translate:
             rt_text = self.translate_runtime_parameters_todict(rt_text)
@@ -370,7 +1028,7 @@ class kmall():
 
         # Result of the BIST. Starts with a synopsis of the result, followed by detailed descriptions.
         tmp = self.FID.read(dg['numBytesCmnPart'] - struct.Struct(format_to_unpack).size)
-        bist_text = tmp.decode('UTF-8')
+        bist_text = bytes(tmp).decode('UTF-8')
         # print(bist_text)
         dg['BISTText'] = bist_text
 
@@ -900,7 +1558,38 @@ class kmall():
 
         return dg
 
-    def read_EMdgmMRZ(self):
+    def read_EMdgmMRZ_sounding_block(self, num_soundings: int, stride: int = None):
+        """
+        Read #MRZ - the full sounding table for a datagram (numSoundingsMaxMain + numExtraDetections soundings) in one
+        read, decoded with a single np.frombuffer using mrz_sounding_dtype.  Same fields as read_EMdgmMRZ_sounding,
+        but returned as a dictionary of numpy arrays (one entry per sounding) instead of one dictionary per sounding.
+
+        Parameters
+        ----------
+        num_soundings
+            number of sounding structs to read, numSoundingsMaxMain + numExtraDetections
+        stride
+            size of each sounding struct in the datagram, rxInfo numBytesPerSounding, defaults to the size of
+            mrz_sounding_dtype
+
+        Returns
+        -------
+        dict
+            dictionary of field name: numpy array of length num_soundings
+        """
+
+        if stride is None or stride == mrz_sounding_dtype.itemsize:
+            stride = mrz_sounding_dtype.itemsize
+            sounding_dtype = mrz_sounding_dtype
+        else:  # raises CorruptPacketError if the stride is too short for the sounding struct
+            sounding_dtype = _partial_dtype(mrz_sounding_dtype, mrz_sounding_dtype.names, stride)
+        buffer = self.FID.read(num_soundings * stride)
+        if len(buffer) != num_soundings * stride:
+            raise CorruptPacketError(f"Corrupt packet: #MRZ sounding block truncated at {self.FID.tell()}")
+        soundings = np.frombuffer(buffer, dtype=sounding_dtype, count=num_soundings)
+        return {ky: soundings[ky] for ky in mrz_sounding_dtype.names}
+
+    def read_EMdgmMRZ(self, vectorized: bool = False):
         """ http://www3.mbari.org/products/mbsystem/formatdoc/KongsbergKmall/EMdgmFormat_RevH/html/structEMdgmMRZ__def.html
         A method to read a full #MRZ datagram.
         Kongsberg documentation: "The datagram also contains seabed image data. Depths points (x,y,z) are calculated
@@ -913,6 +1602,9 @@ class kmall():
         :return: A dictionary including full MRZ datagram information including EMdgmHeader ('header'), EMdgmMpartition
         ('Mpart'), EMdgmbody ('Mbody'), EMdgmMRZ_pingInfo ('pingInfo'), EMdgmMRZ_txSectorInfo ('txSectorInfo'),
         EMdgmMRZ_rxInfo ('rxinfo'), EMdgmMRZ_sounding ('soundings'), and ('SIsample_desidB').
+
+        If vectorized is True, the soundings are decoded with read_EMdgmMRZ_sounding_block, so 'sounding' is a dict of
+        numpy arrays and 'SIsample_desidB' is an int16 numpy array.  Otherwise 'sounding' is a dict of lists.
         """
         # LMD tested.
 
@@ -940,16 +1632,22 @@ class kmall():
         dg['extraDetClassInfo'] = self.listofdicts2dictoflists(extraDetClassInfo)
 
         # Read the sounding data.
-        soundings = []
-        Nseabedimage_samples = 0
-        for record in range(dg['rxInfo']['numExtraDetections'] +
-                            dg['rxInfo']['numSoundingsMaxMain']):
-            soundings.append(self.read_EMdgmMRZ_sounding())
-            num_samples = soundings[record]['SInumSamples']
-            Nseabedimage_samples += num_samples
-            if num_samples > 32768:  # in a corrupted file, this can be a large positive - just guessing that there is a limit
+        num_soundings = dg['rxInfo']['numExtraDetections'] + dg['rxInfo']['numSoundingsMaxMain']
+        if vectorized:
+            dg['sounding'] = self.read_EMdgmMRZ_sounding_block(num_soundings, dg['rxInfo']['numBytesPerSounding'])
+            if (dg['sounding']['SInumSamples'] > 32768).any():  # see below
                 raise CorruptPacketError(f"Corrupt packet: #MRZ at {start}")
-        dg['sounding'] = self.listofdicts2dictoflists(soundings)
+            Nseabedimage_samples = int(dg['sounding']['SInumSamples'].sum())
+        else:
+            soundings = []
+            Nseabedimage_samples = 0
+            for record in range(num_soundings):
+                soundings.append(self.read_EMdgmMRZ_sounding())
+                num_samples = soundings[record]['SInumSamples']
+                Nseabedimage_samples += num_samples
+                if num_samples > 32768:  # in a corrupted file, this can be a large positive - just guessing that there is a limit
+                    raise CorruptPacketError(f"Corrupt packet: #MRZ at {start}")
+            dg['sounding'] = self.listofdicts2dictoflists(soundings)
 
         # Read the seabed imagery.
         # Seabed image sample amplitude, in 0.1 dB. Actual number of seabed image samples (SIsample_desidB) to be found
@@ -960,7 +1658,10 @@ class kmall():
         # as used for reflectivity2_dB (struct EMdgmMRZ_sounding_def).
         format_to_unpack = str(Nseabedimage_samples) + "h"
 
-        dg['SIsample_desidB'] = struct.unpack(format_to_unpack, self.FID.read(struct.Struct(format_to_unpack).size))
+        if vectorized:
+            dg['SIsample_desidB'] = np.frombuffer(self.FID.read(struct.Struct(format_to_unpack).size), dtype='<i2')
+        else:
+            dg['SIsample_desidB'] = struct.unpack(format_to_unpack, self.FID.read(struct.Struct(format_to_unpack).size))
 
         # Seek to end of the packet.
         self.FID.seek(start + dg['header']['numBytesDgm'], 0)
@@ -1150,9 +1851,80 @@ class kmall():
 
         return dg
 
-    def read_EMdgmMWC(self):
+    def read_EMdgmMWCrxBeamData_block(self, rxInfo: dict, numbytes: int):
+        """
+        Read #MWC - data block 2 for all beams at once.  The rest of the datagram (numbytes) is read in one call, the
+        beam headers are decoded with mwc_beam_dtype and the samples are gathered into padded 2d arrays with numpy,
+        instead of one struct.unpack per beam as in read_EMdgmMWCrxBeamData/read_EMdgmMWCrxBeamPhase1/2.
+
+        Parameters
+        ----------
+        rxInfo
+            the EMdgmMWCrxInfo dict for this datagram, see read_EMdgmMWCrxInfo
+        numbytes
+            number of bytes from the current position to the end of the beam data
+
+        Returns
+        -------
+        dict
+            'beamData', dict of the beam header fields as numpy arrays (one entry per beam), with 'sampleAmplitude05dB_p'
+            an int8 (beams, max numSampleData) array padded with mwc_amplitude_fill
+        dict
+            'phaseInfo', {'rxBeamPhase': (beams, max numSampleData) array}, int8 if phaseFlag is 1, int16 if phaseFlag
+            is 2, padded with 0.  None if phaseFlag is 0
+        """
+
+        buffer = self.FID.read(numbytes)
+        if len(buffer) != numbytes:
+            raise CorruptPacketError(f"Corrupt packet: #MWC beam data truncated at {self.FID.tell()}")
+        numbeams = rxInfo['numBeams']
+        phase_size = {0: 0, 1: 1, 2: 2}.get(rxInfo['phaseFlag'], None)
+        if phase_size is None:
+            raise CorruptPacketError(f"Corrupt packet: #MWC with phaseFlag={rxInfo['phaseFlag']} at {self.FID.tell()}")
+        # beam entries are variable length, walk the numSampleData fields to get the start of each beam
+        entry_size = rxInfo['numBytesPerBeamEntry']
+        numsamples_offset = mwc_beam_dtype.fields['numSampleData'][1]
+        beam_offsets = np.zeros(numbeams, dtype=np.int64)
+        offset = 0
+        for idx in range(numbeams):
+            if offset + entry_size > numbytes:
+                raise CorruptPacketError(f"Corrupt packet: #MWC beam data truncated at {self.FID.tell()}")
+            beam_offsets[idx] = offset
+            offset += entry_size + struct.unpack_from('<H', buffer, offset + numsamples_offset)[0] * (1 + phase_size)
+        if offset > numbytes:
+            raise CorruptPacketError(f"Corrupt packet: #MWC beam data truncated at {self.FID.tell()}")
+
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        headers = data[beam_offsets[:, None] + np.arange(mwc_beam_dtype.itemsize)].view(mwc_beam_dtype)[:, 0]
+        beamdata = {ky: headers[ky] for ky in mwc_beam_dtype.names}
+
+        numsamples = headers['numSampleData'].astype(np.int64)
+        maxsamples = int(numsamples.max()) if numbeams else 0
+        sample_idx = np.arange(maxsamples)
+        valid = sample_idx[None, :] < numsamples[:, None]
+        amp_start = beam_offsets + entry_size
+        amplitude = np.full((numbeams, maxsamples), mwc_amplitude_fill, dtype=np.int8)
+        amplitude[valid] = data[(amp_start[:, None] + sample_idx[None, :])[valid]].view(np.int8)
+        beamdata['sampleAmplitude05dB_p'] = amplitude
+
+        phaseinfo = None
+        if phase_size:
+            phase_start = amp_start + numsamples
+            phase_dtype = np.int8 if phase_size == 1 else np.dtype('<i2')
+            phase_idx = (phase_start[:, None] + sample_idx[None, :] * phase_size)[valid]
+            phase_bytes = data[phase_idx[:, None] + np.arange(phase_size)]
+            phase = np.zeros((numbeams, maxsamples), dtype=phase_dtype)
+            phase[valid] = phase_bytes.view(phase_dtype)[:, 0]
+            phaseinfo = {'rxBeamPhase': phase}
+        return beamdata, phaseinfo
+
+    def read_EMdgmMWC(self, vectorized: bool = False):
         """
         Read #MWC - Multibeam Water Column Datagram. Entire datagram containing several sub structs.
+
+        If vectorized is True, the beam data is decoded with read_EMdgmMWCrxBeamData_block, so 'beamData' is a dict of
+        numpy arrays with 'sampleAmplitude05dB_p' as a padded (beams, samples) int8 array, and 'phaseInfo' (if present)
+        holds a padded (beams, samples) 'rxBeamPhase' array.  Otherwise these are lists of tuples, one per beam.
         :return: A dictionary containing EMdgmMWC.
         """
         # LMD added, partially tested.
@@ -1189,6 +1961,14 @@ class kmall():
                                     + numSampleData * size(EMdgmMWCrxBeamPhase2_def)
         '''
 
+        if vectorized:
+            numbytes = start + dg['header']['numBytesDgm'] - 4 - self.FID.tell()
+            dg['beamData'], phaseinfo = self.read_EMdgmMWCrxBeamData_block(dg['rxInfo'], numbytes)
+            if phaseinfo is not None:
+                dg['phaseInfo'] = phaseinfo
+            self.FID.seek(start + dg['header']['numBytesDgm'], 0)
+            return dg
+
         rxBeamData = []
         rxPhaseInfo = []
         for idx in range(dg['rxInfo']['numBeams']):
@@ -1517,7 +2297,7 @@ class kmall():
         fields = self.FID.read(struct.Struct(format_to_unpack).size)
 
         # KMB
-        dg['dgmType'] = fields.decode('utf-8')
+        dg['dgmType'] = bytes(fields).decode('utf-8')
 
         format_to_unpack = "2H3I"
         fields = struct.unpack(format_to_unpack, self.FID.read(struct.Struct(format_to_unpack).size))
@@ -1631,7 +2411,52 @@ class kmall():
 
         return dg
 
-    def read_EMdgmSKM(self):
+    def read_EMdgmSKMsample_block(self, dgInfo: dict):
+        """
+        Read #SKM - all samples of the datagram in one read, decoded with a single np.frombuffer using
+        skm_sample_dtype.  Same fields as read_EMdgmSKMsample, but as numpy arrays (one entry per sample) instead of
+        lists, and 'datetime' is a datetime64[ns] array instead of a list of datetime objects.
+
+        Parameters
+        ----------
+        dgInfo
+            A dictionary containing EMdgmSKMinfo (output of function read_EMdgmSKMinfo)
+
+        Returns
+        -------
+        dict
+            dict with 'KMdefault' and 'delayedHeave' dicts of field name: numpy array
+        """
+
+        numsamples = dgInfo['numSamplesArray']
+        # KMbinary + delayed heave is numBytesPerSample long, read_EMdgmSKMsample assumes they follow each other
+        stride = max(dgInfo['numBytesPerSample'], skm_sample_dtype.itemsize)
+        buffer = self.FID.read(numsamples * stride)
+        if len(buffer) != numsamples * stride:
+            raise CorruptPacketError(f"Corrupt packet: #SKM samples truncated at {self.FID.tell()}")
+        if stride == skm_sample_dtype.itemsize:
+            sample_dtype = skm_sample_dtype
+        else:
+            sample_dtype = _partial_dtype(skm_sample_dtype, skm_sample_dtype.names, stride)
+        samples = np.frombuffer(buffer, dtype=sample_dtype, count=numsamples)
+
+        kmdefault = {}
+        for ky in [nm for nm in skm_sample_dtype.names if not nm.startswith('delayedHeave')]:
+            if ky == 'dgmType':
+                kmdefault[ky] = samples[ky].astype(str)
+            else:
+                kmdefault[ky] = samples[ky]
+            if ky == 'time_nanosec':
+                kmdefault['dgtime'] = samples['time_sec'] + samples['time_nanosec'] / 1.0E9
+                kmdefault['datetime'] = (samples['time_sec'].astype(np.int64) * 1000000000 +
+                                         samples['time_nanosec']).astype('datetime64[ns]')
+        delayedheave = {'time_sec': samples['delayedHeave_time_sec'], 'time_nanosec': samples['delayedHeave_time_nanosec'],
+                        'datetime': (samples['delayedHeave_time_sec'].astype(np.int64) * 1000000000 +
+                                     samples['delayedHeave_time_nanosec']).astype('datetime64[ns]'),
+                        'delayedHeave_m': samples['delayedHeave_m']}
+        return {'KMdefault': kmdefault, 'delayedHeave': delayedheave}
+
+    def read_EMdgmSKM(self, vectorized: bool = False):
         """
         Read #SKM - data from attitude and attitude velocity sensors. Datagram may contain several sensor measurements.
         The number of samples in datagram is listed in numSamplesArray in the struct EMdgmSKMinfo_def. Time given in
@@ -1639,6 +2464,9 @@ class kmall():
         the sensors data. If input is other than KM binary sensor input format, the data are converted to the KM binary
         format by the PU. All parameters are uncorrected. For processing of data, installation offsets, installation
         angles and attitude values are needed to correct the data for motion.
+
+        If vectorized is True, the samples are decoded with read_EMdgmSKMsample_block, so 'sample' holds dicts of numpy
+        arrays instead of lists.
         :return: A dictionary containing EMdgmSKM.
         """
         # LMD tested.
@@ -1650,7 +2478,10 @@ class kmall():
 
         dg['header'] = self.read_EMdgmHeader()
         dg['infoPart'] = self.read_EMdgmSKMinfo()
-        dg['sample'] = self.read_EMdgmSKMsample(dg['infoPart'])
+        if vectorized:
+            dg['sample'] = self.read_EMdgmSKMsample_block(dg['infoPart'])
+        else:
+            dg['sample'] = self.read_EMdgmSKMsample(dg['infoPart'])
 
         # VES implementation:
         '''
@@ -2429,59 +3260,11 @@ class kmall():
     # Routines for writing and reading custom compressed packets
     ###############################################################
 
-    def compressSoundings(self, dg):
-        ''' A method to compress the soundings table by column rather than by row.'''
-        record = len(dg['soundingIndex'])
-        format_to_pack = "1H8B1H6f2H18f4H"
-
-        buffer = struct.pack(str(record) + "H", *dg['soundingIndex'])
-
-        buffer += struct.pack(str(record) + "B", *dg['txSectorNumb'])
-        buffer += struct.pack(str(record) + "B", *dg['detectionType'])
-        buffer += struct.pack(str(record) + "B", *dg['detectionMethod'])
-        buffer += struct.pack(str(record) + "B", *dg['rejectionInfo1'])
-        buffer += struct.pack(str(record) + "B", *dg['rejectionInfo2'])
-        buffer += struct.pack(str(record) + "B", *dg['postProcessingInfo'])
-        buffer += struct.pack(str(record) + "B", *dg['detectionClass'])
-        buffer += struct.pack(str(record) + "B", *dg['detectionConfidenceLevel'])
-
-        buffer += struct.pack(str(record) + "H", *dg['padding'])
-
-        buffer += struct.pack(str(record) + "f", *dg['rangeFactor'])
-        buffer += struct.pack(str(record) + "f", *dg['qualityFactor'])
-        buffer += struct.pack(str(record) + "f", *dg['detectionUncertaintyVer_m'])
-        buffer += struct.pack(str(record) + "f", *dg['detectionUncertaintyHor_m'])
-        buffer += struct.pack(str(record) + "f", *dg['detectionWindowLength_sec'])
-        buffer += struct.pack(str(record) + "f", *dg['echoLength_sec'])
-
-        buffer += struct.pack(str(record) + "H", *dg['WCBeamNumb'])
-        buffer += struct.pack(str(record) + "H", *dg['WCrange_samples'])
-
-        buffer += struct.pack(str(record) + "f", *dg['WCNomBeamAngleAcross_deg'])
-        buffer += struct.pack(str(record) + "f", *dg['meanAbsCoeff_dbPerkm'])
-        buffer += struct.pack(str(record) + "f", *dg['reflectivity1_dB'])
-        buffer += struct.pack(str(record) + "f", *dg['reflectivity2_dB'])
-        buffer += struct.pack(str(record) + "f", *dg['receiverSensitivityApplied_dB'])
-        buffer += struct.pack(str(record) + "f", *dg['sourceLevelApplied_dB'])
-        buffer += struct.pack(str(record) + "f", *dg['BScalibration_dB'])
-        buffer += struct.pack(str(record) + "f", *dg['TVG_dB'])
-        buffer += struct.pack(str(record) + "f", *dg['beamAngleReRx_deg'])
-        buffer += struct.pack(str(record) + "f", *dg['beamAngleCorrection_deg'])
-        buffer += struct.pack(str(record) + "f", *dg['twoWayTravelTime_sec'])
-        buffer += struct.pack(str(record) + "f", *dg['twoWayTravelTimeCorrection_sec'])
-        buffer += struct.pack(str(record) + "f", *dg['deltaLatitude_deg'])
-        buffer += struct.pack(str(record) + "f", *dg['deltaLongitude_deg'])
-        buffer += struct.pack(str(record) + "f", *dg['z_reRefPoint_m'])
-        buffer += struct.pack(str(record) + "f", *dg['y_reRefPoint_m'])
-        buffer += struct.pack(str(record) + "f", *dg['x_reRefPoint_m'])
-        buffer += struct.pack(str(record) + "f", *dg['beamIncAngleAdj_deg'])
-
-        buffer += struct.pack(str(record) + "H", *dg['realTimeCleanInfo'])
-        buffer += struct.pack(str(record) + "H", *dg['SIstartRange_samples'])
-        buffer += struct.pack(str(record) + "H", *dg['SIcentreSample'])
-        buffer += struct.pack(str(record) + "H", *dg['SInumSamples'])
-
-        return bz2.compress(buffer)
+    def compressSoundings(self, dg, codec: str = None):
+        ''' A method to compress the soundings table by column rather than by row.
+        codec: one of sounding_codecs, default_sounding_codec if None.'''
+        buffer = b''.join(np.asarray(dg[name], dtype=fmt).tobytes() for name, fmt in compressed_sounding_columns)
+        return _compress_block(buffer, codec)
 
     def encodeArrayIntoUintX(self, A, res):
         ''' Differential encoding of an array of values into a byte array
@@ -2566,17 +3349,8 @@ class kmall():
 
         tmp = (((valuesToEncode - minv) * scaleFactor)).astype(int)
 
-        # This bullshit gets around an apparant bug in the struct module.
-        if isinstance(A[0], np.ndarray):
-            tmp2 = A[0].tolist()
-        else:
-            tmp2 = A[0]
-
-        if isinstance(tmp2, np.int64) or isinstance(tmp2, np.float64):
-            buffer = struct.pack('f', tmp2)
-        else:
-            buffer = struct.pack('f', tmp2[0])
-        # buffer = struct.pack('f',float(A[0][0]))
+        # first value of the (flattened) array, as a python float for any input dtype
+        buffer = struct.pack('f', float(np.ravel(A)[0]))
 
         N = len(tmp)
         buffer += struct.pack('f', minv)
@@ -2590,12 +3364,7 @@ class kmall():
             buffer += struct.pack('i', N)
         buffer += struct.pack('B', bits)
 
-        if bits == 8:
-            buffer += struct.pack(str(N) + 'B', *tmp)
-        if bits == 16:
-            buffer += struct.pack(str(N) + 'H', *tmp)
-        if bits == 32:
-            buffer += struct.pack(str(N) + 'I', *tmp)
+        buffer += tmp.astype({8: 'B', 16: 'H', 32: 'I'}[bits]).tobytes()
 
         return buffer
 
@@ -2617,43 +3386,19 @@ class kmall():
 
         bits = fields[4]
 
-        if bits == 8:
-            dA = struct.unpack(str(N) + 'B', buffer[17:(17 + N)])
-            bytesDecoded = 17 + N
-        elif bits == 16:
-            dA = struct.unpack(str(N) + 'H', buffer[17:(17 + N * 2)])
-            bytesDecoded = 17 + (N * 2)
-        elif bits == 32:
-            dA = struct.unpack(str(N) + 'I', buffer[17:(17 + N * 4)])
-            bytesDecoded = 17 + (N * 4)
+        maxbits = {8: 255.0, 16: 65535.0, 32: 4294967295.0}[bits]
+        dA = np.frombuffer(buffer, dtype={8: 'B', 16: 'H', 32: 'I'}[bits], count=N, offset=17)
+        bytesDecoded = 17 + dA.nbytes
 
+        orig = np.empty(N + 1, dtype=np.float64)
+        orig[0] = A0
+        orig[1:] = dA * (maxv - minv) / maxbits + minv
         if differentialDecode:
-            if bits == 8:
-                orig = np.cumsum(
-                    [A0] + list((np.array([float(x) for x in dA]) * (maxv - minv) / 255.0) + minv)).tolist()
-            elif bits == 16:
-                orig = np.cumsum(
-                    [A0] + list((np.array([float(x) for x in dA]) * (maxv - minv) / 65535.0) + minv)).tolist()
-            else:
-                orig = np.cumsum(
-                    [A0] + list((np.array([float(x) for x in dA]) * (maxv - minv) / 4294967295.0) + minv)).tolist()
-        else:
-            if bits == 8:
-                orig = [A0] + list((np.array([float(x) for x in dA]) * (maxv - minv) / 255.0) + minv)
-            elif bits == 16:
-                orig = [A0] + list((np.array([float(x) for x in dA]) * (maxv - minv) / 65535.0) + minv)
-            else:
-                orig = [A0] + list((np.array([float(x) for x in dA]) * (maxv - minv) / 4294967295.0) + minv)
-
-                # print(A0)
-            # print(minv)
-            # print(maxv)
-            # print(N)
-            # print(bits)
+            orig = np.cumsum(orig)
 
         return (orig, bytesDecoded)
 
-    def encodeAndCompressSoundings(self, dg):
+    def encodeAndCompressSoundings(self, dg, codec: str = None):
         ''' A method to differential-encode and compress the soundings table.
 
         Float values are encoded in this way
@@ -2671,11 +3416,11 @@ class kmall():
         summed and the errors that result can be larger than the
         "res" value. Some experimentation is required to ensure
         sufficient bits are used to reduce the desired error.
-        '''
 
-        record = len(dg['soundingIndex'])
+        codec: one of sounding_codecs, default_sounding_codec if None.
+        '''
 
-        buffer = struct.pack(str(record) + "H", *dg['soundingIndex'])
+        buffer = np.asarray(dg['soundingIndex'], dtype='H').tobytes()
 
         ## The following optimization has almost no effect
         ## because of the compressoin applied to the
@@ -2695,7 +3440,7 @@ class kmall():
         tmp = (np.array(dg['detectionType']) * 100. +
                np.array(dg['detectionMethod']) * 10. +
                np.array(dg['txSectorNumb'])).astype(int)
-        buffer += struct.pack(str(record) + "B", *tmp)
+        buffer += tmp.astype('B').tobytes()
         # I don't think there's any way to tell with no ambiguity
         # when decoding if they were packed or not. For example,
         # if there were just one tx sector, and only normal type
@@ -2707,11 +3452,8 @@ class kmall():
         # buffer += struct.pack(str(record)+"B", *dg['detectionType'])
         # buffer += struct.pack(str(record)+"B", *dg['detectionMethod'])
 
-        buffer += struct.pack(str(record) + "B", *dg['rejectionInfo1'])
-        buffer += struct.pack(str(record) + "B", *dg['rejectionInfo2'])
-        buffer += struct.pack(str(record) + "B", *dg['postProcessingInfo'])
-        buffer += struct.pack(str(record) + "B", *dg['detectionClass'])
-        buffer += struct.pack(str(record) + "B", *dg['detectionConfidenceLevel'])
+        for name in ['rejectionInfo1', 'rejectionInfo2', 'postProcessingInfo', 'detectionClass', 'detectionConfidenceLevel']:
+            buffer += np.asarray(dg[name], dtype='B').tobytes()
 
         # No point in carrying along the padding field. It's for byte alignment
         # but we've already reorganized the data. so we can omit it
@@ -2724,8 +3466,8 @@ class kmall():
         buffer += self.encodeArrayIntoUintX(dg['detectionWindowLength_sec'], .001)
         buffer += self.encodeArrayIntoUintX(dg['echoLength_sec'], .001)
 
-        buffer += struct.pack(str(record) + "H", *dg['WCBeamNumb'])
-        buffer += struct.pack(str(record) + "H", *dg['WCrange_samples'])
+        buffer += np.asarray(dg['WCBeamNumb'], dtype='H').tobytes()
+        buffer += np.asarray(dg['WCrange_samples'], dtype='H').tobytes()
         buffer += self.encodeArrayIntoUintX(dg['WCNomBeamAngleAcross_deg'], .001)
 
         # meanAbsCoeff_dbPerkm is a single value per transmit sector. No point in
@@ -2734,7 +3476,7 @@ class kmall():
         _, idx = np.unique(dg['txSectorNumb'], return_index=True)
         # Encoding as ushort's in .01's of a dB.
         vals = np.round(np.array(dg['meanAbsCoeff_dbPerkm'])[np.sort(idx)] * 100).astype(int)
-        buffer += struct.pack(str(len(idx)) + "H", *vals)
+        buffer += vals.astype('H').tobytes()
 
         # Reflectivity1_dB values get -100 when the detect is invalid
         # and reflectivity2_dB get any of several values thare are
@@ -2747,27 +3489,16 @@ class kmall():
         # The values are rounded to 2 decimal places first because
         # they are floats and the chances that any two floats are
         # the same is quite small.
-        dg['reflectivity1_dB'] = np.round(dg['reflectivity1_dB'], decimals=2)
-
-        # This wizardry calculates the mode (most frequent value)
-        # of the reflectivity values associated with valid detects.
-        reflectivity_mode = stats.mode([y for x, y in
-                                        zip(dg['detectionMethod'], dg['reflectivity1_dB'])
-                                        if x != 0])[0][0]
-        # Replace all the non-detects with the mode.
-        dg['reflectivity1_dB'] = [y if x != 0 else reflectivity_mode
-                                  for x, y in
-                                  zip(dg['detectionMethod'], dg['reflectivity1_dB'])]
-
-        # Do the same with reflectiivty2.
-        dg['reflectivity2_dB'] = np.round(dg['reflectivity2_dB'], decimals=2)
-        reflectivity_mode = stats.mode([y for x, y in
-                                        zip(dg['detectionMethod'], dg['reflectivity2_dB'])
-                                        if x != 0])[0][0]
-        # Replace all the non-detects with the mode.
-        dg['reflectivity2_dB'] = [y if x != 0 else reflectivity_mode
-                                  for x, y in
-                                  zip(dg['detectionMethod'], dg['reflectivity2_dB'])]
+        # Calculate the mode (most frequent value, the smallest of them if
+        # there are several) of the reflectivity values associated with
+        # valid detects and replace all the non-detects with it.  Do the
+        # same with reflectivity2.
+        valid_detect = np.asarray(dg['detectionMethod']) != 0
+        for name in ['reflectivity1_dB', 'reflectivity2_dB']:
+            dg[name] = np.round(dg[name], decimals=2)
+            if valid_detect.any():
+                values, counts = np.unique(dg[name][valid_detect], return_counts=True)
+                dg[name] = np.where(valid_detect, dg[name], values[np.argmax(counts)])
 
         buffer += self.encodeArrayIntoUintX(dg['reflectivity1_dB'], .1)
         buffer += self.encodeArrayIntoUintX(dg['reflectivity2_dB'], .001)
@@ -2789,144 +3520,87 @@ class kmall():
         # realTimeCleanInfo is for future use. So we can omit it for now.
         # buffer += struct.pack(str(record)+"H", *dg['realTimeCleanInfo'])
 
-        buffer += struct.pack(str(record) + "H", *dg['SIstartRange_samples'])
-        buffer += struct.pack(str(record) + "H", *dg['SIcentreSample'])
-        buffer += struct.pack(str(record) + "H", *dg['SInumSamples'])
+        for name in ['SIstartRange_samples', 'SIcentreSample', 'SInumSamples']:
+            buffer += np.asarray(dg[name], dtype='H').tobytes()
 
-        return bz2.compress(buffer)
+        return _compress_block(buffer, codec)
 
     def expandAndDecodeSoundings(self, buffer, records):
         ''' When the soundings datagram is differential-encoded and compressed, this method reverses it on reading.
-        buffer:  bytes object containing the compressed data.
+        buffer:  bytes object containing the compressed data, with any of sounding_codecs.
         records: Number of soundings encoded in the block.
-        returns: dg['sounding'] containing dictionary of lists of sounding record fields.
+        returns: dg['sounding'] containing dictionary of numpy arrays of sounding record fields.
         '''
 
-        buffer = bz2.decompress(buffer)
+        # bytearray so that the arrays viewing it are writable, memoryview so that slicing it does not copy
+        buffer = memoryview(bytearray(_decompress_block(buffer)))
         dg = {}
         ptr = 0
-        dg['soundingIndex'] = struct.unpack(str(records) + "H", buffer[0:(records * 2)])
-        ptr += (records * 2)
 
-        tmp = np.array(struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)]))
-        ptr += records
+        def unpack_column(fmt):
+            nonlocal ptr
+            column = np.frombuffer(buffer, dtype=fmt, count=records, offset=ptr)
+            ptr += column.nbytes
+            return column
+
+        def decode_column():
+            nonlocal ptr
+            column, bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
+            ptr += bytesDecoded
+            return column
+
+        dg['soundingIndex'] = unpack_column('H')
+
+        tmp = unpack_column('B').astype(int)
         dg['detectionType'] = np.round(tmp / 100.).astype(int)
         dg['detectionMethod'] = np.round((tmp - dg['detectionType'] * 100) / 10.).astype(int)
         dg['txSectorNumb'] = np.round((tmp - dg['detectionType'] * 100 - dg['detectionMethod'] * 10)).astype(int)
-        dg['detectionType'] = dg['detectionType'].tolist()
-        dg['detectionMethod'] = dg['detectionMethod'].tolist()
-        dg['txSectorNumb'] = dg['txSectorNumb'].tolist()
-        # dg['txSectorNumb'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records )])
-        # ptr += records
-        # dg['detectionType'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        # ptr += records
-        # dg['detectionMethod'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        # ptr += records
-        dg['rejectionInfo1'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        ptr += records
-        dg['rejectionInfo2'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        ptr += records
-        dg['postProcessingInfo'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        ptr += records
-        dg['detectionClass'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        ptr += records
-        dg['detectionConfidenceLevel'] = struct.unpack(str(records) + "B", buffer[ptr:(ptr + records)])
-        ptr += records
+        for name in ['rejectionInfo1', 'rejectionInfo2', 'postProcessingInfo', 'detectionClass', 'detectionConfidenceLevel']:
+            dg[name] = unpack_column('B')
 
         # The padding data is not encoded, so we just generate 0's for it here.
-        dg['padding'] = list(np.zeros(shape=len(dg['soundingIndex'])).astype(int))
-
-        dg['rangeFactor'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['qualityFactor'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['detectionUncertaintyVer_m'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['detectionUncertaintyHor_m'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['detectionWindowLength_sec'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['echoLength_sec'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-
-        dg['WCBeamNumb'] = struct.unpack(str(records) + "H", buffer[ptr:(ptr + (records * 2))])
-        ptr += (records * 2)
-        dg['WCrange_samples'] = struct.unpack(str(records) + "H", buffer[ptr:(ptr + (records * 2))])
-        ptr += (records * 2)
-
-        dg['WCNomBeamAngleAcross_deg'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
+        dg['padding'] = np.zeros(records, dtype=int)
+
+        for name in ['rangeFactor', 'qualityFactor', 'detectionUncertaintyVer_m', 'detectionUncertaintyHor_m',
+                     'detectionWindowLength_sec', 'echoLength_sec']:
+            dg[name] = decode_column()
+
+        dg['WCBeamNumb'] = unpack_column('H')
+        dg['WCrange_samples'] = unpack_column('H')
+
+        dg['WCNomBeamAngleAcross_deg'] = decode_column()
 
         # meanAbsCoeff_dbPerkm is a single value for each transmit sector.
         # And we've only encodeied one for each as ushorts in 0.01 dB.
         # So we extract these.
         Nsectors = len(np.unique(dg['txSectorNumb']))
-        values = np.array(struct.unpack(str(Nsectors) + "H", buffer[ptr:(ptr + (Nsectors * 2))])) / 100.0
+        values = np.frombuffer(buffer, dtype='H', count=Nsectors, offset=ptr) / 100.0
         ptr += (Nsectors * 2)
         # Then assign them to each sector.
-        tmp = np.zeros(shape=len(dg['soundingIndex']))
+        tmp = np.zeros(shape=records)
         for sectoridx in np.unique(dg['txSectorNumb']):
             tmp[dg['txSectorNumb'] == sectoridx] = values[sectoridx]
-        dg['meanAbsCoeff_dbPerkm'] = tmp.tolist()
+        dg['meanAbsCoeff_dbPerkm'] = tmp
 
-        dg['reflectivity1_dB'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        # Reset values for no-detect values that were modified to
-        # improve compression.
-        dg['reflectivity1_dB'] = [-100. if x == 0 else y
-                                  for x, y in
-                                  zip(dg['detectionMethod'], dg['reflectivity1_dB'])]
-
-        dg['reflectivity2_dB'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
         # Reset values for no-detect values that were modified to
         # improve compression. Note this makes a suble if inconsequential
         # change to the file, as the values in reflectivity2_dB for
         # failed detections are not -100. They are not uniform in value
         # and so cannot be replaced exactly here. But since these
         # are for non-detects it should not matter to anyone. (I hope)
-        dg['reflectivity2_dB'] = [-100. if x == 0 else y
-                                  for x, y in
-                                  zip(dg['detectionMethod'], dg['reflectivity2_dB'])]
-
-        dg['receiverSensitivityApplied_dB'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['sourceLevelApplied_dB'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['BScalibration_dB'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['TVG_dB'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['beamAngleReRx_deg'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['beamAngleCorrection_deg'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['twoWayTravelTime_sec'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['twoWayTravelTimeCorrection_sec'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['deltaLatitude_deg'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['deltaLongitude_deg'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['z_reRefPoint_m'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['y_reRefPoint_m'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['x_reRefPoint_m'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-        dg['beamIncAngleAdj_deg'], bytesDecoded = self.decodeUintXintoArray(buffer[ptr:])
-        ptr += bytesDecoded
-
-        # dg['realTimeCleanInfo'] = struct.unpack(str(records) + "H", buffer[ptr:(ptr + (records * 2))])
-        # ptr += (records * 2)
-        dg['realTimeCleanInfo'] = list(np.zeros(shape=len(dg['soundingIndex'])).astype(int))
-        dg['SIstartRange_samples'] = struct.unpack(str(records) + "H", buffer[ptr:(ptr + (records * 2))])
-        ptr += (records * 2)
-        dg['SIcentreSample'] = struct.unpack(str(records) + "H", buffer[ptr:(ptr + (records * 2))])
-        ptr += (records * 2)
-        dg['SInumSamples'] = struct.unpack(str(records) + "H", buffer[ptr:(ptr + (records * 2))])
-        ptr += (records * 2)
+        dg['reflectivity1_dB'] = np.where(dg['detectionMethod'] == 0, -100., decode_column())
+        dg['reflectivity2_dB'] = np.where(dg['detectionMethod'] == 0, -100., decode_column())
+
+        for name in ['receiverSensitivityApplied_dB', 'sourceLevelApplied_dB', 'BScalibration_dB', 'TVG_dB',
+                     'beamAngleReRx_deg', 'beamAngleCorrection_deg', 'twoWayTravelTime_sec',
+                     'twoWayTravelTimeCorrection_sec', 'deltaLatitude_deg', 'deltaLongitude_deg', 'z_reRefPoint_m',
+                     'y_reRefPoint_m', 'x_reRefPoint_m', 'beamIncAngleAdj_deg']:
+            dg[name] = decode_column()
+
+        # realTimeCleanInfo is not encoded (for future use), zeros here.
+        dg['realTimeCleanInfo'] = np.zeros(records, dtype=int)
+        for name in ['SIstartRange_samples', 'SIcentreSample', 'SInumSamples']:
+            dg[name] = unpack_column('H')
 
         return dg
 
@@ -2938,22 +3612,23 @@ class kmall():
         self.FID.write(buffer)
         return
 
-    def encodeAndCompressImagery(self, dg):
-        ''' A method to encode and compress the imagery data.'''
+    def encodeAndCompressImagery(self, dg, codec: str = None):
+        ''' A method to encode and compress the imagery data.
+        codec: one of sounding_codecs, default_sounding_codec if None.'''
         buffer = self.encodeArrayIntoUintX(np.array(dg['SIsample_desidB']), .1)
-        return bz2.compress(buffer)
+        return _compress_block(buffer, codec)
 
     def decodeAndDecompresssImagery(self, buffer, Nseabedimage_samples):
-        format_to_unpack = str(Nseabedimage_samples) + "h"
-        return self.decodeUintXintoArray(bz2.decompress(buffer))
+        return self.decodeUintXintoArray(_decompress_block(buffer))
 
     def write_EncodedCompressedImagery(self, buffer):
         ''' A method to write the encoded compressed imagery'''
         self.FID.write(struct.pack("I", len(buffer)))
         self.FID.write(buffer)
 
-    def write_EMdgmCZ0(self, dg):
-        ''' A method to write an MRZ datagram back to disk, but omitting the imagery data.'''
+    def write_EMdgmCZ0(self, dg, codec: str = None):
+        ''' A method to write an MRZ datagram back to disk, encoding and compressing the soundings and imagery data.
+        codec: one of sounding_codecs, default_sounding_codec if None.'''
 
         # First we need to see how much space the imagery data will take.
         # And set the number of imagery samples per sounding field to zero.
@@ -2970,9 +3645,9 @@ class kmall():
         # And we need to create a new MRZ packet type to hold compressed data.
         dg['header']['dgmType'] = b'#CZ0'
 
-        imageryBuffer = self.encodeAndCompressImagery(dg)
+        imageryBuffer = self.encodeAndCompressImagery(dg, codec)
 
-        soundingsBuffer = self.encodeAndCompressSoundings(dg['sounding'])
+        soundingsBuffer = self.encodeAndCompressSoundings(dg['sounding'], codec)
 
         # Reduce the datagram size by the difference in size of the
         # original and compressed sounding data, including the size
@@ -3006,9 +3681,10 @@ class kmall():
 
         self.FID.write(struct.pack("I", dg['header']['numBytesDgm']))
 
-    def write_EMdgmCZ1(self, dg):
+    def write_EMdgmCZ1(self, dg, codec: str = None):
         ''' A method to write a new datagram compressing teh soundings and
-        omitting the imagery data.'''
+        omitting the imagery data.
+        codec: one of sounding_codecs, default_sounding_codec if None.'''
 
         # First we need to see how much space the imagery data will take.
         # And set the number of imagery samples per sounding field to zero.
@@ -3025,7 +3701,7 @@ class kmall():
         # And we need to create a new MRZ packet type to hold compressed data.
         dg['header']['dgmType'] = b'#CZ1'
 
-        soundingsBuffer = self.encodeAndCompressSoundings(dg['sounding'])
+        soundingsBuffer = self.encodeAndCompressSoundings(dg['sounding'], codec)
 
         # Reduce the datagram size by the difference in size of the
         # original and compressed sounding data, including the size
@@ -3102,8 +3778,7 @@ class kmall():
         dg['sounding'] = self.expandAndDecodeSoundings(soundingsBuffer,
                                                        Nsoundings)
 
-        for record in range(Nsoundings):
-            Nseabedimage_samples += dg['sounding']['SInumSamples'][record]
+        Nseabedimage_samples = int(np.sum(dg['sounding']['SInumSamples']))
 
         # Read the seabed imagery.
         # Seabed image sample amplitude, in 0.1 dB. Actual number of
@@ -3205,6 +3880,32 @@ class kmall():
         buffer = self.FID.read(bytestoread[0])
         return buffer
 
+    def decode_compressed_pings(self, num_workers: int = None):
+        """
+        Decode all the CZ0/CZ1 datagrams of the file in a thread pool, see read_EMdgmCZ0/read_EMdgmCZ1.  The
+        decompression (all of sounding_codecs) releases the GIL, so the datagrams decode in parallel.  Uses
+        decode_datagram_at, memory map the file (use_mmap=True) to avoid a file handle per datagram.
+
+        Parameters
+        ----------
+        num_workers
+            number of threads to use, defaults to the ThreadPoolExecutor default
+
+        Returns
+        -------
+        list
+            the datagram dict for each CZ0/CZ1 datagram, in file order
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.Index is None:
+            self.index_file()
+        msgtype = np.asarray(self.msgtype, dtype=str)
+        offsets = np.asarray(self.msgoffset, dtype=np.int64)[(msgtype == "b'#CZ0'") | (msgtype == "b'#CZ1'")]
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            return list(pool.map(lambda offset: self.decode_datagram_at(int(offset)), offsets))
+
     ###########################################################
     # Utilities
     ###########################################################
@@ -3223,7 +3924,10 @@ class kmall():
         if self.verbose >= 1:
             print("Opening: %s to read" % filetoopen)
 
-        self.FID = open(filetoopen, "rb")
+        if self.use_mmap:
+            self.FID = MappedKmallFile(filetoopen)
+        else:
+            self.FID = open(filetoopen, "rb")
 
     def OpenFiletoWrite(self, inputfilename=None):
         """ Open a KMALL data file for reading."""
@@ -3252,8 +3956,26 @@ class kmall():
         for k, v in dg.items():
             print("%s:\t\t\t%s\n" % (k, str(v)))
 
-    def index_file(self):
-        """ Index a KMALL file - message type, time, size, byte offset. """
+    def index_file(self, use_sidecar: bool = True, use_mmap: bool = False):
+        """
+        Index a KMALL file - message type, time, size, byte offset.
+
+        Only the 20 byte datagram header is read for each datagram, the datagram body is skipped using the size
+        field, so large datagrams (MWC) are never read.  If use_mmap is True, the file is memory mapped and the
+        headers are decoded all at once with numpy, see _index_headers_mmap.
+
+        If use_sidecar is True, the index is loaded from the sidecar index file written next to the kmall file
+        (see index_sidecar_path) when that sidecar is valid for the current file size and modification time.
+        Otherwise the file is indexed and the sidecar is (re)written for the next time.
+
+        Parameters
+        ----------
+        use_sidecar
+            if True, load/save the index from/to the sidecar file
+        use_mmap
+            if True, index using a memory map of the file instead of file reads, always the case when this object
+            was constructed with use_mmap=True
+        """
 
         if self.FID is None:
             self.OpenFiletoRead()
@@ -3269,66 +3991,107 @@ class kmall():
         if (self.verbose == 1):
             print("Filesize: %d" % self.file_size)
 
-        self.msgoffset = []
-        self.msgsize = []
-        self.msgtime = []
-        self.msgtype = []
-        self.pktcnt = 0
+        self._watercolumn = None  # built from the index, see watercolumn
+        if use_sidecar and self.load_index_sidecar():
+            self._build_index_dataframe()
+            return
 
-        while self.FID.tell() < self.file_size:
+        if use_mmap or self.use_mmap:
+            self._index_headers_mmap()
+        else:
+            self._index_headers()
 
-            try:
-                # Get the byte offset.
-                self.msgoffset.append(self.FID.tell())
+        if self.verbose:
+            for dgm_type, offset, size, tme in zip(self.msgtype, self.msgoffset, self.msgsize, self.msgtime):
+                print("MSG_TYPE: %s,\tOFFSET:%0.0f,\tSIZE: %0.0f,\tTIME: %0.3f" % (dgm_type, offset, size, tme))
 
-                # Read the first four bytes to get the datagram size.
-                msgsize = struct.unpack("I", self.FID.read(4))
-                self.msgsize.append(msgsize[0])
+        self._build_index_dataframe()
+        if use_sidecar:
+            self.save_index_sidecar()
 
-                # Read the datagram.
-                msg_buffer = self.FID.read(int(self.msgsize[self.pktcnt]) - 4)
-            except:
-                print("Error indexing file: %s at byte offset %d" % (self.filename, self.FID.tell()))
+    def _index_headers(self):
+        """
+        Walk the datagrams in the file by reading each 20 byte header and seeking past the body, populating the
+        msgtime/msgoffset/msgsize/msgtype attributes used by index_file.
+        """
 
-                self.msgoffset = self.msgoffset[:-1]
-                self.msgsize = self.msgsize[:-1]
-                self.scanToDatagram()
+        header_struct = struct.Struct('<1I4s2B1H2I')
+        self.msgoffset = []
+        self.msgsize = []
+        self.msgtime = []
+        self.msgtype = []
 
+        offset = 0
+        while offset < self.file_size:
+            self.FID.seek(offset, 0)
+            buffer = self.FID.read(header_struct.size)
+            if len(buffer) < header_struct.size:
+                print("Error indexing file: %s, truncated datagram at byte offset %d" % (self.filename, offset))
+                break
+            msgsize, dgm_type, dgm_version, sysid, emid, sec, nsec = header_struct.unpack(buffer)
+            if msgsize < header_struct.size or dgm_type[0:1] != b'#':
+                print("Error indexing file: %s at byte offset %d" % (self.filename, offset))
+                offset = self.find_next_datagram(offset + 1)
+                if offset is None:
+                    break
                 continue
 
-            # Interpret the header.
-            header_without_length = struct.Struct('ccccBBHII')
-
-            (dgm_type0, dgm_type1, dgm_type2, dgm_type3, dgm_version,
-             sysid, emid,
-             sec,
-             nsec) = header_without_length.unpack_from(msg_buffer, 0)
-
-            dgm_type = dgm_type0 + dgm_type1 + dgm_type2 + dgm_type3
-
+            self.msgoffset.append(offset)
+            self.msgsize.append(msgsize)
             self.msgtype.append(str(dgm_type))
-            # Decode time
-            # osec = sec
-            # osec *= 1E9
-            # osec += nsec
-            # lisec = nanosec
-            # lisec /= 1E6
-
             # Capture the datagram header timestamp.
             self.msgtime.append(sec + nsec / 1.0E9)
-
-            if self.verbose:
-                print("MSG_TYPE: %s,\tOFFSET:%0.0f,\tSIZE: %0.0f,\tTIME: %0.3f" %
-                      (dgm_type,
-                       self.msgoffset[self.pktcnt],
-                       self.msgsize[self.pktcnt],
-                       self.msgtime[self.pktcnt]))
-
-            self.pktcnt += 1
+            offset += msgsize
 
         self.msgoffset = np.array(self.msgoffset)
         self.msgsize = np.array(self.msgsize)
         self.msgtime = np.array(self.msgtime)
+        self.pktcnt = len(self.msgoffset)
+
+    def _index_headers_mmap(self):
+        """
+        Memory mapped version of _index_headers.  Only the 4 byte size field of each datagram is touched while walking
+        the file, the headers at the resulting offsets are then gathered and decoded in one pass with numpy using
+        kmall_header_dtype.
+        """
+
+        if not self.file_size:
+            self.msgoffset, self.msgsize, self.msgtime, self.msgtype = np.array([]), np.array([]), np.array([]), []
+            self.pktcnt = 0
+            return
+
+        header_size = kmall_header_dtype.itemsize
+        with mmap.mmap(self.FID.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = []
+            offset = 0
+            while offset + header_size <= self.file_size:
+                msgsize = struct.unpack_from('<I', mm, offset)[0]
+                if msgsize < header_size or mm[offset + 4] != 0x23:  # 0x23 = '#', the start of the datagram type
+                    print("Error indexing file: %s at byte offset %d" % (self.filename, offset))
+                    offset = self.find_next_datagram(offset + 1)
+                    if offset is None:
+                        break
+                    continue
+                offsets.append(offset)
+                offset += msgsize
+            if offset < self.file_size:
+                print("Error indexing file: %s, truncated datagram at byte offset %d" % (self.filename, offset))
+
+            offsets = np.array(offsets, dtype=np.int64)
+            filedata = np.frombuffer(mm, dtype=np.uint8)
+            headers = filedata[offsets[:, np.newaxis] + np.arange(header_size)].view(kmall_header_dtype)[:, 0]
+            del filedata  # release the buffer export, so that the mmap can close
+
+        self.msgoffset = offsets
+        self.msgsize = headers['numBytesDgm'].astype(np.int64)
+        self.msgtime = headers['time_sec'] + headers['time_nanosec'] / 1.0E9
+        self.msgtype = [str(dgm_type) for dgm_type in headers['dgmType']]
+        self.pktcnt = len(self.msgoffset)
+
+    def _build_index_dataframe(self):
+        """
+        Build self.Index from the msgtime/msgoffset/msgsize/msgtype attributes populated by index_file
+        """
 
         self.Index = pd.DataFrame({'Time': self.msgtime,
                                    'ByteOffset': self.msgoffset,
@@ -3346,6 +4109,71 @@ class kmall():
         if self.verbose >= 2:
             print(self.Index)
 
+    def index_sidecar_path(self):
+        """
+        Path to the sidecar index file for this kmall file, ex: 0000_20200101_000000.kmall.index.npz
+        """
+        return self.filename + '.index.npz'
+
+    def save_index_sidecar(self):
+        """
+        Write the current index (see index_file) to the sidecar file as numpy arrays, along with the index format version
+        and the size/modification time of the kmall file, used to validate the sidecar in load_index_sidecar.
+
+        Returns
+        -------
+        bool
+            True if the sidecar was written
+        """
+
+        sidecar = self.index_sidecar_path()
+        try:
+            with open(sidecar, 'wb') as fil:
+                np.savez(fil, version=np.int32(kmall_index_version), file_size=np.int64(os.path.getsize(self.filename)),
+                         file_mtime=np.float64(os.path.getmtime(self.filename)),
+                         msgoffset=np.asarray(self.msgoffset, dtype=np.int64),
+                         msgsize=np.asarray(self.msgsize, dtype=np.int64),
+                         msgtime=np.asarray(self.msgtime, dtype=np.float64),
+                         msgtype=np.asarray(self.msgtype, dtype=str))
+        except OSError as e:  # read only directory, etc., sidecar is just an optimization
+            if self.verbose:
+                print('Unable to write index sidecar {}: {}'.format(sidecar, e))
+            return False
+        return True
+
+    def load_index_sidecar(self):
+        """
+        Load the index from the sidecar file into the msgtime/msgoffset/msgsize/msgtype attributes if the sidecar exists,
+        is the current index format version and matches the size/modification time of the kmall file.
+
+        Returns
+        -------
+        bool
+            True if the index was loaded from the sidecar, False if the file needs to be indexed
+        """
+
+        sidecar = self.index_sidecar_path()
+        if not os.path.exists(sidecar):
+            return False
+        try:
+            with np.load(sidecar, allow_pickle=False) as idx:
+                if int(idx['version']) != kmall_index_version:
+                    return False
+                if int(idx['file_size']) != os.path.getsize(self.filename):
+                    return False
+                if float(idx['file_mtime']) != os.path.getmtime(self.filename):
+                    return False
+                self.msgoffset = idx['msgoffset']
+                self.msgsize = idx['msgsize']
+                self.msgtime = idx['msgtime']
+                self.msgtype = idx['msgtype'].tolist()
+        except Exception as e:  # corrupt/partially written sidecar, just rebuild it
+            if self.verbose:
+                print('Unable to read index sidecar {}: {}'.format(sidecar, e))
+            return False
+        self.pktcnt = len(self.msgoffset)
+        return True
+
     def extract_nav(self):
         ''' Extract navigation data.
         Only works when data is interpreted into the KMbinary record at the
@@ -3360,6 +4188,10 @@ class kmall():
         KMbinary datagram. But it does not handle 1) multiple navigation
         inputs, 2) multiple navigation input types, 3) there are no checks to
         see that the data is valid. etc.
+
+        The samples of each SKM datagram are decoded with one np.frombuffer (read_EMdgmSKMsample_block), self.att is
+        a dict of contiguous numpy arrays (dgtime, roll_deg, pitch_deg, heave_m, heading_deg, ...) for the whole file,
+        which is also returned.
         '''
 
         if self.Index is None:
@@ -3375,14 +4207,16 @@ class kmall():
         attitudeDatagrams = list()
         for offset in SKMOffsets:
             self.FID.seek(offset, 0)
-            dg = self.read_EMdgmSKM()
+            dg = self.read_EMdgmSKM(vectorized=True)
             attitudeDatagrams.append(dg['sample']['KMdefault'])
 
-        # Convert list of dictionaries to dictionary of lists.
-        self.att = self.listofdicts2dictoflists(attitudeDatagrams)
+        if attitudeDatagrams:
+            self.att = {ky: np.concatenate([dg[ky] for dg in attitudeDatagrams]) for ky in attitudeDatagrams[0]}
+        else:
+            self.att = None
 
         self.FID.seek(0, 0)
-        return
+        return self.att
 
     def listofdicts2dictoflists(self, listofdicts):
         """ A utility  to convert a list of dicts to a dict of lists."""
@@ -3422,32 +4256,160 @@ class kmall():
     def extractLonLatZ(self):
         """ A method to extract Longitude, Latitude and Depth for each soundings."""
 
+        points = self.extract_point_cloud()
+        return points['longitude'], points['latitude'], points['z']
+
+    def extract_point_cloud(self, include_uncertainty: bool = False, include_flags: bool = False):
+        """
+        Extract the longitude, latitude and depth (z_reRefPoint_m - z_waterLevelReRefPoint_m) of every sounding in the
+        file as flat arrays.
+
+        Uses iter_mrz_soundings to go straight to the MRZ datagrams and decode only the ping position and the wanted
+        sounding columns with one np.frombuffer per ping.  The output arrays are preallocated from the number of MRZ
+        datagrams and the number of soundings in the first ping, and only grow (doubling) if later pings have more
+        soundings, see reserve_flat_columns.
+
+        Parameters
+        ----------
+        include_uncertainty
+            if True, also return 'tvu' and 'thu' (detectionUncertaintyVer_m, detectionUncertaintyHor_m)
+        include_flags
+            if True, also return the beam flags, see point_cloud_flag_fields
+
+        Returns
+        -------
+        dict
+            dict of flat numpy arrays, one entry per sounding: 'longitude', 'latitude', 'z' (float64), 'tvu', 'thu'
+            (float32) and the flag fields (uint8) if asked for
+        """
+
+        sounding_fields = ['deltaLatitude_deg', 'deltaLongitude_deg', 'z_reRefPoint_m']
+        outputs = {'longitude': np.float64, 'latitude': np.float64, 'z': np.float64}
+        if include_uncertainty:
+            sounding_fields += ['detectionUncertaintyVer_m', 'detectionUncertaintyHor_m']
+            outputs.update({'tvu': np.float32, 'thu': np.float32})
+        if include_flags:
+            sounding_fields += point_cloud_flag_fields
+            outputs.update({fld: np.uint8 for fld in point_cloud_flag_fields})
+
+        points = None
+        count = 0
+        for ping, pinginfo, sectors, soundings in self.iter_mrz_soundings(sounding_fields):
+            end = count + len(soundings)
+            if points is None:
+                initial_capacity = self.num_mrz_datagrams() * len(soundings)
+            points = reserve_flat_columns(points, outputs, count, end, initial_capacity)
+            points['latitude'][count:end] = pinginfo['latitude_deg'] + soundings['deltaLatitude_deg'].astype(np.float64)
+            points['longitude'][count:end] = pinginfo['longitude_deg'] + soundings['deltaLongitude_deg'].astype(np.float64)
+            points['z'][count:end] = soundings['z_reRefPoint_m'].astype(np.float64) - float(pinginfo['z_waterLevelReRefPoint_m'])
+            if include_uncertainty:
+                points['tvu'][count:end] = soundings['detectionUncertaintyVer_m']
+                points['thu'][count:end] = soundings['detectionUncertaintyHor_m']
+            if include_flags:
+                for fld in point_cloud_flag_fields:
+                    points[fld][count:end] = soundings[fld]
+            count = end
+
+        if points is None:
+            return {ky: np.zeros(0, dtype=dtyp) for ky, dtyp in outputs.items()}
+        return {ky: val[:count] for ky, val in points.items()}
+
+    def num_mrz_datagrams(self):
+        """
+        Number of MRZ datagrams in the index (index_file is run if needed)
+        """
         if self.Index is None:
             self.index_file()
+        return int(np.count_nonzero(np.array(self.msgtype, dtype=str) == "b'#MRZ'"))
 
-        if self.FID is None:
-            self.OpenFiletoRead()
+    def iter_mrz_soundings(self, sounding_fields: list, sector_fields: list = None, extra_detections: bool = True):
+        """
+        Generator over the MRZ datagrams of the file, decoding only the ping info, the wanted tx sector fields and the
+        wanted sounding fields of each ping with np.frombuffer.  Uses the index (index_file is run if needed) to go
+        straight to the MRZ datagrams.
 
-        # M = map( lambda x: x=="b'#MRZ'", self.msgtype)
-        # MRZOffsets = self.msgoffset[list(M)]
+        Every offset taken from the datagram (numBytesCmnPart, numBytesInfoData, the tx sector and sounding strides
+        and counts) is checked against the datagram size, truncated or corrupt datagrams are skipped with a warning.
 
-        # Get the file byte count offset for each MRZ datagram.
-        MRZOffsets = [x for x, y in zip(self.msgoffset, self.msgtype) if y == "b'#MRZ'"]
+        Parameters
+        ----------
+        sounding_fields
+            names of the mrz_sounding_dtype fields to decode
+        sector_fields
+            names of the mrz_txsector_dtype fields to decode, if None the tx sectors are not decoded
+        extra_detections
+            if True, the soundings are numSoundingsMaxMain + numExtraDetections, otherwise only the main soundings
+
+        Returns
+        -------
+        tuple
+            for each valid ping, (ping, pinginfo, sectors, soundings): the number of the MRZ datagram in the file
+            (counting from 0, skipped datagrams included), the mrz_pinginfo_dtype record, a structured array of the
+            sector_fields (one entry per tx sector, None if sector_fields is None) and a structured array of the
+            sounding_fields (one entry per sounding)
+        """
 
-        # Initialize array to store the data.
-        lat = np.array([])
-        lon = np.array([])
-        z = np.array([])
+        if self.Index is None:
+            self.index_file()
+        if self.FID is None:
+            self.OpenFiletoRead()
 
-        for offset in MRZOffsets:
-            self.FID.seek(offset, 0)
-            dg = self.read_EMdgmMRZ()
+        mrz_mask = np.array(self.msgtype, dtype=str) == "b'#MRZ'"
+        offsets = np.asarray(self.msgoffset, dtype=np.int64)[mrz_mask]
+        sizes = np.asarray(self.msgsize, dtype=np.int64)[mrz_mask]
+        sounding_dtypes = {}  # the partial sounding dtype for each numBytesPerSounding found
+        sector_dtypes = {}  # the partial tx sector dtype for each numBytesPerTxSector found
+
+        for ping, (offset, size) in enumerate(zip(offsets, sizes)):
+            self.FID.seek(int(offset))
+            buffer = self.FID.read(int(size))
+            if len(buffer) != size:
+                print('Kmall: {}: MRZ datagram at {} is truncated, skipping'.format(self.filename, offset))
+                continue
+            try:
+                if size < kmall_header_dtype.itemsize + struct.calcsize('3H'):
+                    raise CorruptPacketError(f"Corrupt packet: #MRZ at {offset}")
+                pinginfo_start = self._mrz_pinginfo_offset(buffer)
+                if pinginfo_start + mrz_pinginfo_dtype.itemsize > size:
+                    raise CorruptPacketError(f"Corrupt packet: #MRZ at {offset}")
+                pinginfo = np.frombuffer(buffer, dtype=mrz_pinginfo_dtype, count=1, offset=pinginfo_start)[0]
+                sector_start = pinginfo_start + int(pinginfo['numBytesInfoData'])
+                num_sectors = int(pinginfo['numTxSectors'])
+                sector_stride = int(pinginfo['numBytesPerTxSector'])
+                rxinfo_start = sector_start + num_sectors * sector_stride
+                if rxinfo_start + mrz_rxinfo_dtype.itemsize > size:
+                    raise CorruptPacketError(f"Corrupt packet: #MRZ at {offset}")
+                rxinfo = np.frombuffer(buffer, dtype=mrz_rxinfo_dtype, count=1, offset=rxinfo_start)[0]
+                sounding_start = rxinfo_start + int(rxinfo['numBytesRxInfo']) + \
+                    int(rxinfo['numExtraDetectionClasses']) * int(rxinfo['numBytesPerClass'])
+                num_soundings = int(rxinfo['numSoundingsMaxMain'])
+                if extra_detections:
+                    num_soundings += int(rxinfo['numExtraDetections'])
+                stride = int(rxinfo['numBytesPerSounding'])
+                if sounding_start + num_soundings * stride > size:
+                    raise CorruptPacketError(f"Corrupt packet: #MRZ at {offset}")
+                # _partial_dtype raises on a stride too short for the fields
+                if stride not in sounding_dtypes:
+                    sounding_dtypes[stride] = _partial_dtype(mrz_sounding_dtype, sounding_fields, stride)
+                if sector_fields is not None and sector_stride not in sector_dtypes:
+                    sector_dtypes[sector_stride] = _partial_dtype(mrz_txsector_dtype, sector_fields, sector_stride)
+            except CorruptPacketError:
+                print('Kmall: {}: MRZ datagram at {} is corrupt, skipping'.format(self.filename, offset))
+                continue
 
-            z = np.concatenate([z,  np.array(dg['sounding']['z_reRefPoint_m']) - dg['pingInfo']['z_waterLevelReRefPoint_m']])
-            lat = np.concatenate([lat, dg['pingInfo']['latitude_deg'] + np.array(dg['sounding']['deltaLatitude_deg'])])
-            lon = np.concatenate([lon, dg['pingInfo']['longitude_deg'] + np.array(dg['sounding']['deltaLongitude_deg'])])
+            sectors = None
+            if sector_fields is not None:
+                sectors = np.frombuffer(buffer, dtype=sector_dtypes[sector_stride], count=num_sectors, offset=sector_start)
+            soundings = np.frombuffer(buffer, dtype=sounding_dtypes[stride], count=num_soundings, offset=sounding_start)
+            yield ping, pinginfo, sectors, soundings
 
-        return (lon.flatten(),lat.flatten(),z.flatten())
+    def _mrz_pinginfo_offset(self, buffer):
+        """
+        Return the offset of EMdgmMRZ_pingInfo in a MRZ datagram buffer, after the header, EMdgmMpartition and
+        EMdgmMbody (whose size is the numBytesCmnPart field)
+        """
+        cmnpart_start = kmall_header_dtype.itemsize + struct.calcsize('2H')
+        return cmnpart_start + struct.unpack_from('<H', buffer, cmnpart_start)[0]
 
     def check_ping_count(self):
         """ A method to check to see that all required MRZ datagrams exist """
@@ -3625,37 +4587,204 @@ class kmall():
 
     def seek_next_startbyte(self, file_length, start_ptr=0):
         """
-        Determines if current pointer is at the start of a record.  If not, finds the next valid one.
-        """
-        # check is to continue on until you find the pound sign, which might indicate the record identifier,
-        #  can't just search for # though, have to use regex to ensure the 3 capital letter identifier comes after.
-        at_the_right_byte = False
-        while not at_the_right_byte:
-            cur_ptr = self.FID.tell()
-            if cur_ptr >= start_ptr + file_length:
-                # at the end of file, return False to stop searching
-                return False
-            # consider start bytes right at the end of the given filelength as valid, even if they extend
-            # over to the next chunk
-            srchdat = self.FID.read(min(20, (start_ptr + file_length) - cur_ptr))
-            stx_idx = srchdat.find(b'#')
-            if stx_idx >= 0:
-                possible_start = cur_ptr + stx_idx
-                self.FID.seek(possible_start)
-                datchk = self.FID.read(4)
-                m = self.datagram_ident_search.search(datchk, 0)
-                if m:
-                    self.FID.seek(possible_start - 4)
-                    self.decode_datagram()
-                    if self.read_method:
-                        try:
-                            self.read_datagram()
-                            self.FID.seek(possible_start - 4)
-                            return True
-                        except:
-                            self.FID.seek(possible_start + 1)
-                    else:
-                        self.FID.seek(possible_start + 1)
+        Determines if current pointer is at the start of a record.  If not, finds the next valid one, see
+        find_next_datagram.  Start bytes right at the end of the given file_length are considered valid, even if the
+        datagram extends over to the next chunk.
+
+        Parameters
+        ----------
+        file_length
+            length in bytes of the chunk we are searching
+        start_ptr
+            byte offset of the start of the chunk
+
+        Returns
+        -------
+        bool
+            True if a datagram was found (file pointer is left at the start of it), False if we hit the end of the
+            chunk (file pointer is left at the end of the chunk)
+        """
+
+        cur_ptr = self.FID.tell()
+        next_offset = self.find_next_datagram(cur_ptr, start_ptr + file_length)
+        if next_offset is None:
+            self.FID.seek(max(cur_ptr, start_ptr + file_length))
+            return False
+        self.FID.seek(next_offset)
+        return True
+
+    def find_next_datagram(self, start_ptr: int, end_ptr: int = None, window_size: int = resync_window_size):
+        """
+        Find the next valid datagram, used to resync after a corrupt region in the file.  The file (the memory map
+        directly when this object was constructed with use_mmap=True, otherwise windows of window_size bytes) is
+        searched with the start byte expression (see _build_startbytesearch) and each candidate is validated by its
+        size field and the trailing length field at the end of the datagram, without decoding it.
+
+        Moves the file pointer, callers should seek to the returned offset.
+
+        Parameters
+        ----------
+        start_ptr
+            byte offset to start searching from, a datagram starting at start_ptr will be found
+        end_ptr
+            the datagram identifier must start before this byte offset, defaults to the end of the file
+        window_size
+            size of the buffered reads when the file is not memory mapped
+
+        Returns
+        -------
+        int
+            byte offset of the start of the next valid datagram, None if there are no more
+        """
+
+        file_size = os.fstat(self.FID.fileno()).st_size
+        end_ptr = file_size if end_ptr is None else min(end_ptr, file_size)
+        mapped = self.FID.mmap if isinstance(self.FID, MappedKmallFile) else None
+
+        # the identifier follows the 4 byte size field, so a datagram starting at start_ptr has its identifier at + 4
+        search_ptr = start_ptr + 4
+        while search_ptr < end_ptr:
+            if mapped is not None:
+                base, buffer = 0, mapped
+                search_end = end_ptr
+            else:
+                base = search_ptr - 4
+                search_end = min(search_ptr + window_size, end_ptr)
+                self.FID.seek(base)
+                buffer = self.FID.read(search_end - base + 3)  # + 3 for an identifier that straddles the window end
+            for m in self.datagram_ident_search.finditer(buffer, search_ptr - base, search_end - base + 3):
+                offset = base + m.start() - 4
+                numbytes = struct.unpack_from('<I', buffer, m.start() - 4)[0]
+                if numbytes < 24 or offset + numbytes > file_size:  # at least the 20 byte header and the 4 byte tail
+                    continue
+                if mapped is not None:
+                    trailing = struct.unpack_from('<I', mapped, offset + numbytes - 4)[0]
+                elif offset + numbytes <= base + len(buffer):
+                    trailing = struct.unpack_from('<I', buffer, offset - base + numbytes - 4)[0]
+                else:
+                    self.FID.seek(offset + numbytes - 4)
+                    trailing = struct.unpack('<I', self.FID.read(4))[0]
+                if trailing == numbytes:
+                    return offset
+            search_ptr = search_end
+        return None
+
+    def compile_mrz_decoder(self, subrecs: list):
+        """
+        Build a decoder for only the given MRZ fields, used by sequential_read_records when a fields list is provided.
+        The returned plan holds the partial structured dtypes for the wanted fields of each MRZ block, see
+        decode_mrz_compiled.
+
+        The sounding travel time is always decoded (needed to drop invalid pings in _populate_rec), as well as
+        sounding.txSectorNumb and the four sector records expanded in _populate_rec when any sector field is wanted.
+
+        Parameters
+        ----------
+        subrecs
+            list of MRZ fields in the dot notation of _build_sequential_read_categories, ex: ['header.dgtime',
+            'pingInfo.latitude_deg', 'sounding.twoWayTravelTime_sec']
+
+        Returns
+        -------
+        dict
+            decoder plan for decode_mrz_compiled
+        """
+
+        blocks = {'header': kmall_header_dtype, 'cmnPart': mrz_cmnpart_dtype, 'pingInfo': mrz_pinginfo_dtype,
+                  'txSectorInfo': mrz_txsector_dtype, 'rxInfo': mrz_rxinfo_dtype, 'sounding': mrz_sounding_dtype}
+        wanted = {blk: [] for blk in blocks}
+        for subrec in subrecs:
+            blk, _, fld = subrec.partition('.')
+            if blk == 'header' and fld == 'dgtime':
+                continue  # always decoded
+            if blk not in blocks or fld not in blocks[blk].names:
+                raise ValueError('compile_mrz_decoder: unable to decode {}, not a field of the MRZ blocks {}'.format(subrec, list(blocks)))
+            if fld not in wanted[blk]:
+                wanted[blk].append(fld)
+        if 'twoWayTravelTime_sec' not in wanted['sounding']:
+            wanted['sounding'].append('twoWayTravelTime_sec')
+        if wanted['txSectorInfo']:
+            for fld in ['sectorTransmitDelay_sec', 'centreFreq_Hz', 'tiltAngleReTx_deg', 'totalSignalLength_sec']:
+                if fld not in wanted['txSectorInfo']:
+                    wanted['txSectorInfo'].append(fld)
+            if 'txSectorNumb' not in wanted['sounding']:
+                wanted['sounding'].append('txSectorNumb')
+        return {'fields': wanted, 'sounding_dtypes': {}, 'txsector_dtypes': {}}
+
+    def decode_mrz_compiled(self, plan: dict):
+        """
+        Decode the MRZ datagram at the current file position with a decoder plan from compile_mrz_decoder.  The whole
+        datagram is read at once, the position of each block is found from the size fields (numBytesCmnPart,
+        numBytesInfoData, numTxSectors * numBytesPerTxSector, numBytesRxInfo, extra detection classes) and only the
+        wanted fields are decoded.  The seabed image samples are never read.
+
+        Returns the same nested dict layout as read_EMdgmMRZ(vectorized=True) with only the wanted fields, the
+        header always holds dgtime and the scalar fields are python int/float like the full decode.  Leaves the file
+        position at the end of the datagram.
+
+        Parameters
+        ----------
+        plan
+            decoder plan from compile_mrz_decoder
+
+        Returns
+        -------
+        dict
+            partial MRZ datagram dict
+        """
+
+        start = self.FID.tell()
+        numbytes = struct.unpack('<I', self.FID.read(4))[0]
+        self.FID.seek(start)
+        buffer = self.FID.read(numbytes)
+        if len(buffer) != numbytes or numbytes < kmall_header_dtype.itemsize + 4:
+            raise CorruptPacketError(f"Corrupt packet: #MRZ at {start}")
+        wanted = plan['fields']
+
+        header = np.frombuffer(buffer, dtype=kmall_header_dtype, count=1)[0]
+        self.datagram_version = int(header['dgmVersion'])
+        dg = {'header': {'dgtime': int(header['time_sec']) + int(header['time_nanosec']) / 1.0E9}}
+        for fld in wanted['header']:
+            dg['header'][fld] = header[fld].item()
+
+        cmnpart_start = kmall_header_dtype.itemsize + struct.calcsize('2H')  # after EMdgmMpartition
+        pinginfo_start = self._mrz_pinginfo_offset(buffer)
+        if pinginfo_start + mrz_pinginfo_dtype.itemsize > numbytes:
+            raise CorruptPacketError(f"Corrupt packet: #MRZ at {start}")
+        if wanted['cmnPart']:
+            cmnpart = np.frombuffer(buffer, dtype=mrz_cmnpart_dtype, count=1, offset=cmnpart_start)[0]
+            dg['cmnPart'] = {fld: cmnpart[fld].item() for fld in wanted['cmnPart']}
+        pinginfo = np.frombuffer(buffer, dtype=mrz_pinginfo_dtype, count=1, offset=pinginfo_start)[0]
+        if wanted['pingInfo']:
+            dg['pingInfo'] = {fld: pinginfo[fld].item() for fld in wanted['pingInfo']}
+
+        txsector_start = pinginfo_start + int(pinginfo['numBytesInfoData'])
+        numsectors = int(pinginfo['numTxSectors'])
+        sector_stride = int(pinginfo['numBytesPerTxSector'])
+        rxinfo_start = txsector_start + numsectors * sector_stride
+        if rxinfo_start + mrz_rxinfo_dtype.itemsize > numbytes:
+            raise CorruptPacketError(f"Corrupt packet: #MRZ at {start}")
+        if wanted['txSectorInfo']:
+            if sector_stride not in plan['txsector_dtypes']:
+                plan['txsector_dtypes'][sector_stride] = _partial_dtype(mrz_txsector_dtype, wanted['txSectorInfo'], sector_stride)
+            sectors = np.frombuffer(buffer, dtype=plan['txsector_dtypes'][sector_stride], count=numsectors, offset=txsector_start)
+            dg['txSectorInfo'] = {fld: sectors[fld] for fld in wanted['txSectorInfo']}
+
+        rxinfo = np.frombuffer(buffer, dtype=mrz_rxinfo_dtype, count=1, offset=rxinfo_start)[0]
+        if wanted['rxInfo']:
+            dg['rxInfo'] = {fld: rxinfo[fld].item() for fld in wanted['rxInfo']}
+        sounding_start = rxinfo_start + int(rxinfo['numBytesRxInfo']) + \
+            int(rxinfo['numExtraDetectionClasses']) * int(rxinfo['numBytesPerClass'])
+        num_soundings = int(rxinfo['numSoundingsMaxMain']) + int(rxinfo['numExtraDetections'])
+        sounding_stride = int(rxinfo['numBytesPerSounding'])
+        if sounding_start + num_soundings * sounding_stride > numbytes:
+            raise CorruptPacketError(f"Corrupt packet: #MRZ at {start}")
+        if sounding_stride not in plan['sounding_dtypes']:
+            plan['sounding_dtypes'][sounding_stride] = _partial_dtype(mrz_sounding_dtype, wanted['sounding'], sounding_stride)
+        soundings = np.frombuffer(buffer, dtype=plan['sounding_dtypes'][sounding_stride], count=num_soundings,
+                                  offset=sounding_start)
+        dg['sounding'] = {fld: soundings[fld] for fld in wanted['sounding']}
+        return dg
 
     def _populate_rec(self, rec: dict):
         """
@@ -3673,37 +4802,21 @@ class kmall():
         else:
             # any NaN returns for traveltime are set to 0, lets us easily filter later
             rec['sounding']['twoWayTravelTime_sec'] = np.nan_to_num(rec['sounding']['twoWayTravelTime_sec'])
-            
-            record_time = rec['header']['dgtime']
-            # xarray Dataset must have no duplicate times (this appears to happen every now and then with dual head/dual ping)
-            while record_time in self.time_buffer:
-                record_time = record_time + 0.000001
-            self.time_buffer.append(record_time)
-            if len(self.time_buffer) > 10:
-                self.time_buffer.remove(self.time_buffer[0])
-
-            # expand out the sector wise arrays to be beam wise
-            txsector_index = np.array(rec['sounding']['txSectorNumb'])
-            populated_delay = np.empty(txsector_index.shape, dtype=np.float32)
-            populated_freq = np.empty(txsector_index.shape, dtype=np.int32)
-            populated_tiltangle = np.empty(txsector_index.shape, dtype=np.float32)
-            populated_pulselength = np.empty(txsector_index.shape, dtype=np.float32)
+            # duplicate ping times (dual head/dual ping) are made unique after the sort, see _ensure_unique_starttime
+
+            if 'txSectorInfo' not in rec:  # partial decode without the sector records, see compile_mrz_decoder
+                return rec
+            # expand out the sector wise arrays to be beam wise, gathering the sector value for each beam
+            txsector_index = np.asarray(rec['sounding']['txSectorNumb'], dtype=np.intp)
             try:
-                for id in np.unique(txsector_index):
-                    populated_delay[txsector_index == id] = rec['txSectorInfo']['sectorTransmitDelay_sec'][id]
-                    populated_freq[txsector_index == id] = rec['txSectorInfo']['centreFreq_Hz'][id]
-                    populated_tiltangle[txsector_index == id] = rec['txSectorInfo']['tiltAngleReTx_deg'][id]
-                    populated_pulselength[txsector_index == id] = rec['txSectorInfo']['totalSignalLength_sec'][id]
-            except:
+                for ky, dtyp in [('tiltAngleReTx_deg', np.float32), ('centreFreq_Hz', np.int32),
+                                 ('sectorTransmitDelay_sec', np.float32), ('totalSignalLength_sec', np.float32)]:
+                    rec['txSectorInfo'][ky] = np.asarray(rec['txSectorInfo'][ky])[txsector_index].astype(dtyp)
+            except (IndexError, KeyError):
                 # this is a duplicate, happens when running sequential read with start_ptr/end_ptr, eof doesnt kick in
                 # shows here because 'Delay', etc.  are already removed from rec.tx
                 return None
 
-            rec['txSectorInfo']['tiltAngleReTx_deg'] = populated_tiltangle.tolist()
-            rec['txSectorInfo']['centreFreq_Hz'] = populated_freq.tolist()
-            rec['txSectorInfo']['sectorTransmitDelay_sec'] = populated_delay.tolist()
-            rec['txSectorInfo']['totalSignalLength_sec'] = populated_pulselength.tolist()
-
             return rec
 
     def _build_sequential_read_categories(self):
@@ -3780,6 +4893,64 @@ class kmall():
 
         return recs_categories, recs_categories_translator, recs_categories_result
 
+    def _filter_sequential_read_categories(self, fields: list = None):
+        """
+        Restrict the categories of _build_sequential_read_categories to the given fields, so that sequential read only
+        reads and returns those.
+
+        fields are record names from recs_categories_result ('navigation', reads all of that record) or record.column
+        ('ping.traveltime').  The time of each record is always included.  For ping, 'fixedgain' and
+        'processing_status' can also be asked for, they are built from sourceLevel/receiversensitivity and
+        beampointingangle in _finalize_records.
+
+        Parameters
+        ----------
+        fields
+            list of records/columns wanted, if None, return the categories for all of them
+
+        Returns
+        -------
+        dict
+            recs_categories, see _build_sequential_read_categories
+        dict
+            recs_categories_translator
+        dict
+            recs_categories_result
+        """
+
+        recs_categories, recs_categories_translator, recs_categories_result = self._build_sequential_read_categories()
+        if fields is None:
+            return recs_categories, recs_categories_translator, recs_categories_result
+
+        derived = {'ping': {'fixedgain': ['sourceLevel', 'receiversensitivity'], 'processing_status': ['beampointingangle'],
+                            'detectioninfo': ['detectioninfo', 'detectioninfo_two']}}
+        wanted = {}
+        for fld in fields:
+            rec, _, column = fld.partition('.')
+            if rec not in recs_categories_result:
+                raise ValueError('sequential_read_records: {} is not one of the records {}'.format(rec, list(recs_categories_result)))
+            wanted.setdefault(rec, {'time'})
+            if not column:
+                wanted[rec].update(recs_categories_result[rec])
+            else:
+                columns = derived.get(rec, {}).get(column, [column])
+                if any(col not in recs_categories_result[rec] for col in columns):
+                    raise ValueError('sequential_read_records: {} is not one of the columns of {}: {}'.format(
+                        column, rec, list(recs_categories_result[rec])))
+                wanted[rec].update(columns)
+
+        filtered_result = {rec: {col: None for col in recs_categories_result[rec] if col in wanted[rec]}
+                           for rec in recs_categories_result if rec in wanted}
+        filtered_translator = {}
+        for ident, subrecs in recs_categories_translator.items():
+            for subrec, targets in subrecs.items():
+                targets = [target for target in targets if target[0] in wanted and target[1] in wanted[target[0]]]
+                if targets:
+                    filtered_translator.setdefault(ident, {})[subrec] = targets
+        filtered_categories = {ident: [subrec for subrec in recs_categories[ident] if subrec in filtered_translator[ident]]
+                               for ident in filtered_translator}
+        return filtered_categories, filtered_translator, filtered_result
+
     def _translate_serial_number_record(self, recs_to_read, serial_translator):
         """
         Take the serial number record from sequential_read, which is just an array of integer indexes ([0, 1, 0, 1...])
@@ -3788,7 +4959,7 @@ class kmall():
         """
         # kmall no longer has serial number in header, only systemid which is the last octet of the ip address.
         #  translate that number to serial number
-        if serial_translator is not None:
+        if serial_translator is not None and 'serial_num' in recs_to_read.get('ping', {}):
             for sysid in serial_translator:
                 id_match = np.where(recs_to_read['ping']['serial_num'] == int(sysid))[0]
                 recs_to_read['ping']['serial_num'][id_match] = int(serial_translator[sysid])
@@ -3801,10 +4972,10 @@ class kmall():
         after merging all chunks.
         """
 
-        if recs_to_read['ping']['time'].any():
+        if 'ping' in recs_to_read and recs_to_read['ping']['time'].any():
             recs_to_read['ping']['time'][0] += 0.000010
             # if dual head, modify the first time of the second head as well
-            if recs_to_read['ping']['serial_num'][0] != recs_to_read['ping']['serial_num'][1]:
+            if 'serial_num' in recs_to_read['ping'] and recs_to_read['ping']['serial_num'][0] != recs_to_read['ping']['serial_num'][1]:
                 recs_to_read['ping']['time'][1] += 0.000010
             # ensure each time is unique
             timediff = np.diff(recs_to_read['ping']['time'])
@@ -3827,13 +4998,13 @@ class kmall():
         pattern almost after concatenating all skm records.
         """
 
-        if recs_to_read['attitude']['time'].any():
+        if 'attitude' in recs_to_read and recs_to_read['attitude']['time'].any():
             att_idx = np.argsort(recs_to_read['attitude']['time'])
-            for rec_type in ['time', 'roll', 'pitch', 'heading', 'heave']:
+            for rec_type in recs_to_read['attitude']:  # time, roll, pitch, heading, heave
                 recs_to_read['attitude'][rec_type] = recs_to_read['attitude'][rec_type][att_idx]
-        if recs_to_read['navigation']['time'].any():
+        if 'navigation' in recs_to_read and recs_to_read['navigation']['time'].any():
             nav_idx = np.argsort(recs_to_read['navigation']['time'])
-            for rec_type in ['time', 'latitude', 'longitude', 'altitude']:
+            for rec_type in recs_to_read['navigation']:  # time, latitude, longitude, altitude
                 recs_to_read['navigation'][rec_type] = recs_to_read['navigation'][rec_type][nav_idx]
         return recs_to_read
 
@@ -3869,9 +5040,9 @@ class kmall():
         SKM records that have attitude data but no navigation.  Maybe some difference in logging rates between the two
         sources?  Either way, we need to filter out any empty records.
         """
-        if recs_to_read['navigation']['time'].any():
+        if 'latitude' in recs_to_read.get('navigation', {}) and recs_to_read['navigation']['time'].any():
             nav_idx = recs_to_read['navigation']['latitude'] != 0
-            for rec_type in ['time', 'latitude', 'longitude', 'altitude']:
+            for rec_type in recs_to_read['navigation']:  # time, latitude, longitude, altitude
                 recs_to_read['navigation'][rec_type] = recs_to_read['navigation'][rec_type][nav_idx]
         return recs_to_read
 
@@ -3883,7 +5054,9 @@ class kmall():
         2 = rejected, 1 = phase detection, 0 = amplitude detection
         So we merge the relevant parts of the two records
         """
-        if recs_to_read['ping']['detectioninfo'].any():
+        if 'ping' not in recs_to_read:
+            return recs_to_read
+        if 'detectioninfo' in recs_to_read['ping'] and recs_to_read['ping']['detectioninfo'].any():
             if recs_to_read['ping']['detectioninfo_two'].any():
                 assert recs_to_read['ping']['detectioninfo_two'].size == recs_to_read['ping']['detectioninfo'].size
                 amp_msk = recs_to_read['ping']['detectioninfo_two'] == 1
@@ -3898,7 +5071,11 @@ class kmall():
         """
         Take in the list of numpy arrays, and merge them into a single array by casting as ndarray.  If you get a sonar
         with a varying number of beams, you have to go the iterate-over-all-pings route instead, which is slower.
+
+        A ColumnAccumulator is padded to (pings, maxlen) directly from its values/offsets, see ColumnAccumulator.to_array
         """
+        if isinstance(arr, ColumnAccumulator):
+            return arr.to_array(dtype=dtyp, maxlen=maxlen)
         try:
             if dtyp is not None:
                 newrec = np.array(arr, dtype=dtyp)
@@ -3917,6 +5094,33 @@ class kmall():
                 newrec[i][0:len(j)] = j
         return newrec
 
+    def _finalize_ping_column(self, dgram: str, arr: list, maxlen: int):
+        """
+        Convert the list of per ping values for one of the ping records (dgram) to the array type Kluster expects, see
+        _finalize_records
+        """
+        if dgram in ['detectioninfo', 'detectioninfo_two']:
+            return self._finalize_ping_record(arr, np.int32, maxlen)
+        elif dgram == 'yawpitchstab':
+            return self.translate_yawpitch_tostring(np.array(arr))
+        elif dgram == 'mode':
+            return self.translate_mode_tostring(np.array(arr))
+        elif dgram == 'modetwo':
+            return self.translate_mode_two_tostring(np.array(arr))
+        elif dgram in ['soundspeed', 'tiltangle', 'delay', 'beampointingangle', 'traveltime', 'qualityfactor',
+                       'reflectivity', 'pulselength', 'tvg', 'sourceLevel', 'receiversensitivity', 'absorption']:
+            return self._finalize_ping_record(arr, 'float32', maxlen)
+        elif dgram == 'serial_num':
+            return self._finalize_ping_record(arr, 'uint64', maxlen)
+        elif dgram == 'txsector_beam':
+            return self._finalize_ping_record(arr, 'uint8', maxlen)
+        elif dgram == 'counter':
+            return self._finalize_ping_record(arr, 'uint32', maxlen)
+        elif dgram == 'frequency':
+            return self._finalize_ping_record(arr, 'int32', maxlen)
+        else:
+            return self._finalize_ping_record(arr, None, maxlen)
+
     def _finalize_records(self, recs_to_read, recs_count, serial_translator=None):
         """
         Take output from sequential_read_records and alter the type/size/translate as needed for Kluster to read and
@@ -3928,25 +5132,29 @@ class kmall():
         returns: recs_to_read, dict of dicts finalized
         """
 
+        # a read with a fields list (see _filter_sequential_read_categories) may only have some of the records/columns
+        ping = recs_to_read.get('ping', {})
         # records aren't sorted for some reason, have to do that here
-        idx = np.argsort(recs_to_read['ping']['time'])
+        idx = np.argsort(ping['time']) if 'time' in ping else None
         # flatten the serial number array
-        recs_to_read['ping']['serial_num'] = np.squeeze(recs_to_read['ping']['serial_num'])
+        if 'serial_num' in ping:
+            ping['serial_num'] = np.squeeze(ping['serial_num'])
         # get the max number of beams
-        if recs_to_read['ping']['traveltime'] != None:
-            maxlen = len(max(recs_to_read['ping']['traveltime'], key=lambda x: len(x)))
-        # else:
-        #     maxlen = 0
+        if ping.get('traveltime') is not None:
+            maxlen = ping['traveltime'].max_row_length()
+        else:
+            maxlen = max([col.max_row_length() for col in ping.values() if isinstance(col, ColumnAccumulator)], default=0)
 
         # need to force in the serial number, its not in the header anymore with these kmall files...
-        if recs_to_read['installation_params']['installation_settings'] is not None:
+        if 'installation_params' in recs_to_read and recs_to_read['installation_params'].get('installation_settings') is not None:
             inst_params = recs_to_read['installation_params']['installation_settings'][0]
             if inst_params is not None and serial_translator is not None:
                 serialnums = list(serial_translator.values())
                 recs_to_read['installation_params']['serial_one'] = np.array(serialnums[0], dtype='uint64')
                 recs_to_read['installation_params']['serial_two'] = np.array(serialnums[1], dtype='uint64')
-                recs_to_read['ping']['serial_num'][recs_to_read['ping']['serial_num'] == 0] = serialnums[0]
-                recs_to_read['ping']['serial_num'][recs_to_read['ping']['serial_num'] == 1] = serialnums[1]
+                if 'serial_num' in ping:
+                    ping['serial_num'][ping['serial_num'] == 0] = serialnums[0]
+                    ping['serial_num'][ping['serial_num'] == 1] = serialnums[1]
 
         for rec in recs_to_read:
             for dgram in recs_to_read[rec]:
@@ -3958,32 +5166,11 @@ class kmall():
                         # found no records, empty array of strings for the mode/stab records
                         recs_to_read[rec][dgram] = np.zeros(0, 'U2')
                 elif rec in ['attitude']:  # these recs have time blocks of data in them, need to be concatenated
-                    recs_to_read[rec][dgram] = np.concatenate(recs_to_read[rec][dgram])
+                    recs_to_read[rec][dgram] = np.array(recs_to_read[rec][dgram].values)
                     if dgram in ['roll', 'pitch', 'heave', 'heading']:
                         recs_to_read[rec][dgram] = recs_to_read[rec][dgram].astype(np.float32)
                 elif rec == 'ping':  # use the argsort indices here to sort by time
-                    if dgram in ['detectioninfo', 'detectioninfo_two']:
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], np.int32, maxlen)
-                    elif dgram == 'yawpitchstab':
-                        recs_to_read[rec][dgram] = self.translate_yawpitch_tostring(np.array(recs_to_read[rec][dgram]))
-                    elif dgram == 'mode':
-                        recs_to_read[rec][dgram] = self.translate_mode_tostring(np.array(recs_to_read[rec][dgram]))
-                    elif dgram == 'modetwo':
-                        recs_to_read[rec][dgram] = self.translate_mode_two_tostring(np.array(recs_to_read[rec][dgram]))
-                    elif dgram in ['soundspeed', 'tiltangle', 'delay', 'beampointingangle', 'traveltime', 'qualityfactor',
-                                   'reflectivity', 'pulselength', 'tvg', 'sourceLevel', 'receiversensitivity', 'absorption']:
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], 'float32', maxlen)
-                    elif dgram == 'serial_num':
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], 'uint64', maxlen)
-                    elif dgram == 'txsector_beam':
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], 'uint8', maxlen)
-                    elif dgram == 'counter':
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], 'uint32', maxlen)
-                    elif dgram == 'frequency':
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], 'int32', maxlen)
-                    else:
-                        recs_to_read[rec][dgram] = self._finalize_ping_record(recs_to_read[rec][dgram], None, maxlen)
-                    recs_to_read[rec][dgram] = recs_to_read[rec][dgram][idx]
+                    recs_to_read[rec][dgram] = self._finalize_ping_column(dgram, recs_to_read[rec][dgram], maxlen)[idx]
                 else:
                     if dgram == 'altitude':
                         recs_to_read[rec][dgram] = np.array(recs_to_read[rec][dgram], dtype='float32')
@@ -3996,10 +5183,13 @@ class kmall():
         # recs_to_read = self._interpolate_skm_time_spikes(recs_to_read)
         recs_to_read = self._skm_remove_empty_navigation(recs_to_read)
         recs_to_read = self._merge_detectioninfo_detectionmethod(recs_to_read)
-        recs_to_read['ping']['fixedgain'] = recs_to_read['ping'].pop('sourceLevel') + recs_to_read['ping'].pop('receiversensitivity')
+        if 'sourceLevel' in ping and 'receiversensitivity' in ping:
+            ping['fixedgain'] = ping.pop('sourceLevel') + ping.pop('receiversensitivity')
 
         # need to sort/drop uniques, keep finding duplicate times
         for dset_name in ['attitude', 'navigation', 'ping']:
+            if dset_name not in recs_to_read:
+                continue
             dset = recs_to_read[dset_name]
             _, index = np.unique(dset['time'], return_index=True)
             if dset['time'].size != index.size:
@@ -4013,12 +5203,15 @@ class kmall():
                     dset[var] = dset[var][index]
 
         # some dtype setting to appease the Kluster check
-        recs_to_read['runtime_params']['runtime_settings'] = np.array(recs_to_read['runtime_params']['runtime_settings'], dtype=np.object)
+        if 'runtime_settings' in recs_to_read.get('runtime_params', {}):
+            recs_to_read['runtime_params']['runtime_settings'] = np.array(recs_to_read['runtime_params']['runtime_settings'], dtype=object)
         # empty processing status that we append for Kluster to use later
-        recs_to_read['ping']['processing_status'] = np.zeros_like(recs_to_read['ping']['beampointingangle'], dtype=np.uint8)
+        if 'beampointingangle' in ping:
+            ping['processing_status'] = np.zeros_like(ping['beampointingangle'], dtype=np.uint8)
         return recs_to_read
 
-    def sequential_read_records(self, start_ptr=0, end_ptr=0, first_installation_rec=False, serial_translator=None):
+    def sequential_read_records(self, start_ptr=0, end_ptr=0, first_installation_rec=False, serial_translator=None,
+                                fields=None):
         """
         Read the file and return a dict of the wanted records/fields according to recs_categories.  If start_ptr/end_ptr
         is provided, start and end at those byte offsets.
@@ -4026,21 +5219,135 @@ class kmall():
         If a serial_translator is provided (as a dictionary) use it to translate the systemid (the last octet of the
         system ip address) to the actual serial number for kluster to use
 
+        If fields is provided (ex: ['navigation'] or ['ping.traveltime', 'ping.beampointingangle']), only those
+        records/columns are returned, and the MRZ datagrams are read with a decoder compiled for just the needed
+        fields (see compile_mrz_decoder), see _filter_sequential_read_categories.
+
         returns: recs_to_read, dict of dicts for each desired record read sequentially, see recs_categories
         """
-        recs_categories, recs_categories_translator, recs_categories_result = self._build_sequential_read_categories()
+        recs_to_read, recs_count = self._sequential_read_raw(start_ptr, end_ptr, first_installation_rec, fields=fields)
+        recs_to_read = self._finalize_records(recs_to_read, recs_count, serial_translator=serial_translator)
+        recs_to_read['format'] = 'kmall'
+        return recs_to_read
+
+    def read_time_range(self, t0: float, t1: float, datagram_types: list = None, serial_translator=None,
+                        fields: list = None):
+        """
+        Read only the datagrams with a header time within t0 <= time <= t1, returned finalized the same as
+        sequential_read_records.  The index (see index_file, loaded from the sidecar if available) is binary searched
+        for the window and the file pointer is moved straight to each datagram in it, nothing outside of the window
+        is decoded.
+
+        km = kmall.kmall(r"C:\\Users\\zzzz\\Downloads\\0007_20190513_154724_ASVBEN.kmall")
+        recs = km.read_time_range(1557762460.0, 1557762520.0, datagram_types=['MRZ', 'SKM'])
+
+        The installation and runtime parameters (IIP, IOP) apply to the whole window, so those datagrams are read
+        whatever their time.  Records are selected by datagram header time, the SKM samples of a datagram straddling
+        t0 or t1 can fall just outside of the window.
+
+        Parameters
+        ----------
+        t0
+            start of the window in utc seconds
+        t1
+            end of the window in utc seconds
+        datagram_types
+            list of datagram identifiers to read (ex: ['MRZ', 'IIP']), default is all the datagrams in
+            _build_sequential_read_categories
+        serial_translator
+            see sequential_read_records
+        fields
+            see sequential_read_records
+
+        Returns
+        -------
+        dict
+            dict of dicts for each desired record, same as sequential_read_records
+        """
+
+        recs_categories, _, _ = self._build_sequential_read_categories()
+        if datagram_types is None:
+            datagram_types = list(recs_categories.keys())
+        invalid = [dtyp for dtyp in datagram_types if dtyp not in recs_categories]
+        if invalid:
+            raise ValueError('read_time_range: {} not found in the datagrams read by sequential_read_records: {}'.format(
+                invalid, list(recs_categories.keys())))
+        if self.Index is None:
+            self.index_file()
+
+        msgtime = np.asarray(self.msgtime)
+        msgoffset = np.asarray(self.msgoffset)
+        msgtype = np.asarray(self.msgtype)
+        time_order = np.argsort(msgtime, kind='stable')
+        sorted_time = msgtime[time_order]
+        first = np.searchsorted(sorted_time, t0, side='left')
+        last = np.searchsorted(sorted_time, t1, side='right')
+        in_window = np.zeros(msgtime.shape[0], dtype=bool)
+        in_window[time_order[first:last]] = True
+        in_window |= np.isin(msgtype, ["b'#IIP'", "b'#IOP'"])
+        in_window &= np.isin(msgtype, ["b'#{}'".format(dtyp) for dtyp in datagram_types])
+
+        recs_to_read, recs_count = self._sequential_read_raw(offsets=msgoffset[in_window], fields=fields)
+        recs_to_read = self._finalize_records(recs_to_read, recs_count, serial_translator=serial_translator)
+        recs_to_read['format'] = 'kmall'
+        return recs_to_read
+
+    def _sequential_read_raw(self, start_ptr=0, end_ptr=0, first_installation_rec=False, fields=None, offsets=None):
+        """
+        The read loop of sequential_read_records, returns the records before _finalize_records is run, as a
+        ColumnAccumulator per record (a list for the installation/runtime text), along with the count of datagrams read
+        for each record.  Raw records from several chunks
+        can be merged with _merge_raw_records and then finalized once, see parallel_read_records.
+
+        Parameters
+        ----------
+        start_ptr
+            byte offset to start reading at
+        end_ptr
+            byte offset to stop reading at, 0 to read to the end of the file
+        first_installation_rec
+            if True, stop after the first installation parameters record
+        fields
+            optional list of records/columns to read, see _filter_sequential_read_categories
+        offsets
+            optional byte offsets of the datagrams to read (from the index, in file order), if provided only those
+            datagrams are read, seeking straight to each one, start_ptr/end_ptr are ignored
+
+        Returns
+        -------
+        dict
+            dict of dicts of ColumnAccumulator for each desired record, see recs_categories
+        dict
+            number of datagrams read for each record
+        """
+        recs_categories, recs_categories_translator, recs_categories_result = self._filter_sequential_read_categories(fields)
         wanted_records = list(recs_categories.keys())
-        recs_to_read = copy.deepcopy(recs_categories_result)
+        mrz_decoder = None
+        if fields is not None and 'MRZ' in recs_categories:
+            mrz_decoder = self.compile_mrz_decoder(recs_categories['MRZ'])
+        # the records that each datagram type contributes to, for the datagram counts
+        datagram_records = {ident: {target[0] for targets in recs_categories_translator[ident].values() for target in targets}
+                            for ident in recs_categories_translator}
+        recs_to_read = {rec: dict.fromkeys(recs_categories_result[rec]) for rec in recs_categories_result}
         recs_count = dict([(k, 0) for k in recs_to_read])
 
         if self.FID is None:
             self.OpenFiletoRead()
 
+        if offsets is not None:
+            start_ptr, end_ptr = 0, 0
+            offsets = iter(offsets)
         filelen = self._initialize_sequential_read(start_ptr, end_ptr)
         if start_ptr:
             self.seek_next_startbyte(filelen, start_ptr=start_ptr)
         # locs = []
         while not self.eof:
+            if offsets is not None:
+                next_offset = next(offsets, None)
+                if next_offset is None:
+                    self.eof = True
+                    break
+                self.FID.seek(int(next_offset))
             if self.FID.tell() >= start_ptr + filelen:
                 self.eof = True
                 break
@@ -4051,13 +5358,16 @@ class kmall():
                 if self.datagram_ident not in wanted_records:
                     self.skip_datagram()
                     continue
-                self.read_datagram()
+                if mrz_decoder is not None and self.datagram_ident == 'MRZ':
+                    self.datagram_data = self.decode_mrz_compiled(mrz_decoder)
+                else:
+                    self.read_datagram(vectorized=True)
             except CorruptPacketError as e:
                 self.seek_next_startbyte(filelen, start_ptr=last_loc + 8)  # look for the next packet at a place 8 bytes ahead of the bad packet
                 print(e)
                 continue
-            for rec_ident in list(recs_categories_translator[self.datagram_ident].values())[0]:
-                recs_count[rec_ident[0]] += 1
+            for rec_name in datagram_records[self.datagram_ident]:
+                recs_count[rec_name] += 1
 
             rec = self.datagram_data
             rec = self._populate_rec(rec)
@@ -4075,28 +5385,256 @@ class kmall():
                         rec_key = subrec
                         tmprec = rec[rec_key]
 
-                    if subrec in ['install_txt', 'runtime_txt']:  # str, casting to list splits the string, dont want that
-                        val = [tmprec]
-                    else:
-                        try:  # flow for array/list attribute
-                            val = [np.array(tmprec)]
-                        except TypeError:  # flow for float/int attribute
-                            val = [tmprec]
-
-                    # generate new list or append to list for each rec of that dgram type found
+                    # generate new column or append to the column for each rec of that dgram type found
                     for translated in recs_categories_translator[self.datagram_ident][subrec]:
-                        if translated[1] == 'serial_num':  # get the first value, don't need serial_number by sector
-                            val = [np.array(val[0][0])]
-                        if recs_to_read[translated[0]][translated[1]] is None:
-                            recs_to_read[translated[0]][translated[1]] = copy.copy(val)
+                        column = recs_to_read[translated[0]][translated[1]]
+                        if subrec in ['install_txt', 'runtime_txt']:  # str, casting to array splits the string, dont want that
+                            if column is None:
+                                column = recs_to_read[translated[0]][translated[1]] = []
+                            column.append(tmprec)
                         else:
-                            recs_to_read[translated[0]][translated[1]].extend(val)
+                            if column is None:
+                                column = recs_to_read[translated[0]][translated[1]] = ColumnAccumulator()
+                            if translated[1] == 'serial_num':  # get the first value, don't need serial_number by sector
+                                column.append(np.asarray(tmprec)[0])
+                            else:
+                                column.append(tmprec)
             if self.datagram_ident == 'IIP' and first_installation_rec:
                 self.eof = True
+        return recs_to_read, recs_count
+
+    def plan_read_chunks(self, num_chunks: int):
+        """
+        Split the file into num_chunks byte ranges for sequential_read_records.  If the file has been indexed
+        (index_file), the boundaries are placed on datagram starts, and never between two datagrams with the same
+        time, so that a dual head ping is not split across chunks.  Without an index the file is split evenly by size,
+        sequential_read_records will find the next datagram from each start offset.
+
+        Parameters
+        ----------
+        num_chunks
+            number of chunks wanted, fewer are returned if the file has fewer datagrams
+
+        Returns
+        -------
+        list
+            list of [start_ptr, end_ptr] for each chunk, covering the whole file
+        """
+
+        if self.FID is None:
+            self.OpenFiletoRead()
+        if self.file_size is None:
+            self.FID.seek(0, 2)
+            self.file_size = self.FID.tell()
+            self.FID.seek(0)
+        num_chunks = max(int(num_chunks), 1)
+        targets = np.arange(1, num_chunks) * (self.file_size / num_chunks)
+        if self.msgoffset is not None and len(self.msgoffset):
+            offsets = np.asarray(self.msgoffset, dtype=np.int64)
+            msgtime = np.asarray(self.msgtime)
+            # can only split where the time changes
+            valid = np.concatenate([[True], msgtime[1:] != msgtime[:-1]])
+            candidates = offsets[valid]
+            bounds = candidates[np.minimum(np.searchsorted(candidates, targets), len(candidates) - 1)]
+        else:
+            bounds = targets.astype(np.int64)
+        bounds = np.unique(np.concatenate([[0], bounds, [self.file_size]]).astype(np.int64))
+        return [[int(bounds[i]), int(bounds[i + 1])] for i in range(len(bounds) - 1)]
+
+    def _merge_raw_records(self, raw_chunks: list):
+        """
+        Merge the raw records of several _sequential_read_raw calls (in file order) into one set of raw records,
+        ready for _finalize_records, which then does the sorting and removal of duplicate times for the whole file.
+
+        Parameters
+        ----------
+        raw_chunks
+            list of (recs_to_read, recs_count) tuples from _sequential_read_raw
+
+        Returns
+        -------
+        dict
+            merged dict of dicts of ColumnAccumulator for each desired record
+        dict
+            total number of datagrams read for each record
+        """
+
+        recs_to_read, recs_count = copy.deepcopy(raw_chunks[0])
+        for chunk_recs, chunk_count in raw_chunks[1:]:
+            for rec in chunk_recs:
+                recs_count[rec] += chunk_count[rec]
+                for dgram, val in chunk_recs[rec].items():
+                    if val is None:
+                        continue
+                    if recs_to_read[rec][dgram] is None:
+                        recs_to_read[rec][dgram] = copy.deepcopy(val)
+                    else:
+                        recs_to_read[rec][dgram].extend(val)
+        return recs_to_read, recs_count
+
+    def parallel_read_records(self, num_workers: int = None, chunks_per_worker: int = 1, serial_translator=None,
+                              fields: list = None):
+        """
+        Parallel version of sequential_read_records.  The file is split into datagram aligned chunks (see
+        plan_read_chunks, the file is indexed first if it has not been already), each chunk is read with
+        sequential_read_records in a separate process, and the chunk results are merged and finalized just like a
+        sequential read of the whole file.
+
+        Parameters
+        ----------
+        num_workers
+            number of processes to use, defaults to os.cpu_count()
+        chunks_per_worker
+            number of chunks to create for each worker, more chunks give better load balancing with varying ping sizes
+        serial_translator
+            see sequential_read_records
+        fields
+            see sequential_read_records
+
+        Returns
+        -------
+        dict
+            dict of dicts for each desired record, same as sequential_read_records
+        """
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if self.Index is None:
+            self.index_file()
+        chunks = self.plan_read_chunks(num_workers * max(int(chunks_per_worker), 1))
+        if num_workers == 1 or len(chunks) == 1:
+            raw_chunks = [_read_raw_records_chunk(self.filename, start, end, self.use_mmap, fields) for start, end in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                raw_chunks = list(pool.map(_read_raw_records_chunk, [self.filename] * len(chunks),
+                                           [c[0] for c in chunks], [c[1] for c in chunks], [self.use_mmap] * len(chunks),
+                                           [fields] * len(chunks)))
+        recs_to_read, recs_count = self._merge_raw_records(raw_chunks)
         recs_to_read = self._finalize_records(recs_to_read, recs_count, serial_translator=serial_translator)
         recs_to_read['format'] = 'kmall'
         return recs_to_read
 
+    def iter_pings(self, fields: list = None, batch_size: int = 1000, serial_translator=None):
+        """
+        Generator that reads the MRZ pings of the file and yields them in batches of batch_size pings, each batch
+        finalized like the 'ping' record of sequential_read_records (same names, dtypes, beam wise arrays sorted by
+        time).  Only one batch is held in memory at a time, so memory use does not grow with the length of the file.
+
+        km = kmall.kmall(r"C:\\Users\\zzzz\\Downloads\\0007_20190513_154724_ASVBEN.kmall")
+        for pings in km.iter_pings(fields=['time', 'beampointingangle', 'traveltime'], batch_size=500):
+            print(pings['time'][0], pings['traveltime'].shape)
+
+        Duplicate times are only removed within a batch, not between batches.
+
+        Parameters
+        ----------
+        fields
+            list of the ping record names wanted (ex: ['time', 'traveltime']), see the 'ping' record in
+            _build_sequential_read_categories.  fixedgain and processing_status are also available, as in
+            sequential_read_records.  Default is all of them.  'time' is always included.
+        batch_size
+            maximum number of pings in each batch
+        serial_translator
+            see sequential_read_records
+
+        Returns
+        -------
+        dict
+            dict of numpy arrays for each ping record, one per batch
+        """
+
+        recs_categories, recs_categories_translator, recs_categories_result = self._build_sequential_read_categories()
+        valid_fields = list(recs_categories_result['ping'].keys()) + ['fixedgain', 'processing_status']
+        valid_fields = [f for f in valid_fields if f not in ['sourceLevel', 'receiversensitivity', 'detectioninfo_two']]
+        if fields is None:
+            fields = valid_fields
+        invalid = [f for f in fields if f not in valid_fields]
+        if invalid:
+            raise ValueError('iter_pings: {} not found in the available ping records: {}'.format(invalid, valid_fields))
+        if batch_size < 1:
+            raise ValueError('iter_pings: batch_size must be at least 1, got {}'.format(batch_size))
+
+        # the raw records needed to build the requested fields
+        needed = set(fields) | {'time'}
+        if 'fixedgain' in needed:
+            needed |= {'sourceLevel', 'receiversensitivity'}
+        if 'detectioninfo' in needed:
+            needed.add('detectioninfo_two')
+        if 'processing_status' in needed:
+            needed.add('beampointingangle')
+        subrecs = []
+        for subrec in recs_categories['MRZ']:
+            for translated in recs_categories_translator['MRZ'][subrec]:
+                if translated[0] == 'ping' and translated[1] in needed:
+                    subrecs.append((subrec.split('.'), translated[1]))
+
+        if self.FID is None:
+            self.OpenFiletoRead()
+        filelen = self._initialize_sequential_read(0, 0)
+        pings = {rec_name: ColumnAccumulator(batch_size) for _, rec_name in subrecs}
+        while not self.eof:
+            if self.FID.tell() >= filelen:
+                self.eof = True
+                break
+            last_loc = self.FID.tell()
+            try:
+                self.decode_datagram()
+                if self.datagram_ident != 'MRZ':
+                    self.skip_datagram()
+                    continue
+                self.read_datagram(vectorized=True)
+            except CorruptPacketError as e:
+                self.seek_next_startbyte(filelen, start_ptr=last_loc + 8)
+                print(e)
+                continue
+            rec = self._populate_rec(self.datagram_data)
+            if rec is None:
+                continue
+            for subrec, rec_name in subrecs:
+                tmprec = rec
+                for ky in subrec:
+                    tmprec = tmprec[ky]
+                if rec_name == 'serial_num':  # get the first value, don't need serial_number by sector
+                    pings[rec_name].append(np.asarray(tmprec)[0])
+                else:
+                    pings[rec_name].append(tmprec)
+            if len(pings['time']) >= batch_size:
+                yield self._finalize_ping_batch(pings, fields, serial_translator)
+                pings = {rec_name: ColumnAccumulator(batch_size) for _, rec_name in subrecs}
+        if len(pings['time']):
+            yield self._finalize_ping_batch(pings, fields, serial_translator)
+
+    def _finalize_ping_batch(self, pings: dict, fields: list, serial_translator=None):
+        """
+        Finalize a batch of raw ping records for iter_pings, follows the ping record steps of _finalize_records
+        """
+
+        idx = np.argsort(pings['time'].to_array())
+        maxlen = max(col.max_row_length() for col in pings.values())
+        batch = {}
+        for dgram, arr in pings.items():
+            batch[dgram] = self._finalize_ping_column(dgram, arr, maxlen)[idx]
+        if serial_translator is not None and 'serial_num' in batch:
+            for sysid in serial_translator:
+                batch['serial_num'][batch['serial_num'] == int(sysid)] = int(serial_translator[sysid])
+        if 'detectioninfo' in batch:
+            batch = self._merge_detectioninfo_detectionmethod({'ping': batch})['ping']
+        if 'fixedgain' in fields:
+            batch['fixedgain'] = batch['sourceLevel'] + batch['receiversensitivity']
+        if 'processing_status' in fields:
+            batch['processing_status'] = np.zeros_like(batch['beampointingangle'], dtype=np.uint8)
+
+        _, index = np.unique(batch['time'], return_index=True)
+        if batch['time'].size != index.size:
+            for var in batch:
+                batch[var] = batch[var][index]
+        final_batch = {'time': batch['time']}
+        for fld in fields:
+            final_batch[fld] = batch[fld]
+        return final_batch
+
     def translate_yawpitch_tostring(self, arr):
         """
         Translate the binary code to a string identifier. Allows user to understand the mode
@@ -4496,6 +6034,544 @@ class kmall():
         return {0: int(ser_one), 1: int(ser_two)}
 
 
+class KmallCollection:
+    """
+    Several kmall files (a survey day, a directory of lines) read as one dataset.  Each file is indexed (see
+    kmall.index_file, the sidecar index is used when it exists and written when it does not) and the indexes are
+    merged into one time sorted index, Index, with the file number of each datagram.  Queries by time, ping or
+    datagram type then span file boundaries.
+
+    kc = kmall.KmallCollection(r"C:\\data\\H13000\\EM2040\\2021-123", max_open_files=4)
+    recs = kc.read_time_range(1620000000.0, 1620000300.0, datagram_types=['MRZ', 'SKM', 'IIP'])
+    for filename, offset, dgram_type, dgram in kc.iter_datagrams(datagram_types=['SVP']):
+        print(filename, dgram['header']['dgtime'])
+
+    Files are only opened when a query needs them, and at most max_open_files are held open at once (least recently
+    used are closed first).
+
+    Pings are numbered by unique MRZ time, in time order, as in KmallWaterColumn.
+    """
+
+    def __init__(self, files, max_open_files: int = 8, use_mmap: bool = False):
+        if isinstance(files, str) and os.path.isdir(files):
+            files = [os.path.join(files, f) for f in os.listdir(files) if os.path.splitext(f)[1] == '.kmall']
+        elif isinstance(files, str):
+            files = [files]
+        if not files:
+            raise ValueError('KmallCollection: no kmall files found in {}'.format(files))
+        if max_open_files < 1:
+            raise ValueError('KmallCollection: max_open_files must be at least 1, got {}'.format(max_open_files))
+        self.filenames = sorted(files)
+        self.max_open_files = max_open_files
+        self.use_mmap = use_mmap
+        self._open_files = OrderedDict()
+
+        self.Index = None
+        self.ping_times = None
+        self.build_index()
+
+    def build_index(self):
+        """
+        Index each file and merge the file indexes into Index, a DataFrame sorted by time (file order for equal times)
+        with the FileNumber (position in filenames), ByteOffset, MessageSize and MessageType of each datagram.
+        """
+
+        file_number, msgtime, msgoffset, msgsize, msgtype = [], [], [], [], []
+        for cnt, filename in enumerate(self.filenames):
+            km = kmall(filename)
+            km.index_file()
+            km.closeFile()
+            file_number.append(np.full(len(km.msgoffset), cnt, dtype=np.int32))
+            msgtime.append(np.asarray(km.msgtime, dtype=np.float64))
+            msgoffset.append(np.asarray(km.msgoffset, dtype=np.int64))
+            msgsize.append(np.asarray(km.msgsize, dtype=np.int64))
+            msgtype.append(np.asarray(km.msgtype, dtype=str))
+        msgtime = np.concatenate(msgtime)
+        order = np.argsort(msgtime, kind='stable')
+
+        self.Index = pd.DataFrame({'Time': msgtime[order],
+                                   'FileNumber': np.concatenate(file_number)[order],
+                                   'ByteOffset': np.concatenate(msgoffset)[order],
+                                   'MessageSize': np.concatenate(msgsize)[order],
+                                   'MessageType': np.concatenate(msgtype)[order]})
+        self.Index['MessageType'] = self.Index.MessageType.astype('category')
+        self.ping_times = np.unique(self.Index.Time.values[self.Index.MessageType.values == "b'#MRZ'"])
+
+    def __len__(self):
+        return len(self.ping_times)
+
+    @property
+    def start_time(self):
+        return float(self.Index.Time.iloc[0]) if len(self.Index) else None
+
+    @property
+    def end_time(self):
+        return float(self.Index.Time.iloc[-1]) if len(self.Index) else None
+
+    def get_file(self, file_number: int):
+        """
+        Return the open kmall object for the given file number (position in filenames), opening it if necessary and
+        closing the least recently used file if more than max_open_files would be open.
+        """
+
+        if file_number in self._open_files:
+            self._open_files.move_to_end(file_number)
+            return self._open_files[file_number]
+        km = kmall(self.filenames[file_number], use_mmap=self.use_mmap)
+        km.OpenFiletoRead()
+        km.file_size = os.path.getsize(km.filename)
+        self._open_files[file_number] = km
+        while len(self._open_files) > self.max_open_files:
+            self._open_files.popitem(last=False)[1].closeFile()
+        return km
+
+    def close(self):
+        """
+        Close all the open files
+        """
+        while self._open_files:
+            self._open_files.popitem(last=False)[1].closeFile()
+
+    def select(self, t0: float = None, t1: float = None, datagram_types: list = None):
+        """
+        Return the rows of Index with a time within t0 <= time <= t1 and one of the given datagram types
+
+        Parameters
+        ----------
+        t0
+            start of the window in utc seconds, default is the start of the collection
+        t1
+            end of the window in utc seconds, default is the end of the collection
+        datagram_types
+            list of datagram identifiers (ex: ['MRZ', 'SKM']), default is all of them
+
+        Returns
+        -------
+        pd.DataFrame
+            the selected rows of Index, in time order
+        """
+
+        times = self.Index.Time.values
+        first = 0 if t0 is None else np.searchsorted(times, t0, side='left')
+        last = len(times) if t1 is None else np.searchsorted(times, t1, side='right')
+        selected = self.Index.iloc[first:last]
+        if datagram_types is not None:
+            selected = selected[selected.MessageType.isin(["b'#{}'".format(dtyp) for dtyp in datagram_types])]
+        return selected
+
+    def ping_time_range(self, start: int, stop: int):
+        """
+        Return the time of the first and last ping of the pings numbered start to stop (exclusive, like a slice)
+        """
+
+        ping_times = self.ping_times[start:stop]
+        if not len(ping_times):
+            raise IndexError('KmallCollection: no pings in {}:{}, there are {} pings'.format(start, stop, len(self)))
+        return float(ping_times[0]), float(ping_times[-1])
+
+    def iter_datagrams(self, t0: float = None, t1: float = None, datagram_types: list = None, vectorized: bool = True):
+        """
+        Generator that decodes the datagrams selected by select, in time order across the files.
+
+        Returns
+        -------
+        tuple
+            (filename, byte offset, datagram identifier, datagram dict) for each datagram with a read method
+        """
+
+        selected = self.select(t0, t1, datagram_types)
+        for file_number, offset in zip(selected.FileNumber.values, selected.ByteOffset.values):
+            km = self.get_file(int(file_number))
+            km.FID.seek(int(offset))
+            km.datagram_data = None
+            km.decode_datagram()
+            if km.read_method is None or km.read_method == 'error':
+                continue
+            km.read_datagram(vectorized=vectorized)
+            yield km.filename, int(offset), km.datagram_ident, km.datagram_data
+
+    def read_time_range(self, t0: float, t1: float, datagram_types: list = None, serial_translator=None,
+                        fields: list = None):
+        """
+        Read the records with a datagram time within t0 <= time <= t1 from all the files in the window, returned as
+        one finalized dict of records, same as kmall.sequential_read_records.  As in kmall.read_time_range, the
+        installation and runtime parameters (IIP, IOP) of each file in the window are always read.
+
+        Parameters
+        ----------
+        t0
+            start of the window in utc seconds
+        t1
+            end of the window in utc seconds
+        datagram_types
+            see kmall.read_time_range
+        serial_translator
+            see kmall.sequential_read_records
+        fields
+            see kmall.sequential_read_records
+
+        Returns
+        -------
+        dict
+            dict of dicts for each desired record, same as sequential_read_records
+        """
+
+        first_km = self.get_file(0)
+        recs_categories, _, _ = first_km._build_sequential_read_categories()
+        if datagram_types is None:
+            datagram_types = list(recs_categories.keys())
+        invalid = [dtyp for dtyp in datagram_types if dtyp not in recs_categories]
+        if invalid:
+            raise ValueError('KmallCollection: {} not found in the datagrams read by sequential_read_records: {}'.format(
+                invalid, list(recs_categories.keys())))
+
+        in_window = self.select(t0, t1, datagram_types)
+        params = self.select(datagram_types=[dtyp for dtyp in ['IIP', 'IOP'] if dtyp in datagram_types])
+        params = params[params.FileNumber.isin(np.unique(in_window.FileNumber.values))]
+        selected = pd.concat([in_window, params])
+
+        raw_chunks = []
+        for file_number in np.unique(selected.FileNumber.values):
+            offsets = np.unique(selected.ByteOffset.values[selected.FileNumber.values == file_number])  # file order
+            raw_chunks.append(self.get_file(int(file_number))._sequential_read_raw(offsets=offsets, fields=fields))
+        if not raw_chunks:
+            raw_chunks.append(first_km._sequential_read_raw(offsets=[], fields=fields))
+        recs_to_read, recs_count = first_km._merge_raw_records(raw_chunks)
+        recs_to_read = first_km._finalize_records(recs_to_read, recs_count, serial_translator=serial_translator)
+        recs_to_read['format'] = 'kmall'
+        return recs_to_read
+
+    def read_ping_range(self, start: int, stop: int, datagram_types: list = None, serial_translator=None,
+                        fields: list = None):
+        """
+        Read the pings numbered start to stop (exclusive) and the other datagrams in the same time span, see
+        read_time_range
+        """
+
+        t0, t1 = self.ping_time_range(start, stop)
+        return self.read_time_range(t0, t1, datagram_types=datagram_types, serial_translator=serial_translator,
+                                    fields=fields)
+
+
+def reserve_flat_columns(columns: dict, dtypes: dict, used: int, needed: int, initial_capacity: int):
+    """
+    Make room for needed values in a dict of flat preallocated arrays, used by kmall.extract_point_cloud and the
+    kmall_backscatter_reader to collect the values of each ping without building a list of small arrays.  The arrays
+    are allocated with initial_capacity values on the first call (columns is None) and double in size when full.
+
+    Parameters
+    ----------
+    columns
+        dict of name: flat numpy array, or None on the first call
+    dtypes
+        dict of name: dtype of the arrays to allocate
+    used
+        number of values already written to each array, kept when the arrays grow
+    needed
+        number of values the arrays need to hold
+    initial_capacity
+        size of the arrays allocated on the first call
+
+    Returns
+    -------
+    dict
+        columns, or new larger arrays holding its first used values
+    """
+
+    if columns is None:
+        return {ky: np.empty(max(initial_capacity, needed, 1), dtype=dtyp) for ky, dtyp in dtypes.items()}
+    capacity = next(iter(columns.values())).size
+    if needed > capacity:
+        capacity = max(2 * capacity, needed)
+        for ky in columns:
+            newarr = np.empty(capacity, dtype=columns[ky].dtype)
+            newarr[:used] = columns[ky][:used]
+            columns[ky] = newarr
+    return columns
+
+
+def _partial_dtype(dtype: np.dtype, names: list, itemsize: int = None):
+    """
+    Return a structured dtype with only the given fields of dtype, at their original offsets, with the given itemsize
+    (the record stride, defaults to dtype.itemsize).  Used to decode only some columns of a record array with
+    np.frombuffer.  The stride comes from the datagram, raises CorruptPacketError if it is too short to hold the fields.
+    """
+    if itemsize is None:
+        itemsize = dtype.itemsize
+    fields_end = max([dtype.fields[nm][1] + dtype.fields[nm][0].itemsize for nm in names], default=0)
+    if itemsize < fields_end:
+        raise CorruptPacketError(f"Corrupt packet: record size {itemsize} is smaller than the {fields_end} bytes "
+                                 f"needed for the decoded fields")
+    return np.dtype({'names': list(names), 'formats': [dtype.fields[nm][0] for nm in names],
+                     'offsets': [dtype.fields[nm][1] for nm in names], 'itemsize': itemsize})
+
+
+def extract_point_clouds(filenames: list, include_uncertainty: bool = False, include_flags: bool = False,
+                         output_file: str = None, num_workers: int = 1):
+    """
+    Run kmall.extract_point_cloud over many kmall files.  Returns the points of all files as flat arrays, with a
+    'file_index' array giving the position of the source file in filenames, or writes them to output_file.
+
+    The output file is a flat binary file of records with the numpy structured dtype returned by this function, so it
+    can be read back with np.fromfile(output_file, dtype=dtype) or np.memmap.  Files are written as they are read, only
+    the points of the files being processed are held in memory.
+
+    Parameters
+    ----------
+    filenames
+        list of paths to kmall files
+    include_uncertainty
+        see kmall.extract_point_cloud
+    include_flags
+        see kmall.extract_point_cloud
+    output_file
+        optional path to a binary file to write the points to, instead of returning them
+    num_workers
+        number of processes to extract files in parallel, 1 to run in this process
+
+    Returns
+    -------
+    dict
+        dict of flat arrays for all points, see kmall.extract_point_cloud, if output_file is None
+    np.dtype
+        the record dtype of the output file, if output_file is provided
+    """
+
+    fields = [('longitude', '<f8'), ('latitude', '<f8'), ('z', '<f8')]
+    if include_uncertainty:
+        fields += [('tvu', '<f4'), ('thu', '<f4')]
+    if include_flags:
+        fields += [(fld, 'u1') for fld in point_cloud_flag_fields]
+    fields += [('file_index', '<u4')]
+    record_dtype = np.dtype(fields)
+
+    args = [(fil, include_uncertainty, include_flags) for fil in filenames]
+    if num_workers == 1:
+        results = (_extract_point_cloud_file(*arg) for arg in args)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=num_workers)
+        results = pool.map(_extract_point_cloud_file, *zip(*args)) if args else iter([])
+
+    try:
+        if output_file is not None:
+            with open(output_file, 'wb') as ofile:
+                for file_index, points in enumerate(results):
+                    records = np.empty(points['z'].size, dtype=record_dtype)
+                    for fld in record_dtype.names:
+                        records[fld] = points[fld] if fld != 'file_index' else file_index
+                    records.tofile(ofile)
+            return record_dtype
+        else:
+            allpoints = []
+            for file_index, points in enumerate(results):
+                points['file_index'] = np.full(points['z'].size, file_index, dtype=np.uint32)
+                allpoints.append(points)
+            return {fld: np.concatenate([pts[fld] for pts in allpoints]) if allpoints else np.zeros(0, dtype=dtyp)
+                    for fld, dtyp in fields}
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _extract_point_cloud_file(filename: str, include_uncertainty: bool, include_flags: bool):
+    """
+    Worker for extract_point_clouds, extract the points of one file
+    """
+    km = kmall(filename, use_mmap=True)
+    try:
+        return km.extract_point_cloud(include_uncertainty=include_uncertainty, include_flags=include_flags)
+    finally:
+        km.closeFile()
+
+
+def compress_kmall_file(filename: str, output_file: str = None, level: int = 0, codec: str = None,
+                        num_workers: int = None, task_bytes: int = archive_task_bytes):
+    """
+    Write a compressed copy of a kmall file, MRZ datagrams are rewritten as CZ0 (level 0, encoded/compressed soundings
+    and imagery) or CZ1 (level 1, encoded/compressed soundings, imagery dropped), see kmall.write_EMdgmCZ0 and
+    kmall.write_EMdgmCZ1.  The other datagrams are copied unchanged.  The soundings are encoded to a fixed resolution
+    (see kmall.encodeAndCompressSoundings), so this is somewhat lossy.
+
+    The file is split into tasks of about task_bytes and the tasks are converted in a process pool, the output is
+    written in the original datagram order as the tasks finish, with only a few tasks held in memory at once.
+
+    Parameters
+    ----------
+    filename
+        path to the kmall file
+    output_file
+        path to the compressed file, defaults to filename + '.0z' (or '.1z' for level 1)
+    level
+        compression level, 0 or 1
+    codec
+        one of sounding_codecs, default_sounding_codec if None
+    num_workers
+        number of processes, defaults to os.cpu_count(), 1 to run in this process
+    task_bytes
+        approximate size of the input converted by each task
+
+    Returns
+    -------
+    dict
+        statistics for the conversion, see _convert_kmall_file
+    """
+
+    if level not in [0, 1]:
+        raise ValueError('compress_kmall_file: level must be 0 or 1, got {}'.format(level))
+    if codec is not None and codec not in sounding_codecs:
+        raise ValueError('compress_kmall_file: unknown codec {}, expected one of {}'.format(codec, list(sounding_codecs.keys())))
+    if output_file is None:
+        output_file = filename + '.{}z'.format(level)
+    return _convert_kmall_file(filename, output_file, 'compress', level, codec, num_workers, task_bytes)
+
+
+def decompress_kmall_file(filename: str, output_file: str = None, num_workers: int = None,
+                          task_bytes: int = archive_task_bytes):
+    """
+    Reverse compress_kmall_file, CZ0/CZ1 datagrams are decoded (kmall.read_EMdgmCZ0/read_EMdgmCZ1) and written back as
+    MRZ datagrams, the other datagrams are copied unchanged.  The codec is recognized from the data.  The soundings
+    match the original within the resolution they were encoded to, imagery is absent from datagrams compressed at
+    level 1.
+
+    Parameters
+    ----------
+    filename
+        path to the compressed kmall file
+    output_file
+        path to the decompressed kmall file, defaults to filename without the compression suffix, ex:
+        0000_20200101_000000.kmall.0z -> 0000_20200101_000000.kmall
+    num_workers
+        number of processes, defaults to os.cpu_count(), 1 to run in this process
+    task_bytes
+        approximate size of the input converted by each task
+
+    Returns
+    -------
+    dict
+        statistics for the conversion, see _convert_kmall_file
+    """
+
+    if output_file is None:
+        tokens = compressed_kmall_regex.search(filename)
+        if tokens is None:
+            raise ValueError('decompress_kmall_file: expected a file name like xxxxx.kmall.0z, got {}'.format(filename))
+        output_file = tokens['basename']
+    return _convert_kmall_file(filename, output_file, 'decompress', None, None, num_workers, task_bytes)
+
+
+def _convert_kmall_file(filename: str, output_file: str, mode: str, level: int, codec: str, num_workers: int,
+                        task_bytes: int):
+    """
+    Shared driver of compress_kmall_file and decompress_kmall_file (mode 'compress' or 'decompress')
+
+    Returns
+    -------
+    dict
+        input_bytes, output_bytes, ratio (input_bytes / output_bytes), seconds, throughput (input MB per second),
+        converted (number of datagrams rewritten) and datagrams (total number of datagrams)
+    """
+
+    starttime = time.perf_counter()
+    km = kmall(filename)
+    km.index_file(use_sidecar=mode == 'compress')  # no index sidecar next to a compressed file
+    km.closeFile()
+    offsets = np.asarray(km.msgoffset, dtype=np.int64)
+    sizes = np.asarray(km.msgsize, dtype=np.int64)
+    msgtype = np.asarray(km.msgtype, dtype=str)
+
+    # contiguous runs of datagrams of about task_bytes each
+    task_number = (np.cumsum(sizes) - sizes) // max(int(task_bytes), 1)
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(task_number)) + 1, [len(offsets)]]).astype(int)
+    tasks = [(filename, offsets[strt:end], sizes[strt:end], msgtype[strt:end], mode, level, codec)
+             for strt, end in zip(bounds[:-1], bounds[1:]) if end > strt]
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    converted = 0
+    with open(output_file, 'wb') as ofile:
+        if num_workers == 1:
+            for task in tasks:
+                buffer, task_converted = _convert_kmall_datagrams(*task)
+                ofile.write(buffer)
+                converted += task_converted
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            from collections import deque
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                pending = deque()
+                for task in tasks:
+                    pending.append(pool.submit(_convert_kmall_datagrams, *task))
+                    while len(pending) >= 2 * num_workers or (pending and pending[0].done()):
+                        buffer, task_converted = pending.popleft().result()
+                        ofile.write(buffer)
+                        converted += task_converted
+                while pending:
+                    buffer, task_converted = pending.popleft().result()
+                    ofile.write(buffer)
+                    converted += task_converted
+
+    seconds = time.perf_counter() - starttime
+    input_bytes = os.path.getsize(filename)
+    output_bytes = os.path.getsize(output_file)
+    return {'input_file': filename, 'output_file': output_file, 'input_bytes': input_bytes,
+            'output_bytes': output_bytes, 'ratio': input_bytes / output_bytes if output_bytes else np.nan,
+            'seconds': seconds, 'throughput': input_bytes / 1e6 / seconds if seconds else np.nan,
+            'converted': converted, 'datagrams': len(offsets)}
+
+
+def _convert_kmall_datagrams(filename: str, offsets: np.ndarray, sizes: np.ndarray, msgtype: np.ndarray, mode: str,
+                             level: int, codec: str):
+    """
+    Process pool worker for _convert_kmall_file, convert one run of datagrams, returning the converted bytes and the
+    number of datagrams rewritten.  A datagram that fails to convert is copied unchanged.
+    """
+
+    reader = kmall(filename)
+    reader.OpenFiletoRead()
+    writer = copy.copy(reader)
+    output = []
+    converted = 0
+    try:
+        for offset, size, mtype in zip(offsets, sizes, msgtype):
+            reader.FID.seek(int(offset))
+            writer.FID = io.BytesIO()
+            try:
+                if mode == 'compress' and mtype == "b'#MRZ'":
+                    dg = reader.read_EMdgmMRZ()
+                    if level == 0:
+                        writer.write_EMdgmCZ0(dg, codec=codec)
+                    else:
+                        writer.write_EMdgmCZ1(dg, codec=codec)
+                elif mode == 'decompress' and mtype in ["b'#CZ0'", "b'#CZ1'"]:
+                    dg = reader.read_EMdgmCZ0() if mtype == "b'#CZ0'" else reader.read_EMdgmCZ1()
+                    writer.write_EMdgmMRZ(dg)
+                else:
+                    output.append(reader.FID.read(int(size)))
+                    continue
+                output.append(writer.FID.getvalue())
+                converted += 1
+            except (CorruptPacketError, struct.error, ValueError, IndexError) as e:
+                print('Unable to {} datagram at byte offset {} in {}, copying it unchanged: {}'.format(mode, offset, filename, e))
+                reader.FID.seek(int(offset))
+                output.append(reader.FID.read(int(size)))
+    finally:
+        reader.closeFile()
+    return b''.join(output), converted
+
+
+def _read_raw_records_chunk(filename: str, start_ptr: int, end_ptr: int, use_mmap: bool = False, fields: list = None):
+    """
+    Process pool worker for kmall.parallel_read_records, read the raw records of one chunk of the file
+    """
+    km = kmall(filename, use_mmap=use_mmap)
+    try:
+        return km._sequential_read_raw(start_ptr, end_ptr, fields=fields)
+    finally:
+        km.closeFile()
+
+
 def print_some_records(file_object, recordnum: int = 50):
     """
     Used in Kluster file analyzer, print out the first x records in the file for the user to examine
@@ -4607,11 +6683,15 @@ def main(args=None):
                         default=False, help=("Decompress a file compressed with this library. " +
                                              "Files must end in .Lz, where L is an integer indicating " +
                                              "the compression level (set by -l when compresssing)"))
+    parser.add_argument('-c', action='store', dest='codec', default=None, choices=list(sounding_codecs.keys()),
+                        help="Codec used to compress the soundings and imagery with -z (Default: %s)" % default_sounding_codec)
+    parser.add_argument('-j', action='store', type=int, dest='num_workers', default=None,
+                        help="Number of processes used to compress/decompress (Default: number of cpus)")
 
     parser.add_argument('-v', action='count', dest='verbose', default=0,
                         help="Increasingly verbose output (e.g. -v -vv -vvv),"
                              "for debugging use -vvv")
-    args = parser.parse_args()
+    args = parser.parse_args(args)
 
     verbose = args.verbose
 
@@ -4628,8 +6708,6 @@ def main(args=None):
         sys.exit()
 
     suffix = "kmall"
-    if decompress:
-        suffix
 
     if kmall_directory:
         filestoprocess = []
@@ -4637,10 +6715,13 @@ def main(args=None):
         if verbose >= 3:
             print("directory: " + kmall_directory)
 
-        # Recursively work through the directory looking for kmall files.
+        # Recursively work through the directory looking for kmall files, or compressed kmall files to decompress.
         for root, subFolders, files in os.walk(kmall_directory):
             for fileval in files:
-                if fileval[-suffix.__len__():] == suffix:
+                if decompress:
+                    if compressed_kmall_regex.search(fileval):
+                        filestoprocess.append(os.path.join(root, fileval))
+                elif fileval[-suffix.__len__():] == suffix:
                     filestoprocess.append(os.path.join(root, fileval))
     else:
         filestoprocess = [kmall_filename]
@@ -4659,8 +6740,9 @@ def main(args=None):
         if (K.verbose >= 1):
             print("Processing file: %s" % K.filename)
 
-        # Index file (check for index)
-        K.index_file()
+        # Index file (check for index), compress_kmall_file/decompress_kmall_file index the file themselves
+        if verify or not (compress or decompress):
+            K.index_file()
 
         ## Do packet verification if requested.
         pingcheckdata = []
@@ -4673,7 +6755,7 @@ def main(args=None):
 
             K.extract_attitude()
             # Report gaps in attitude data.
-            dt_att = np.diff([x.timestamp() for x in K.att["datetime"]])
+            dt_att = np.diff(K.att["dgtime"])
             navcheckdata.append([np.min(np.abs(dt_att)),
                                  np.max(dt_att),
                                  np.mean(dt_att),
@@ -4705,73 +6787,32 @@ def main(args=None):
 
         ## Do compression if desired, at the desired level.
         if compress:
-
+            K.closeFile()
             if compressionLevel == 0:
-
                 print("Compressing soundings and imagery.")
-                compressedFilename = K.filename + ".0z"
-
-                # Modify filename if the file already exists
-                idx = 1
-                while os.path.exists(compressedFilename):
-                    compressedFilename = ((K.filename + "_" + "%02d.0z") % idx)
-                    idx += 1
-
-                T = kmall(compressedFilename)
-                K.index_file()
-                T.OpenFiletoWrite()
-
-                for offset, size, mtype in zip(K.Index['ByteOffset'],
-                                               K.Index['MessageSize'],
-                                               K.Index['MessageType']):
-                    K.FID.seek(offset, 0)
-                    if mtype == "b'#MRZ'":
-                        dg = K.read_EMdgmMRZ()
-                        T.write_EMdgmCZ0(dg)
-                    else:
-                        buffer = K.FID.read(size)
-                        T.FID.write(buffer)
-
-                K.closeFile()
-                T.closeFile()
-
-            if compressionLevel == 1:
-
+            else:
                 print("Compressing soundings, omitting imagery.")
-                compressedFilename = K.filename + ".1z"
-
-                # Modify filename if the file already exists
-                idx = 1
-                while os.path.exists(compressedFilename):
-                    compressedFilename = compressedFilename + "_" + str(idx)
-
-                T = kmall(compressedFilename)
-                K.index_file()
-                T.OpenFiletoWrite()
-
-                for offset, size, mtype in zip(K.Index['ByteOffset'],
-                                               K.Index['MessageSize'],
-                                               K.Index['MessageType']):
-                    K.FID.seek(offset, 0)
-                    if mtype == "b'#MRZ'":
-                        dg = K.read_EMdgmMRZ()
-                        T.write_EMdgmCZ1(dg)
-                    else:
-                        buffer = K.FID.read(size)
-                        T.FID.write(buffer)
 
-                K.closeFile()
-                T.closeFile()
+            # Modify filename if the file already exists
+            compressedFilename = K.filename + ".%dz" % compressionLevel
+            idx = 1
+            while os.path.exists(compressedFilename):
+                compressedFilename = ((K.filename + "_" + "%02d.%dz") % (idx, compressionLevel))
+                idx += 1
+
+            stats = compress_kmall_file(K.filename, compressedFilename, level=compressionLevel, codec=args.codec,
+                                        num_workers=args.num_workers)
+            print_conversion_stats(stats)
 
         # Decompress the file is requested.
         if decompress:
+            K.closeFile()
 
             # Discern the compression level and base filename.
-            regexp = '(?P<basename>.*\.kmall)\.(?P<level>\d+)z'
-            tokens = re.search(regexp, K.filename)
+            tokens = compressed_kmall_regex.search(K.filename)
             if tokens is None:
                 print("Could not discern compression level.")
-                print("Expecting xxxxx.kmall.\d+.z, where \d+ is 1 or more")
+                print("Expecting xxxxx.kmall.\\d+z, where \\d+ is 1 or more")
                 print("integers indicating the compression level.")
                 sys.exit()
 
@@ -4796,36 +6837,18 @@ def main(args=None):
                 print("Decompressing to: %s" % decompressedFilename)
                 print("Decompressing from Level: %s" % compressionLevel)
 
-            # Create kmall object for decompressed file and open it.
-            T = kmall(filename=decompressedFilename)
-            T.OpenFiletoWrite()
-
-            # Loop through the file, decompressing datagrams
-            # when necessary and just writing them when not.
-            for offset, size, mtype in zip(K.Index['ByteOffset'],
-                                           K.Index['MessageSize'],
-                                           K.Index['MessageType']):
-                K.FID.seek(offset, 0)
-                if compressionLevel == "0":
-
-                    if mtype == "b'#CZ0'":
-                        dg = K.read_EMdgmCZ0()
-                        T.write_EMdgmMRZ(dg)
-                    else:
-                        buffer = K.FID.read(size)
-                        T.FID.write(buffer)
-
-                if compressionLevel == "1":
+            stats = decompress_kmall_file(K.filename, decompressedFilename, num_workers=args.num_workers)
+            print_conversion_stats(stats)
 
-                    if mtype == "b'#CZ1'":
-                        dg = K.read_EMdgmCZ1()
-                        T.write_EMdgmMRZ(dg)
-                    else:
-                        buffer = K.FID.read(size)
-                        T.FID.write(buffer)
 
-            T.closeFile()
-            K.closeFile()
+def print_conversion_stats(stats: dict):
+    """
+    Print the statistics returned by compress_kmall_file/decompress_kmall_file
+    """
+    print("%s -> %s" % (stats['input_file'], stats['output_file']))
+    print("%d of %d datagrams converted, %d bytes -> %d bytes (ratio %0.2f), %0.1f s (%0.1f MB/s)" %
+          (stats['converted'], stats['datagrams'], stats['input_bytes'], stats['output_bytes'], stats['ratio'],
+           stats['seconds'], stats['throughput']))
 
 
 if __name__ == '__main__':
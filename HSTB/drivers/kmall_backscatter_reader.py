@@ -1,213 +1,295 @@
-from HSTB.drivers import kmall
-import matplotlib.pyplot as plt
-import numpy as np
+"""
+Backscatter calibration from kmall files: per depth mode, per tx sector correction curves of reflectivity against beam
+angle, relative to the mean reflectivity of the whole dataset.
+
+The files are read one at a time (in parallel with num_workers > 1), only the reflectivity, frequency, sector and
+beam angle columns of the MRZ soundings are decoded, and each file is reduced to sums and counts per (depth mode,
+sector, frequency, angle bin) before the next one is read, so the dataset is never held in memory:
+
+    from HSTB.drivers import kmall_backscatter_reader
+    result = kmall_backscatter_reader.compute_corrections(glob.glob(r"C:\\data\\calibration\\*.kmall"), num_workers=4)
+    kmall_backscatter_reader.plot_corrections(result)
+
+or from the command line:
+
+    python kmall_backscatter_reader.py C:\\data\\calibration --output corrections.npz --plot
+"""
+
+import argparse
 import glob
-from scipy.interpolate import interp1d
-import time
 import os
+import time
 
-# fle = r"C:\Users\samuel.umfress\Desktop\MBES_TestData\0000_20230404_090112.kmall"
-fle_dir = r'C:\Users\samuel.umfress\Documents\HSTB\Backscatter\KMALL Calibration Testing\FA100mData'
-fles = glob.glob(fle_dir+'\\*.kmall')
-
-start_time = time.time()
-
-def read_kmall_file(fle):
-    # This function reads a single .kmall file and returns a data array with reflectivty1, frequency, sector, beam_index,
-    # and beam angle. There is also an empty array for for the computed correction values.
-    # Also returns a integer cooresponding to the depth mode of the line.
-    # Note that limiting the number of pings computed is useful to speed up testing.
-
-    km = kmall.kmall(fle)
-    reflectivity1 = []
-    reflectivity2 = []
-    frequency = []
-    sector = []
-    first_swath_freqs = []
-    beam_index = []
-    beam_angle = []
-    while not km.eof:
-        km.decode_datagram()
-        if km.datagram_ident != 'MRZ':
-            km.skip_datagram()
-        else:
-            km.read_datagram()
-            depth_mode = km.datagram_data['pingInfo']['depthMode'] # this is gonna get the mode for every ping and only save the last one.
-            sector_frequencies = km.datagram_data['txSectorInfo']['centreFreq_Hz']
-            sector_numbs = km.datagram_data['sounding']['txSectorNumb']
-            frequency.append([sector_frequencies[sector] for sector in sector_numbs])
-            if len(frequency) == 1:
-                sector.append(sector_numbs)
-                first_swath_freqs = sector_frequencies
-            elif sector_frequencies == first_swath_freqs:
-                sector.append(sector_numbs)
+import numpy as np
+
+from HSTB.drivers import kmall
+
+# default beam angle bin edges in degrees (beamAngleReRx_deg), one degree bins from -80 to 80
+default_angle_bins = np.arange(-80, 81, 1, dtype=np.float64)
+
+# the per sounding columns returned by read_backscatter_columns, and their dtypes
+backscatter_columns = {'reflectivity1': np.float32, 'reflectivity2': np.float32, 'frequency': np.float32,
+                       'sector': np.uint8, 'beam_index': np.uint16, 'beam_angle': np.float32,
+                       'depth_mode': np.uint8, 'ping': np.uint32}
+
+
+def read_backscatter_columns(filename: str):
+    """
+    Read the backscatter columns of the main soundings (not the extra detections) of every MRZ datagram in a kmall
+    file, as flat arrays with one entry per sounding.
+
+    Uses kmall.iter_mrz_soundings to decode only the ping info, the tx sector frequencies and the wanted sounding fields
+    of each ping with np.frombuffer, corrupt datagrams are skipped.  The output arrays are preallocated from the number
+    of pings and the number of soundings in the first ping, and only grow (doubling) if needed.
+
+    Parameters
+    ----------
+    filename
+        path to a kmall file
+
+    Returns
+    -------
+    dict
+        dict of flat numpy arrays, see backscatter_columns: 'reflectivity1' and 'reflectivity2' (reflectivity1_dB,
+        reflectivity2_dB), 'frequency' (centreFreq_Hz of the tx sector of the sounding), 'sector' (txSectorNumb),
+        'beam_index' (soundingIndex), 'beam_angle' (beamAngleReRx_deg), 'depth_mode' (depthMode of the ping) and
+        'ping' (the ping number in the file, counting from 0)
+    """
+
+    km = kmall.kmall(filename, use_mmap=True)
+    sounding_fields = ['soundingIndex', 'txSectorNumb', 'reflectivity1_dB', 'reflectivity2_dB', 'beamAngleReRx_deg']
+    columns = None
+    count = 0
+    try:
+        for ping, pinginfo, sectors, soundings in km.iter_mrz_soundings(sounding_fields,
+                                                                         ['txSectorNumb', 'centreFreq_Hz'],
+                                                                         extra_detections=False):
+            end = count + len(soundings)
+            if columns is None:
+                initial_capacity = km.num_mrz_datagrams() * len(soundings)
+            columns = kmall.reserve_flat_columns(columns, backscatter_columns, count, end, initial_capacity)
+            # sector frequency lookup by txSectorNumb, sectors without an entry in txSectorInfo get NaN
+            sector_freq = np.full(256, np.nan, dtype=np.float32)
+            sector_freq[sectors['txSectorNumb']] = sectors['centreFreq_Hz']
+
+            columns['reflectivity1'][count:end] = soundings['reflectivity1_dB']
+            columns['reflectivity2'][count:end] = soundings['reflectivity2_dB']
+            columns['frequency'][count:end] = sector_freq[soundings['txSectorNumb']]
+            columns['sector'][count:end] = soundings['txSectorNumb']
+            columns['beam_index'][count:end] = soundings['soundingIndex']
+            columns['beam_angle'][count:end] = soundings['beamAngleReRx_deg']
+            columns['depth_mode'][count:end] = pinginfo['depthMode']
+            columns['ping'][count:end] = ping
+            count = end
+    finally:
+        km.closeFile()
+
+    if columns is None:
+        return {ky: np.zeros(0, dtype=dtyp) for ky, dtyp in backscatter_columns.items()}
+    return {ky: arr[:count] for ky, arr in columns.items()}
+
+
+def accumulate_backscatter(columns: dict, angle_bins: np.ndarray = default_angle_bins):
+    """
+    Reduce the backscatter columns of a file (see read_backscatter_columns) to the sum and count of reflectivity1 per
+    (depth mode, sector, frequency, angle bin), with one np.digitize and one np.bincount.  Soundings with a NaN
+    reflectivity, frequency or beam angle are dropped, soundings outside of angle_bins only count towards the totals.
+
+    Parameters
+    ----------
+    columns
+        dict of flat arrays from read_backscatter_columns
+    angle_bins
+        increasing beam angle bin edges in degrees, see default_angle_bins
+
+    Returns
+    -------
+    dict
+        'keys' (N, 3) int64 array of the (depth mode, sector, frequency in Hz) of each curve, 'sum' and 'count' (N,
+        number of bins) arrays, and 'total_sum' and 'total_count' of all valid soundings, used for the reference level
+    """
+
+    angle_bins = np.asarray(angle_bins, dtype=np.float64)
+    num_bins = angle_bins.size - 1
+    refl = columns['reflectivity1'].astype(np.float64)
+    valid = np.isfinite(refl) & np.isfinite(columns['frequency']) & np.isfinite(columns['beam_angle'])
+    result = {'total_sum': float(refl[valid].sum()), 'total_count': int(valid.sum())}
+
+    bin_index = np.digitize(columns['beam_angle'], angle_bins) - 1
+    valid &= (bin_index >= 0) & (bin_index < num_bins)
+    keys = np.column_stack([columns['depth_mode'][valid].astype(np.int64), columns['sector'][valid].astype(np.int64),
+                            np.rint(columns['frequency'][valid]).astype(np.int64)])
+    ukeys, key_index = np.unique(keys, axis=0, return_inverse=True)
+    flat_index = key_index.ravel() * num_bins + bin_index[valid]
+    size = ukeys.shape[0] * num_bins
+    result['keys'] = ukeys.reshape(-1, 3)
+    result['sum'] = np.bincount(flat_index, weights=refl[valid], minlength=size).reshape(-1, num_bins)
+    result['count'] = np.bincount(flat_index, minlength=size).reshape(-1, num_bins)
+    return result
+
+
+def merge_accumulations(accumulations: list):
+    """
+    Merge the outputs of accumulate_backscatter for several files into one, adding up the sums and counts of the
+    curves with the same (depth mode, sector, frequency)
+
+    Parameters
+    ----------
+    accumulations
+        list of dicts from accumulate_backscatter, all built with the same angle_bins
+
+    Returns
+    -------
+    dict
+        same structure as accumulate_backscatter, with the keys sorted
+    """
+
+    merged = {}
+    total_sum = 0.0
+    total_count = 0
+    num_bins = None
+    for acc in accumulations:
+        total_sum += acc['total_sum']
+        total_count += acc['total_count']
+        num_bins = acc['sum'].shape[1]
+        for key, sm, cnt in zip(map(tuple, acc['keys']), acc['sum'], acc['count']):
+            if key in merged:
+                merged[key][0] += sm
+                merged[key][1] += cnt
             else:
-                sector.append(np.add(sector_numbs, 3))
-
-            ref1_ping = km.datagram_data['sounding']['reflectivity1_dB']
-            reflectivity1.append(ref1_ping)
-            ref2_ping = km.datagram_data['sounding']['reflectivity2_dB']
-            reflectivity2.append(ref2_ping)
-            beam_index.append(km.datagram_data['sounding']['soundingIndex'])
-            beam_angle.append(km.datagram_data['sounding']['beamAngleReRx_deg'])
-
-        if len(reflectivity1) > 200: #cuts off at 200 pings to run faster for testing
-            break
-
-    reflectivity1 = np.array(reflectivity1)
-    reflectivity2 = np.array(reflectivity2)
-    frequency = np.array(frequency)
-    sector = np.array(sector)
-    beam_index = np.array(beam_index)
-    beam_angle = np.array(beam_angle)
-
-    data = np.zeros((np.shape(reflectivity1)[0], np.shape(reflectivity1)[1], 7))
-    data[:,:,0] = reflectivity1
-    data[:,:,1] = frequency
-    data[:,:,2] = sector
-    data[:,:,3] = beam_index
-    #data[:,:,4] will be used for the computed corr value
-    data[:,:,5] = beam_angle
-    data[:,:,6] = reflectivity2
-    return data, depth_mode
-    # return depth_mode
-
-def create_data_pile(fles):
-    # Concatenates all data arrays into a single "data pile" as if it were a single ping. I.e, concatenated along
-    # the ping number axis. Also returns the "ping" indices of the start and end of each line and the associated depth mode.
-
-    depth_mode_list = []
-    line_ind_start = []
-    line_ind_end = []
-    for n in range(len(fles)):
-        fle = fles[n]
-        data, depth_mode = read_kmall_file(fle)
-        if n == 0:
-            data_pile = data
-            line_ind_start.append(0)
-            line_ind_end.append(len(data))
+                merged[key] = [sm.copy(), cnt.copy()]
+    keys = sorted(merged)
+    num_bins = num_bins if num_bins is not None else default_angle_bins.size - 1
+    return {'keys': np.array(keys, dtype=np.int64).reshape(-1, 3),
+            'sum': np.array([merged[ky][0] for ky in keys], dtype=np.float64).reshape(-1, num_bins),
+            'count': np.array([merged[ky][1] for ky in keys], dtype=np.int64).reshape(-1, num_bins),
+            'total_sum': total_sum, 'total_count': total_count}
+
+
+def compute_corrections(filenames: list, angle_bins: np.ndarray = default_angle_bins, num_workers: int = 1):
+    """
+    Build the backscatter correction curves of a set of kmall calibration lines.
+
+    Each file is read with read_backscatter_columns and reduced with accumulate_backscatter in a worker process, the
+    partial sums are merged here.  The reference level is the mean reflectivity1 of all soundings of all files, and the
+    correction of a bin is the mean reflectivity1 of the soundings in the bin minus the reference level.
+
+    A curve is built for each (depth mode, tx sector number, sector centre frequency), so the swaths of a dual swath
+    mode that use different frequencies get their own curves.  Bins with no soundings are NaN.
+
+    Parameters
+    ----------
+    filenames
+        list of paths to kmall files
+    angle_bins
+        increasing beam angle bin edges in degrees, see default_angle_bins
+    num_workers
+        number of processes to read files in parallel, 1 to run in this process
+
+    Returns
+    -------
+    dict
+        'depth_mode', 'sector', 'frequency' (one entry per curve), 'corrections' (number of curves, number of bins) in
+        dB, 'counts' (number of soundings in each bin of each curve), 'angle_bins' (the bin edges), 'bin_centers' and
+        'reference' (the reference level in dB)
+    """
+
+    angle_bins = np.asarray(angle_bins, dtype=np.float64)
+    if angle_bins.ndim != 1 or angle_bins.size < 2 or np.any(np.diff(angle_bins) <= 0):
+        raise ValueError('kmall_backscatter_reader: angle_bins must be at least two increasing bin edges')
+
+    if num_workers == 1:
+        accumulations = [_accumulate_file(fil, angle_bins) for fil in filenames]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            accumulations = list(pool.map(_accumulate_file, filenames, [angle_bins] * len(filenames)))
+    merged = merge_accumulations(accumulations)
+
+    for mode in np.unique(merged['keys'][:, 0]):
+        num_lines = sum(bool(np.any(acc['keys'][:, 0] == mode)) for acc in accumulations)
+        if num_lines == 1:
+            print('kmall_backscatter_reader: For mode {}, only 1 line detected. Should there be a reciprocal '
+                  'line?'.format(mode))
+
+    reference = merged['total_sum'] / merged['total_count'] if merged['total_count'] else np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corrections = merged['sum'] / merged['count'] - reference
+    corrections[merged['count'] == 0] = np.nan
+    return {'depth_mode': merged['keys'][:, 0], 'sector': merged['keys'][:, 1], 'frequency': merged['keys'][:, 2],
+            'corrections': corrections, 'counts': merged['count'], 'angle_bins': angle_bins,
+            'bin_centers': (angle_bins[:-1] + angle_bins[1:]) / 2, 'reference': reference}
+
+
+def _accumulate_file(filename: str, angle_bins: np.ndarray):
+    """
+    Worker for compute_corrections, read and reduce one file
+    """
+    return accumulate_backscatter(read_backscatter_columns(filename), angle_bins)
+
+
+def plot_corrections(result: dict, show: bool = True):
+    """
+    Plot the correction curves from compute_corrections, one subplot per depth mode and one line per sector.  The angle
+    axis is flipped (-beamAngleReRx_deg) so the plot appears as if viewing the swath facing forward.
+
+    Parameters
+    ----------
+    result
+        dict from compute_corrections
+    show
+        if True, call plt.show()
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        the figure
+    """
+
+    import matplotlib.pyplot as plt
+
+    modes = np.unique(result['depth_mode'])
+    fig, axes = plt.subplots(max(len(modes), 1), 1, squeeze=False)
+    for ax, mode in zip(axes[:, 0], modes):
+        for idx in np.nonzero(result['depth_mode'] == mode)[0]:
+            ax.plot(-result['bin_centers'], result['corrections'][idx],
+                    label='Sector #{} ({:.1f} kHz)'.format(result['sector'][idx], result['frequency'][idx] / 1000))
+        ax.set_title('Depth mode {}'.format(mode))
+        ax.set_xlabel('Beam Angle (Degrees)')
+        ax.set_ylabel('Correction Value (dB)')
+        ax.legend()
+    if show:
+        plt.show()
+    return fig
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compute backscatter correction curves from kmall calibration lines')
+    parser.add_argument('paths', nargs='+', help='kmall files, or directories of kmall files')
+    parser.add_argument('-o', '--output', help='npz file to save the correction curves to')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of processes to read files with')
+    parser.add_argument('--bin-size', type=float, default=1.0, help='beam angle bin size in degrees')
+    parser.add_argument('--max-angle', type=float, default=80.0, help='maximum absolute beam angle in degrees')
+    parser.add_argument('--plot', action='store_true', help='plot the correction curves')
+    args = parser.parse_args(args)
+
+    filenames = []
+    for pth in args.paths:
+        if os.path.isdir(pth):
+            filenames += sorted(glob.glob(os.path.join(pth, '*.kmall')))
         else:
-            data_pile = np.concatenate((data_pile, data), axis=0)
-            line_ind_start.append(line_ind_end[n-1]+1)
-            line_ind_end.append(line_ind_end[n-1]+1+len(data))
-        depth_mode_list.append(depth_mode)
-
-    #sorting mode, start/end indices based on mode. This section isn't necesarry if you sort in the corr function.
-    # depth_mode_list, line_ind_start, line_ind_end = zip(*sorted(zip(depth_mode_list, line_ind_start, line_ind_end)))
-    # depth_mode_list = list(depth_mode_list)
-    # line_ind_start = list(line_ind_start)
-    # line_ind_end = list(line_ind_end)
-
-    return data_pile, depth_mode_list, line_ind_start, line_ind_end
-
-
-def compute_ref_value(data_pile):
-    # Averages all reflectivity values into a single scalar value.
-    # If you want to filter out nadir and near nadir beams, you can do that easily with the beam indices though that's a
-    # bit hacky. If you want to do it for real you would need to build in a routine to do so based on beam angle.
-
-    ref1 = data_pile[:, :, 0] #if you wanted to filter out beams (i.e. nadir) you could do so with the first index here.
-    ref_val = np.mean(ref1)
-    return ref_val
-
-def compute_corr(data_pile, depth_mode_list, line_ind_start, line_ind_end, ref_val, beam_angle_bins):
-    corr_pile = np.subtract(data_pile[:,:,0], ref_val) #determining unique corr for every beam in every ping
-    data_pile[:,:,4] = corr_pile #integrating that into the open data_pile array.
-    depth_mode_set = np.array(list(set(depth_mode_list))) #determine a set of all modes in use.
-    depth_mode_list = np.array(depth_mode_list)
-    sector_pile = data_pile[:,:,2]
-    sectors = int(np.max(sector_pile) - np.min(sector_pile) + 1) #total number of sectors in question
-
-    calib_values = np.empty((sectors, len(beam_angle_bins), len(depth_mode_set))) #initializing an array to put the computer calibration values.
-    calib_values[:, :, :] = np.nan #Fill it with nans.
-
-    for i in range(len(depth_mode_set)): #looping through the modes
-        depth_mode = depth_mode_set[i]
-        mode_ind = np.nonzero(depth_mode_list == depth_mode)
-        if np.shape(mode_ind)[1] == 1:
-            data = data_pile[line_ind_start[mode_ind[0][0]]:line_ind_end[mode_ind[0][0]], :, :]
-            print('For mode ' + str(depth_mode) + ', only 1 line detected. Should there be a reciprocal line?')
-        if np.shape(mode_ind)[1] == 2:
-            data1 = data_pile[line_ind_start[mode_ind[0][0]]:line_ind_end[mode_ind[0][0]], :, :]
-            data2 = data_pile[line_ind_start[mode_ind[0][1]]:line_ind_end[mode_ind[0][1]], :, :]
-            data = np.concatenate((data1, data2), axis=0)
-        if np.shape(mode_ind)[1] >= 3:
-            print('Error: For mode ' + str(depth_mode) + ', three lines were detected. There probably should be 2')
-            break
-        #the result of the above 13 lines is a snippet of the data pile for a given mode
-
-        reflectivity1 = data[:,:,0]
-        sector = data[:,:,2]
-        # beam_index = data[:,:,3]
-        # corr = data[:,:,4]
-        # beam_angle = data[:,:,5]
-
-        sectors = int(np.max(sector) - np.min(sector) + 1)
-        num_pings = data.shape[0]
-        corr_angle_rel = np.zeros((num_pings, len(beam_angle_bins), sectors))
-        corr_angle_rel[:, :, :] = np.nan
-
-        for n in range(sectors): #looping through the sectors
-            ind = np.nonzero(data[:,:,2] != n)
-            data_sector = np.zeros(data.shape)
-            data_sector[:,:,:] = data[:,:,:] #initializing data_sector as np.zeros array avoids using the same reference as data variable.
-            data_sector[ind] = np.nan
-            beam_angle = data_sector[:,:,5]
-            corr = data_sector[:,:,4]
-            # corr_angle_rel = np.zeros(num_pings, len(beam_angle_bins), sectors)
-            # corr_angle_rel[:,:,:] = np.nan
-
-            for m in range(num_pings): #looping through the pings
-                beam_angle_ping = beam_angle[m, :][np.isfinite(beam_angle[m, :])]
-                if len(beam_angle_ping) != 0:
-                    bin_ind1 = np.nonzero(np.nanmax(beam_angle_ping) > beam_angle_bins)[0][1]
-                    bin_ind2 = np.nonzero(np.nanmin(beam_angle_ping) > beam_angle_bins)[0][0]
-                    corr_ping = corr[m, :][np.isfinite(corr[m, :])]
-                    corr_angle_rel_ping = interp1d(beam_angle_ping, corr_ping)(beam_angle_bins[bin_ind1:bin_ind2])
-                    corr_angle_rel[m, bin_ind1:bin_ind2, n] = corr_angle_rel_ping
-
-            calib_values[n, :, i] = np.nanmean(corr_angle_rel[:, :, n], axis=0)
-
-    return data_pile, calib_values
-
-#Execute the Functions
-
-beam_angle_bins = np.arange(-80,80,1)*(-1) #Negative 1 is to align indexing with kmall convention.
-data_pile, depth_mode_list, line_ind_start, line_ind_end = create_data_pile(fles)
-ref_val = compute_ref_value(data_pile)
-data_pile, calib_values = compute_corr(data_pile, depth_mode_list, line_ind_start, line_ind_end, ref_val, beam_angle_bins)
-
-
-#Plotting
-
-fig_dp, ax_dp = plt.subplots(1,1)
-ax_dp.imshow(data_pile[:,:,0], aspect='auto')
-for q in range(len(line_ind_end)):
-    ind = line_ind_end[q]
-    ax_dp.plot(ind*np.ones(data_pile.shape[1]), label=os.path.basename(fles[q]) + ' line end')
-
-ax_dp.legend()
-
-num_modes = calib_values.shape[2] #number of modes
-num_sectors = calib_values.shape[0]
-fig_corr, ax_corr = plt.subplots(num_modes,1)
-
-for mode in range(num_modes):
-    for sector in range(num_sectors):
-        ax_corr[mode].plot(beam_angle_bins*(-1), calib_values[sector,:,mode], label='Sector #' + str(sector)) #*(-1) is so plot makes sense and appears as if viewing swath facing fwd.
-        ax_corr[mode].set_xlabel('Beam Angle (Degrees)')
-        ax_corr[mode].set_ylabel('Correction Value (dB)')
-    ax_corr[mode].legend()
-
-ref2_pile = data_pile[:, :, 6]
-rough_beam_angle = data_pile[:, :, 5]
-ref2_mean = np.mean(ref2_pile, axis=0)
-ba_mean = np.mean(rough_beam_angle, axis=0)
-fig_ref2, ax_ref2 = plt.subplots(1, 1)
-ax_ref2.plot(ba_mean, ref2_mean)
-
-print('Runtime is ', np.round((time.time()-start_time)/60,2), ' minutes.')
-
-plt.show()
-
-print('ITS THEEE END OF THE WORLLDDD AS WE KNOW IT')
\ No newline at end of file
+            filenames.append(pth)
+    angle_bins = np.arange(-args.max_angle, args.max_angle + args.bin_size / 2, args.bin_size)
+
+    start_time = time.time()
+    result = compute_corrections(filenames, angle_bins, num_workers=args.workers)
+    print('Computed {} correction curves from {} files, reference level {:.2f} dB, in {:.1f} seconds'.format(
+        len(result['depth_mode']), len(filenames), result['reference'], time.time() - start_time))
+    if args.output:
+        np.savez(args.output, **result)
+    if args.plot:
+        plot_corrections(result)
+
+
+if __name__ == '__main__':
+    main()
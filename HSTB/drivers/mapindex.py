@@ -0,0 +1,119 @@
+"""
+mapindex.py
+
+Versioned sidecar file for the record maps built by the par3, raw and r2 readers (the mappack.packdir dictionary of
+record type to an array of location, time, ... rows), also used for the par3 navarray (same dict of arrays shape).
+
+The map is written next to the data file as a numpy .npz with the format version and the size and modification time of
+the data file, so a map left over from an earlier version of the file (or of this format) is never used, and it is read
+back with allow_pickle=False, so loading a map never unpickles anything.  Replaces the pickled .par/.nav/.r2 maps.
+
+    packdir = load_map_index(infilename)
+    if packdir is None:  # missing, stale or unreadable, map the file and save the map for next time
+        ...
+        save_map_index(infilename, packdir)
+"""
+
+import os
+import numpy as np
+
+# version of the map index written by save_map_index, increment when the contents change
+map_index_version = 1
+
+
+def map_index_path(infilename):
+    """
+    Path to the map index file for a data file, ex: 0000_20200101_000000_ship.all.map.npz
+    """
+    return infilename + '.map.npz'
+
+
+def save_map_index(infilename, packdir, mapfilename=None):
+    """
+    Write a record map to the map index file, along with the map index format version and the size/modification time
+    of the data file, used to validate the map in load_map_index.
+
+    Parameters
+    ----------
+    infilename
+        path to the data file that was mapped
+    packdir
+        dict of record type (str, int or bytes) to an array (or list of rows) of numbers, see mappack.packdir
+    mapfilename
+        optional path to the map index file, defaults to map_index_path(infilename)
+
+    Returns
+    -------
+    bool
+        True if the map index was written
+    """
+
+    if mapfilename is None:
+        mapfilename = map_index_path(infilename)
+    keys = list(packdir.keys())
+    arrays = {}
+    for cnt, key in enumerate(keys):
+        try:
+            arr = np.asarray(packdir[key])
+        except ValueError:  # ragged rows, can't be stored without pickling
+            return False
+        if arr.dtype == object:
+            return False
+        arrays['packdir_{}'.format(cnt)] = arr
+    if keys and isinstance(keys[0], bytes):
+        key_kind = 'bytes'
+        key_names = [key.decode('latin-1') for key in keys]
+    else:
+        key_kind = 'int' if keys and isinstance(keys[0], (int, np.integer)) else 'str'
+        key_names = [str(key) for key in keys]
+    try:
+        with open(mapfilename, 'wb') as fil:
+            np.savez(fil, version=np.int32(map_index_version), file_size=np.int64(os.path.getsize(infilename)),
+                     file_mtime=np.float64(os.path.getmtime(infilename)), key_kind=np.array(key_kind),
+                     keys=np.array(key_names, dtype=str), **arrays)
+    except OSError:  # read only directory, etc., the map index is just an optimization
+        return False
+    return True
+
+
+def load_map_index(infilename, mapfilename=None):
+    """
+    Load the record map from the map index file if it exists, is the current map index format version and matches the
+    size/modification time of the data file.
+
+    Parameters
+    ----------
+    infilename
+        path to the data file
+    mapfilename
+        optional path to the map index file, defaults to map_index_path(infilename)
+
+    Returns
+    -------
+    dict
+        the record map, see save_map_index, or None if the data file needs to be mapped
+    """
+
+    if mapfilename is None:
+        mapfilename = map_index_path(infilename)
+    if not os.path.exists(mapfilename):
+        return None
+    try:
+        with np.load(mapfilename, allow_pickle=False) as idx:
+            if int(idx['version']) != map_index_version:
+                return None
+            if int(idx['file_size']) != os.path.getsize(infilename):
+                return None
+            if float(idx['file_mtime']) != os.path.getmtime(infilename):
+                return None
+            key_kind = str(idx['key_kind'])
+            packdir = {}
+            for cnt, key in enumerate(idx['keys'].tolist()):
+                if key_kind == 'int':
+                    key = int(key)
+                elif key_kind == 'bytes':
+                    key = key.encode('latin-1')
+                packdir[key] = idx['packdir_{}'.format(cnt)]
+    except Exception:  # corrupt/partially written map index, just rebuild it
+        return None
+    return packdir
@@ -57,11 +57,13 @@ from numpy import fft
 from numpy.lib.recfunctions import append_fields, merge_arrays
 import pyproj
 import datetime as dtm
-import pickle
 import struct
+import mmap
 import re
 import copy
 from glob import glob
+
+from HSTB.drivers.mapindex import map_index_path, save_map_index, load_map_index
 try:
     import tables as tbl
     have_tables = True
@@ -217,6 +219,22 @@ sonar_translator = {'em122': [None, 'tx', 'rx', None], 'em302': [None, 'tx', 'rx
                     'em3020': [None, 'tx', 'rx', None], 'em3020_dual': [None, 'txrx_port', 'txrx_stbd', None],
                     'me70': [None, 'txrx', None, None]}
 
+# the datagram header through the general counter and serial number fields, "1I2B1H2I2H".  For the water column
+#  datagram (107) the counter is the PingCounter, see AllRead.quickmap
+quickmap_header_dtype = np.dtype([('Bytes', '<u4'), ('Start', 'u1'), ('Type', 'u1'), ('Model', '<u2'),
+                                  ('Date', '<u4'), ('Time', '<u4'), ('Counter', '<u2'), ('Serial#', '<u2')])
+# smallest valid datagram size field, STX through the time stamp plus ETX and checksum
+quickmap_min_size = 15
+
+
+def _gather_records(filebytes, offsets, dtype):
+    """
+    Decode one dtype record at each of the byte offsets of the file bytes (a uint8 array over a memory map) with a
+    single fancy index, returns an array of dtype
+    """
+    index = np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(dtype.itemsize)
+    return filebytes[index].copy().view(dtype).ravel()
+
 
 class AllRead:
     """
@@ -288,13 +306,11 @@ class AllRead:
         """
         self.infile.close()
         if clean:
-            mapfilename = self.infilename + '.par'
-            navfilename = self.infilename + '.nav'
-            try:
-                os.remove(mapfilename)
-                os.remove(navfilename)
-            except FileNotFoundError:
-                pass
+            for filename in [map_index_path(self.infilename), self.navarray_path()]:
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
 
     def __enter__(self):
         """
@@ -1016,12 +1032,15 @@ class AllRead:
         recs_to_read['format'] = 'all'
         return recs_to_read
 
-    def mapfile(self, verbose=False, show_progress=True):
+    def mapfile(self, verbose=False, show_progress=True, quick=True):
         """
-        Maps the datagrams in the file.
+        Maps the datagrams in the file.  With quick=True the map is built with quickmap, which only reads the datagram
+        headers, otherwise every datagram is read (and water column datagrams decoded) in turn.
         """
         progress = 0
-        if not self.mapped:
+        if not self.mapped and quick:
+            self.quickmap(verbose=verbose)
+        elif not self.mapped:
             self.map = mappack(self.infilename)
             self.reset()
             if show_progress:
@@ -1029,6 +1048,8 @@ class AllRead:
             while not self.eof:
                 loc = self.infile.tell()
                 self.read()
+                if self.eof:
+                    break
                 dtype = self.packet.header[2]
                 dsize = self.packet.header[0]
                 try:
@@ -1068,30 +1089,161 @@ class AllRead:
         else:
             pass
 
-    def loadfilemap(self, mapfilename=''):
+    def quickmap(self, record_types=None, verbose=False):
+        """
+        Maps the datagrams in the file, producing the same map as mapfile without decoding any datagram.
+
+        The file is memory mapped and the datagrams are found by following the size field from one datagram to the next,
+        a datagram is accepted if it has the STX byte, a supported sonar model and the ETX byte where the size field
+        says it ends.  When that fails (corrupt data, or start_ptr not at a datagram) the next datagram is found with a
+        regular expression search for STX + datagram type + model, see _build_quickmap_regex.  The headers of all the
+        datagrams found are then decoded at once with quickmap_header_dtype, so the water column PingCounter comes
+        straight from the header and a file with water column is mapped without decoding any 107 datagram.  The byte
+        order follows byteswap, as in read.
+
+        Parameters
+        ----------
+        record_types
+            optional list of datagram types (int) to include in the map, all types are mapped if None
+        verbose
+            if True, display the map with printmap
+        """
+
+        self.map = mappack(self.infilename)
+        self.infile.seek(0, 2)
+        filesize = self.infile.tell()
+        if filesize > 0:
+            mm = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offsets = self._quickmap_offsets(mm, filesize)
+                # gather the headers of all the datagrams, clipping at the end of the file for the (tiny) datagrams
+                #  shorter than the full header
+                filebytes = np.frombuffer(mm, dtype=np.uint8)
+                header_dtype = quickmap_header_dtype.newbyteorder(self._quickmap_byteorder())
+                hdr_index = np.minimum(offsets[:, None] + np.arange(header_dtype.itemsize), filesize - 1)
+                headers = filebytes[hdr_index].copy().view(header_dtype).ravel()
+                del filebytes
+            finally:
+                mm.close()
+        else:
+            offsets = np.zeros(0, dtype=np.int64)
+            headers = np.zeros(0, dtype=quickmap_header_dtype)
+
+        # POSIX time from the YYYYMMDD date and milliseconds since midnight, as in Datagram.maketime
+        year = (headers['Date'] // 10000).astype(np.int64)
+        month = (headers['Date'] // 100 % 100).astype(np.int64)
+        day = (headers['Date'] % 100).astype(np.int64)
+        valid_date = (year > 0) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+        months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+        dates = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+        valid_date &= dates.astype('datetime64[M]') == months  # day past the end of the month
+        for loc in offsets[~valid_date]:
+            print(f'Unable to generate time for record at {loc}')
+        offsets = offsets[valid_date]
+        headers = headers[valid_date]
+        times = dates[valid_date].astype(np.int64) * 24 * 60 * 60 + headers['Time'] * 0.001
+
+        if record_types:
+            wanted = np.isin(headers['Type'], [int(rt) for rt in record_types])
+            offsets, headers, times = offsets[wanted], headers[wanted], times[wanted]
+        for dtype in np.unique(headers['Type']):
+            idx = np.nonzero(headers['Type'] == dtype)[0]
+            columns = [offsets[idx], times[idx], headers['Bytes'][idx]]
+            if dtype == 107:
+                columns.append(headers['Counter'][idx])
+            self.map.packdir[str(dtype)] = np.column_stack(columns).astype(np.float64)
+            self.map.sizedir[str(dtype)] = int(headers['Bytes'][idx].sum(dtype=np.int64))
+        self.map.finalize()
+        if '107' in self.map.packdir:
+            self.map.numwc = len(np.unique(self.map.packdir['107'][:, 3]))
+        if verbose:
+            self.map.printmap()
+        self.mapped = True
+        self.reset()
+
+    def _quickmap_byteorder(self):
+        """
+        The byte order of the datagram headers for quickmap, '<' or '>': the native byte order, or the other one if
+        byteswap is set, as in read.
+        """
+        native = '<' if sys.byteorder == 'little' else '>'
+        if self.byteswap:
+            return '>' if native == '<' else '<'
+        return native
+
+    def _build_quickmap_regex(self):
+        """
+        Build the regular expression for quickmap to find the next datagram, STX followed by one of the datagram types
+        in mappack.dtypes and one of the sonar models supported by this module.
+        """
+        recids = sorted(set(mappack().dtypes) | {107, 109, 110})
+        model_format = self._quickmap_byteorder() + 'H'
+        models = [re.escape(struct.pack(model_format, em)) for em in self.ems_with_rangeangle + self.ems_with_oldrangeangle]
+        return re.compile(b'\x02[' + re.escape(bytes(recids)) + b'](?:' + b'|'.join(models) + b')')
+
+    def _quickmap_offsets(self, mm, filesize):
+        """
+        Return the byte offsets of all the valid datagrams between start_ptr and start_ptr + filelen in the memory
+        mapped file, see quickmap
+        """
+        search = self._build_quickmap_regex()
+        header_format = self._quickmap_byteorder() + 'I2BH'
+        models = set(self.ems_with_rangeangle + self.ems_with_oldrangeangle)
+        end_ptr = min(self.start_ptr + self.filelen, filesize)
+        offsets = []
+        pos = self.start_ptr
+        while pos < end_ptr:
+            valid = False
+            if pos + 8 <= filesize:
+                size, start, dtype, model = struct.unpack_from(header_format, mm, pos)
+                end = pos + 4 + size
+                valid = start == 2 and model in models and quickmap_min_size <= size and end <= filesize and \
+                    mm[end - 3] == 3
+            if valid:
+                offsets.append(pos)
+                pos = end
+            else:
+                # resync on the next STX + type + model, the datagram starting 4 bytes (the size field) before it
+                m = search.search(mm, pos + 5)
+                if m is None:
+                    break
+                pos = m.start() - 4
+        return np.array(offsets, dtype=np.int64)
+
+    def loadfilemap(self, mapfilename='', save=True):
         """
-        Loads the packdir if the map object packdir has been saved previously.
+        Loads the packdir if the map object packdir has been saved previously
+        (see savefilemap).  If the map index is missing, out of date with the
+        file or unreadable, the file is mapped and, if save is True, the map
+        index rewritten.
         """
         if mapfilename == '':
-            mapfilename = self.infilename + '.par'
-        try:
-            self.map = mappack()
-            self.map.load(mapfilename)
+            mapfilename = map_index_path(self.infilename)
+        self.map = mappack(self.infilename)
+        if self.map.load(mapfilename):
             self.mapped = True
             print('Loaded file map ' + mapfilename)
-        except IOError:
-            print(mapfilename + ' map file not found.')
+        else:
+            print(mapfilename + ' map file not found or out of date, mapping file.')
+            self.mapped = False
+            self.mapfile(show_progress=False)
+            if save:
+                self.savefilemap(mapfilename)
 
-    def savefilemap(self):
+    def savefilemap(self, mapfilename=''):
         """
         Saves the mappack packdir dictionary for faster operations on a file in
-        the future.  The file is saved under the same name as the loaded file
-        but with a 'par' extension.
+        the future.  The map is saved as a versioned map index (see
+        HSTB.drivers.mapindex) under the same name as the loaded file with a
+        '.map.npz' extension.
         """
         if self.mapped:
-            mapfilename = self.infilename + '.par'
-            self.map.save(mapfilename)
-            print('file map saved to ' + mapfilename)
+            if mapfilename == '':
+                mapfilename = map_index_path(self.infilename)
+            if self.map.save(mapfilename):
+                print('file map saved to ' + mapfilename)
+            else:
+                print('unable to save file map to ' + mapfilename)
         else:
             print('no map to save.')
 
@@ -1167,10 +1319,10 @@ class AllRead:
             recordsremaining = list(range(ping.header['#OfDatagrams']))
             recordsremaining.pop(ping.header['Datagram#'] - 1)
             totalsamples, subbeams = ping.ampdata.shape
-            rx = np.zeros(numbeams, dtype=Data107.nrx_dtype)
+            rx = np.zeros(numbeams, dtype=Data107_nrx.hdr_dtype)
             # Initialize array to NANs. Source:http://stackoverflow.com/a/1704853/1982894
             ampdata = np.empty((totalsamples, numbeams), dtype=np.float32)
-            ampdata.fill(np.NAN)
+            ampdata.fill(np.nan)
 
             rx[:subbeams] = ping.rx
             ampdata[:, :subbeams] = ping.ampdata
@@ -1183,7 +1335,7 @@ class AllRead:
                     numsamples, subbeams = ping.ampdata.shape
                     if numsamples > totalsamples:
                         temp = np.empty((numsamples - totalsamples, numbeams), dtype=np.float32)
-                        temp.fill(np.NAN)
+                        temp.fill(np.nan)
                         ampdata = np.append(ampdata, temp, axis=0)
                         totalsamples = numsamples
                     rx[beamcount:beamcount + subbeams] = ping.rx
@@ -1199,6 +1351,98 @@ class AllRead:
             self.packet.subpack.header[6] = numbeams
             return self.packet.subpack
 
+    def extract_watercolumn(self, output_file, start_ping=0, end_ping=None, num_workers=1):
+        """
+        Extract the water column of a range of pings (or of the whole file)
+        into a (ping, sample, beam) float32 array in a .npy file, opened as a
+        memory map so lines far larger than memory can be extracted.  The
+        amplitudes are in dB (0.5 dB steps, as in Data107), NaN where a beam
+        has no sample.  Ping n of the output is the ping of
+        getwatercolumn(start_ping + n), with the beams sorted by beam
+        pointing angle and the samples counted from the start of the beam.
+
+        The beam pointing angle, detected range and ping information are
+        saved alongside, in output_file with '_beams.npz' in place of '.npy'.
+
+        The partial datagrams of each ping are assembled, and each ping
+        written to the output, by worker processes, each handling a block of
+        consecutive pings.  A first pass, also in the workers, walks the beam
+        headers of each datagram to size the output.
+
+        Parameters
+        ----------
+        output_file
+            path to the .npy file to write
+        start_ping
+            first ping to extract, counting water column pings from 0 as in getwatercolumn
+        end_ping
+            ping after the last ping to extract, None for the end of the file
+        num_workers
+            number of processes to extract pings in parallel, 1 to run in this process
+
+        Returns
+        -------
+        dict
+            'amplitude' (read only np.memmap of output_file), 'beam_angle' (degrees) and 'detected_range' (samples,
+            NaN if no detection) as (ping, beam) float32 arrays, NaN for beams the ping does not have, and one entry per
+            ping for 'ping_time', 'ping_counter', 'sound_speed' (m/s) and 'sampling_frequency' (Hz)
+        """
+        if not self.mapped:
+            self.mapfile()
+        if '107' not in self.map.packdir:
+            raise ValueError('{}: no water column records (107) in this file'.format(self.infilename))
+        wcmap = self.map.packdir['107']
+        pinglist = np.unique(wcmap[:, 3])
+        selected = pinglist[start_ping:end_ping]
+        if len(selected) == 0:
+            raise ValueError('{}: no water column pings in the range {} to {}, {} water column records '
+                             'available.'.format(self.infilename, start_ping, end_ping, len(pinglist)))
+        # datagrams of the selected pings, grouped by ping, in file map order within each ping as in getwatercolumn
+        row_ping = np.searchsorted(selected, wcmap[:, 3])
+        inrange = (row_ping < len(selected)) & (selected[np.minimum(row_ping, len(selected) - 1)] == wcmap[:, 3])
+        rows = np.nonzero(inrange)[0]
+        rows = rows[np.argsort(row_ping[rows], kind='stable')]
+        row_ping = row_ping[rows]
+        offsets = wcmap[rows, 0].astype(np.int64)
+        first_row = np.searchsorted(row_ping, np.arange(len(selected)))
+        ping_time = wcmap[rows[first_row], 1]
+
+        num_chunks = 1 if num_workers == 1 else min(len(selected), 4 * num_workers)
+        ping_chunks = np.array_split(np.arange(len(selected)), num_chunks)
+        offset_chunks = [offsets[(row_ping >= chnk[0]) & (row_ping <= chnk[-1])] for chnk in ping_chunks]
+        if num_workers == 1:
+            pool = None
+            mapper = map
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=num_workers)
+            mapper = pool.map
+        try:
+            # size the output, most samples in any beam and most beams in any ping
+            scans = list(mapper(_scan_watercolumn_datagrams, [self.infilename] * num_chunks, offset_chunks))
+            max_samples = max(int(scn[0].max()) for scn in scans)
+            beams_per_ping = np.bincount(row_ping, weights=np.concatenate([scn[1] for scn in scans]))
+            num_beams = int(beams_per_ping.max())
+
+            amplitude = np.lib.format.open_memmap(output_file, mode='w+', dtype=np.float32,
+                                                  shape=(len(selected), max_samples, num_beams))
+            del amplitude  # the workers write the pings through their own memory maps
+            ping_rows = [row_ping[(row_ping >= chnk[0]) & (row_ping <= chnk[-1])] for chnk in ping_chunks]
+            results = list(mapper(_extract_watercolumn_pings, [self.infilename] * num_chunks,
+                                  [output_file] * num_chunks, ping_rows, offset_chunks))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        beams = {'beam_angle': np.concatenate([res['beam_angle'] for res in results]),
+                 'detected_range': np.concatenate([res['detected_range'] for res in results]),
+                 'ping_time': ping_time, 'ping_counter': selected.astype(np.uint16),
+                 'sound_speed': np.concatenate([res['sound_speed'] for res in results]),
+                 'sampling_frequency': np.concatenate([res['sampling_frequency'] for res in results])}
+        np.savez(os.path.splitext(output_file)[0] + '_beams.npz', **beams)
+        beams['amplitude'] = np.load(output_file, mmap_mode='r')
+        return beams
+
     def display(self):
         """
         Prints the current record header and record type header to the command
@@ -1252,21 +1496,10 @@ class AllRead:
             # look for time stamps in the time range
             idx_range = np.nonzero((tstamps <= maxtime) & (tstamps >= mintime))[0]
             if len(idx_range) > 0:
-                pos = self.navarray[str(postype)]
-                att = self.navarray[str(att_type)]
-                # for time stamps in the time range, find that nav and att
-                for i in idx_range:
-                    ts = tstamps[i]
-                    if pos[0, 0] < ts < pos[-1, 0]:
-                        prev = np.nonzero(pos[:, 0] <= ts)[0][-1]
-                        navpts[i, :3] = self._interp_points(tstamps[i], pos[prev, :], pos[prev + 1, :])
-                    else:
-                        navpts[i, :3] = np.nan
-                    if att[0, 0] < ts < att[-1, 0]:
-                        prev = np.nonzero(att[:, 0] <= tstamps[i])[0][-1]
-                        navpts[i, 3:] = self._interp_points(tstamps[i], att[prev, :], att[prev + 1, :])[1:]
-                    else:
-                        navpts[i, 3:] = np.nan
+                ts = tstamps[idx_range]
+                navpts[idx_range, :3] = self._interp_navarray(self.navarray[str(postype)], ts)
+                # heading is the last attitude column, interpolated the short way around the circle
+                navpts[idx_range, 3:] = self._interp_navarray(self.navarray[str(att_type)], ts, angle_col=4)[:, 1:5]
             # convert roll(3), pitch(4) and heading(6) into radians 
             if not degrees:
                 navpts[:, [3, 4, 6]] = np.deg2rad(navpts[:, [3, 4, 6]])
@@ -1282,6 +1515,33 @@ class AllRead:
         result = pt1 + (tstamp - pt1[0]) * delta / delta[0]
         return result
 
+    def _interp_navarray(self, arr, tstamps, angle_col=None):
+        """
+        Linearly interpolate all the columns of a navarray array (time in the
+        first column, sorted by time) at each of the time stamps, with one
+        np.searchsorted for all of them.  Time stamps that are not strictly
+        inside the time range of the array get NaN.  The column angle_col, if
+        provided, is an angle in degrees that is interpolated across the
+        0/360 wrap and returned in the range [0, 360).
+        """
+        tstamps = np.asarray(tstamps, dtype=np.float64)
+        result = np.full((len(tstamps), arr.shape[1]), np.nan)
+        if len(arr) < 2:
+            return result
+        times = arr[:, 0]
+        inside = (tstamps > times[0]) & (tstamps < times[-1])
+        ts = tstamps[inside]
+        prev = np.searchsorted(times, ts, side='right') - 1
+        pt1 = arr[prev]
+        delta = arr[prev + 1] - pt1
+        if angle_col is not None:
+            delta[:, angle_col] = (delta[:, angle_col] + 180) % 360 - 180
+        interp = pt1 + ((ts - pt1[:, 0]) / delta[:, 0])[:, None] * delta
+        if angle_col is not None:
+            interp[:, angle_col] %= 360
+        result[inside] = interp
+        return result
+
     def _build_navarray(self, allrecords=False):
         """
         The objective is to do the work of building an array of the navigation
@@ -1295,33 +1555,7 @@ class AllRead:
         self.navarray = {}
         if not self.mapped:
             self.mapfile()
-        if '80' in self.map.packdir:
-            print('creating position array')
-            numpos = len(self.map.packdir['80'])
-            self.navarray['80'] = np.zeros((numpos, 3))
-            for i in range(numpos):
-                self.getrecord(80, i)
-                if (self.packet.subpack.header['System'] & 3) == 1:
-                    self.navarray['80'][i, 0] = self.packet.time
-                    self.navarray['80'][i, 2] = self.packet.subpack.header[2]
-                    self.navarray['80'][i, 1] = self.packet.subpack.header[3]
-        if '65' in self.map.packdir:
-            print('creating attitude array (65)')
-            time = []
-            roll = []
-            pitch = []
-            heave = []
-            heading = []
-            numatt = len(self.map.packdir['65'])
-            for m in range(numatt):
-                p65 = self.getrecord(65, m)
-                if (p65.sensor_descriptor & 16) == 0:
-                    time += list(p65.data['Time'])
-                    roll += list(p65.data['Roll'])
-                    pitch += list(p65.data['Pitch'])
-                    heave += list(p65.data['Heave'])
-                    heading += list(p65.data['Heading'])
-            self.navarray['65'] = np.asarray(list(zip(time, roll, pitch, heave, heading)))
+        self.navarray.update(self._bulk_navarrays())
 
         if allrecords and '110' in self.map.packdir:
             print('creating attitude array (110)')
@@ -1379,44 +1613,105 @@ class AllRead:
                         downvel += list(pav.source_data['DownVelocity'])
             self.navarray['110'] = np.asarray(
                 list(zip(time, roll, pitch, heave, heading, exttime, rollrate, pitchrate, yawrate, downvel)))
-        if '104' in self.map.packdir:
-            print('creating altitude (depth) array')
-            num = len(self.map.packdir['104'])
-            self.navarray['104'] = np.zeros((num, 2))
-            for n in range(num):
-                self.getrecord(104, n)
-                self.navarray['104'][n, 0] = self.packet.gettime()
-                self.navarray['104'][n, 1] = self.packet.subpack.header['Height']
+
+    def _bulk_navarrays(self):
+        """
+        Build the position (80), attitude (65) and height (104) arrays of
+        _build_navarray without reading each record through getrecord.
+
+        The file is memory mapped and, for each record type, the record offsets
+        from the file map are visited in file order and the fixed fields (and
+        for attitude, all the samples of all the records) are gathered with one
+        fancy index and decoded with the record raw_dtype and conversions.  The
+        rows come out in file map (time) order, as from getrecord.  Position
+        records from other than the active positioning system (System & 3 != 1)
+        and attitude records from other than the active attitude sensor
+        (sensor descriptor & 16) are left out.
+        """
+        navarrays = {}
+        wanted = [key for key in ['80', '65', '104'] if key in self.map.packdir]
+        if not wanted:
+            return navarrays
+        mm = mmap.mmap(self.infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            filebytes = np.frombuffer(mm, dtype=np.uint8)
+            for key in wanted:
+                recmap = self.map.packdir[key]
+                # visit the records in file order, then put the decoded rows back in map order
+                order = np.argsort(recmap[:, 0], kind='stable')
+                offsets = recmap[order, 0].astype(np.int64)
+                times = recmap[order, 1]
+                reorder = np.empty_like(order)
+                reorder[order] = np.arange(len(order))
+                if key == '80':
+                    print('creating position array')
+                    pos = _gather_records(filebytes, offsets + 16, Data80.raw_dtype).astype(Data80.hdr_dtype)
+                    pos['Latitude'] /= 20000000.
+                    pos['Longitude'] /= 10000000.
+                    keep = ((pos['System'] & 3) == 1)[reorder]
+                    navarrays['80'] = np.column_stack([times, pos['Longitude'], pos['Latitude']])[reorder][keep]
+                elif key == '65':
+                    print('creating attitude array (65)')
+                    numentries = _gather_records(filebytes, offsets + 20, np.dtype('<u2')).astype(np.int64)
+                    sizes = recmap[order, 2].astype(np.int64)
+                    # sensor descriptor is the last byte before the ETX
+                    descriptor = filebytes[offsets + 4 + sizes - 4]
+                    keep = (descriptor & 16) == 0
+                    # the kept records in map order, so the samples come out in the same order as from getrecord
+                    recs = reorder[keep[reorder]]
+                    counts = numentries[recs]
+                    sample_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                    sample_offsets = np.repeat(offsets[recs] + 22, counts) + sample_index * Data65_att.hdr_sz
+                    att = _gather_records(filebytes, sample_offsets, Data65_att.raw_dtype).astype(Data65_att.hdr_dtype)
+                    for fld, factor in Data65_att.conversions.items():
+                        att[fld] *= factor
+                    att['Time'] = np.around(att['Time'] * 0.001 + np.repeat(times[recs], counts), 3)
+                    navarrays['65'] = np.column_stack([att['Time'], att['Roll'], att['Pitch'], att['Heave'],
+                                                       att['Heading']])
+                elif key == '104':
+                    print('creating altitude (depth) array')
+                    height = _gather_records(filebytes, offsets + 16, Data104.raw_dtype).astype(Data104.hdr_dtype)
+                    height['Height'] *= 0.01
+                    navarrays['104'] = np.column_stack([times, height['Height']])[reorder]
+            del filebytes
+        finally:
+            mm.close()
+        return navarrays
+
+    def navarray_path(self):
+        """
+        Path to the navarray file saved by save_navarray, the name of the all
+        file with a '.nav.npz' extension.
+        """
+        return self.infilename + '.nav.npz'
 
     def save_navarray(self):
         """
-        Creats an 'npy' file with the name of the all file that contains the
-        navigation array used.
+        Saves the navigation array, with the name of the all file and a
+        '.nav.npz' extension, as a versioned map index (see
+        HSTB.drivers.mapindex) so it is only loaded back for the same file.
         """
         if 'navarray' not in self.__dict__:
             self._build_navarray()
-        try:
-            navfilename = self.infilename + '.nav'
-            navfile = open(navfilename, 'wb')
-            pickle.dump(self.navarray, navfile)
-            navfile.close()
+        navfilename = self.navarray_path()
+        if save_map_index(self.infilename, self.navarray, mapfilename=navfilename):
             print("Saved navarray to " + navfilename)
-        except:
-            pass
+        else:
+            print("unable to save navarray to " + navfilename)
 
     def load_navarray(self):
         """
-        Loads an 'npy' file with the name of the all file that contains the
-        navigation array for this file name.
+        Loads the navigation array saved by save_navarray for this file name.
+        Returns False if it is missing, out of date with the file or
+        unreadable.
         """
-        try:
-            navfilename = self.infilename + '.nav'
-            navfile = open(navfilename, 'rb')
-            self.navarray = pickle.load(navfile)
-            print("Loaded navarray from " + navfilename)
-            navfile.close()
-        except:
+        navarray = load_map_index(self.infilename, mapfilename=self.navarray_path())
+        if navarray is None:
             print("No navarray file found.")
+            return False
+        self.navarray = navarray
+        print("Loaded navarray from " + self.navarray_path())
+        return True
 
     def plot_navarray(self):
         """
@@ -3732,37 +4027,23 @@ class Data107_nrx(BaseData):
         # declare rx stuff
         if read_limit is None:
             raise Exception("Must specify a number of rx datagrams to read")
-        p = 0  # pointer to where we are in the datablock
-        nrx_sz = self.hdr_size
+        nrx_sz = self.hdr_sz
         nrx = read_limit
-        self.header = np.zeros(nrx, dtype=self.raw_dtype)
-
-        # declare amplitudes stuff
-        amp_dtype = np.dtype([('SampleAmplitude', "b")])
-        numamp = len(datablock) - nrx_sz * nrx  # figures out the total number of amplitudes in the datablock
-        # Initialize array to NANs. Source:http://stackoverflow.com/a/1704853/1982894
-        tempamp = np.empty(numamp, dtype=amp_dtype)
-        tempamp[:] = np.NAN
-        # get the rx and amplitude data
-        pamp = 0
+        # walk the beam headers for where each beam starts, only the number of samples is needed to find the next one
+        starts = np.zeros(nrx, dtype=np.int64)
+        p = 0  # pointer to where we are in the datablock
         for n in range(nrx):
-            self.header[n] = np.frombuffer(datablock[p:p + nrx_sz], dtype=self.raw_dtype)
-            p += nrx_sz
-            # the number of samples for this beam
-            beamsz = self.header[n][2]
-            tempamp[pamp:pamp + beamsz] = np.frombuffer(datablock[p:p + beamsz], dtype=amp_dtype)
-            p += beamsz
-            pamp += beamsz
-        self.header = self.header.astype(self.hdr_dtype)
+            starts[n] = p
+            p += nrx_sz + struct.unpack_from('<H', datablock, p + 4)[0]
+        datablock = np.frombuffer(datablock, dtype=np.uint8)
+        self.header = _gather_records(datablock, starts, self.raw_dtype).astype(self.hdr_dtype)
         self.header['BeamPointingAngle'] *= 0.01
-        # unwined the beam data into an array
+        # unwind the beam data into a (sample, beam) array with one fancy index, NaN past the end of each beam
         numsamples = self.header['NumberSamples']
-        self.ampdata = np.empty((numsamples.max(), nrx), dtype=np.float32)
-        self.ampdata[:] = np.NAN
-        pamp = 0
-        for n in range(nrx):
-            self.ampdata[:numsamples[n], n] = 0.5 * tempamp[pamp:pamp + numsamples[n]].astype(np.float32)
-            pamp += numsamples[n]
+        samples = np.arange(numsamples.max(initial=0))[:, None]
+        inbeam = samples < numsamples
+        self.ampdata = np.full(inbeam.shape, np.nan, dtype=np.float32)
+        self.ampdata[inbeam] = 0.5 * datablock[(starts + nrx_sz + samples)[inbeam]].view(np.int8)
 
     def get_datablock(self, data=None):
         raise Exception("Not implemented")
@@ -4407,10 +4688,12 @@ class mappack:
         plt.legend(keys, loc='lower right')
         plt.grid()
 
-    def save(self, outfilename):
-        outfile = open(outfilename, 'wb')
-        pickle.dump(self.__dict__, outfile)
-        outfile.close()
+    def save(self, outfilename=None):
+        """
+        Save the packdir to the map index file, see HSTB.drivers.mapindex.save_map_index.  Returns True if the map
+        index was written.
+        """
+        return save_map_index(self.infilename, self.packdir, outfilename)
 
     def gettype(self, dtype):
         if int(dtype) in self.dtypes:
@@ -4419,11 +4702,20 @@ class mappack:
             out = ''
         return out
 
-    def load(self, infilename):
-        infile = open(infilename, 'rb')
-        self.__dict__ = pickle.load(infile)
-        infile.close()
-        self.totalfilesize = os.stat(infilename).st_size
+    def load(self, mapfilename=None):
+        """
+        Load the packdir from the map index file if it is valid for the mapped file, see
+        HSTB.drivers.mapindex.load_map_index.  The sizes and number of water column pings are rebuilt from the packdir.
+        Returns True if the map was loaded.
+        """
+        packdir = load_map_index(self.infilename, mapfilename)
+        if packdir is None:
+            return False
+        self.packdir = packdir
+        self.sizedir = {key: int(arr[:, 2].sum()) for key, arr in packdir.items()}
+        if '107' in packdir:
+            self.numwc = len(np.unique(packdir['107'][:, 3]))
+        return True
 
 
 def translate_detectioninfo(arr):
@@ -4569,9 +4861,7 @@ def plot_all_nav(directory='.'):
     n = 0
     for f in flist:
         a = AllRead(f)
-        if os.path.exists(f + '.nav'):
-            a.load_navarray()
-        else:
+        if not a.load_navarray():
             a._build_navarray()
             a.save_navarray()
         ax1.plot(a.navarray['80'][:, 1], a.navarray['80'][:, 2], clist[n])
@@ -4616,6 +4906,86 @@ def checksum_raw_rangeangleablock(raw_rangeangleablock):
     return _checksum_all_bytes(raw_rangeangleablock[5:-3])
 
 
+def _read_watercolumn_datagram(infile, offset):
+    """
+    Read and decode the water column datagram at offset in the open file, returns the Data107 subpack or None if the
+    datagram is not valid
+    """
+    infile.seek(int(offset))
+    packetsize = 4 + struct.unpack('<I', infile.read(4))[0]
+    infile.seek(int(offset))
+    packet = Datagram(infile.read(packetsize))
+    if not packet.valid or packet.dtype != 107:
+        return None
+    packet.decode()
+    return packet.subpack
+
+
+def _scan_watercolumn_datagrams(infilename, offsets):
+    """
+    Worker for AllRead.extract_watercolumn, walk the beam headers of each water column datagram at offsets without
+    decoding the amplitudes, returns the most samples in any beam and the number of beams of each datagram
+    """
+    max_samples = np.zeros(len(offsets), dtype=np.int64)
+    num_beams = np.zeros(len(offsets), dtype=np.int64)
+    with open(infilename, 'rb') as infile:
+        for cnt, offset in enumerate(offsets):
+            infile.seek(int(offset))
+            packetsize = 4 + struct.unpack('<I', infile.read(4))[0]
+            infile.seek(int(offset))
+            block = infile.read(packetsize)
+            header = np.frombuffer(block, dtype=Data107.raw_dtype, count=1, offset=16)[0]
+            num_beams[cnt] = header['NumberBeamsInDatagram']
+            ptr = 16 + Data107.hdr_sz + int(header['#TxSectors']) * Data107_ntx.hdr_sz
+            for _ in range(num_beams[cnt]):
+                numsamples = struct.unpack_from('<H', block, ptr + 4)[0]
+                max_samples[cnt] = max(max_samples[cnt], numsamples)
+                ptr += Data107_nrx.hdr_sz + numsamples
+    return max_samples, num_beams
+
+
+def _extract_watercolumn_pings(infilename, output_file, row_ping, offsets):
+    """
+    Worker for AllRead.extract_watercolumn, assemble the pings from the water column datagrams at offsets (row_ping
+    giving the output ping of each datagram, datagrams of a ping together) and write them to the output .npy file
+    """
+    amplitude = np.lib.format.open_memmap(output_file, mode='r+')
+    num_samples, num_beams = amplitude.shape[1:]
+    pings = np.unique(row_ping)
+    result = {'beam_angle': np.full((len(pings), num_beams), np.nan, dtype=np.float32),
+              'detected_range': np.full((len(pings), num_beams), np.nan, dtype=np.float32),
+              'sound_speed': np.full(len(pings), np.nan, dtype=np.float32),
+              'sampling_frequency': np.full(len(pings), np.nan, dtype=np.float64)}
+    with open(infilename, 'rb') as infile:
+        for cnt, ping in enumerate(pings):
+            slab = np.full((num_samples, num_beams), np.nan, dtype=np.float32)
+            rx = []
+            beamcount = 0
+            for offset in offsets[row_ping == ping]:
+                subpack = _read_watercolumn_datagram(infile, offset)
+                if subpack is None:
+                    print('Water column record at {} skipped.'.format(offset))
+                    continue
+                numsamples, subbeams = subpack.ampdata.shape
+                slab[:numsamples, beamcount:beamcount + subbeams] = subpack.ampdata
+                rx.append(subpack.rx)
+                beamcount += subbeams
+                result['sound_speed'][cnt] = subpack.header['SoundSpeed']
+                result['sampling_frequency'][cnt] = subpack.header['SamplingFrequency']
+            if rx:
+                rx = np.concatenate(rx)
+                sortidx = np.argsort(rx['BeamPointingAngle'])
+                slab[:, :beamcount] = slab[:, sortidx]
+                result['beam_angle'][cnt, :beamcount] = rx['BeamPointingAngle'][sortidx]
+                detected = rx['DetectedRange'][sortidx].astype(np.float32)
+                detected[detected == 0] = np.nan
+                result['detected_range'][cnt, :beamcount] = detected
+            amplitude[ping] = slab
+    amplitude.flush()
+    del amplitude
+    return result
+
+
 def main():
     if len(sys.argv) > 1:
         a = AllRead(sys.argv[0])
@@ -4704,16 +5074,14 @@ class useall(AllRead):
     def __init__(self, infilename, reload_map=True, save_filemap=True,
                  verbose=False, byteswap=False):
         AllRead.__init__(self, infilename, verbose, byteswap)
-        if reload_map and os.path.exists(infilename + '.par'):
-            self.loadfilemap()
+        if reload_map:
+            self.loadfilemap(save=save_filemap)
         else:
             self.mapfile(show_progress=verbose)
             if save_filemap:
                 self.savefilemap()
 
-        if reload_map and os.path.exists(infilename + '.nav'):
-            self.load_navarray()
-        else:
+        if not (reload_map and self.load_navarray()):
             self._build_navarray(allrecords=True)
             if save_filemap:
                 self.save_navarray()
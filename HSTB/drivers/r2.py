@@ -8,9 +8,10 @@ Intended to read R2Sonic files.
 
 import numpy as np
 from matplotlib import pyplot as plt
-import pickle
 import sys
 
+from HSTB.drivers.mapindex import map_index_path, save_map_index, load_map_index
+
 class read:
     """
     The class for handling the file.
@@ -84,7 +85,7 @@ class read:
         """
         progress = 0
         if not self.mapped:
-            self.map = mappack()
+            self.map = mappack(self.infilename)
             self.reset()
             print 'Mapping file;           ',
             while not self.eof:
@@ -110,30 +111,40 @@ class read:
         else:
             pass
         
-    def loadfilemap(self, mapfilename = ''):
+    def loadfilemap(self, mapfilename = '', save = True):
         """
-        Loads the packdir if the map object packdir has been saved previously.
+        Loads the packdir if the map object packdir has been saved previously
+        (see savefilemap).  If the map index is missing, out of date with the
+        file or unreadable, the file is mapped and, if save is True, the map
+        index rewritten.
         """
         if mapfilename == '':
-            mapfilename = self.infilename[:-3] + 'r2'
-        try:
-            self.map = mappack()
-            self.map.load(mapfilename)
+            mapfilename = map_index_path(self.infilename)
+        self.map = mappack(self.infilename)
+        if self.map.load(mapfilename):
             self.mapped = True
             print 'loaded file map ' + mapfilename
-        except IOError:
-            print mapfilename + ' map file not found.'
+        else:
+            print mapfilename + ' map file not found or out of date, mapping file.'
+            self.mapped = False
+            self.mapfile()
+            if save:
+                self.savefilemap(mapfilename)
             
-    def savefilemap(self):
+    def savefilemap(self, mapfilename = ''):
         """
         Saves the mappack packdir dictionary for faster operations on a file in
-        the future.  The file is saved under the same name as the loaded file
-        but with a 'par' extension.
+        the future.  The map is saved as a versioned map index (see
+        HSTB.drivers.mapindex) under the same name as the loaded file with a
+        '.map.npz' extension.
         """
         if self.mapped:
-            mapfilename = self.infilename[:-3] + 'r2'
-            self.map.save(mapfilename)
-            print 'file map saved to ' + mapfilename
+            if mapfilename == '':
+                mapfilename = map_index_path(self.infilename)
+            if self.map.save(mapfilename):
+                print 'file map saved to ' + mapfilename
+            else:
+                print 'unable to save file map to ' + mapfilename
         else:
             print 'no map to save.'
             
@@ -202,7 +213,7 @@ class use(read):
         """
         progress = 0
         if not self.mapped:
-            self.map = mappack()
+            self.map = mappack(self.infilename)
             self.reset()
             print 'Mapping file;           ',
             while not self.eof:
@@ -658,9 +669,10 @@ class mappack:
     """
     Container for the file packet map.
     """
-    def __init__(self):
+    def __init__(self, infilename=None):
         """Constructor creates a packmap dictionary"""
         self.packdir = {}
+        self.infilename = infilename
        
     def add(self, type, location=0, time=0):
         """Adds the location (byte in file) to the tuple for the value type"""
@@ -680,15 +692,23 @@ class mappack:
         for key in keys:
             print str(key[0]) + ' has ' + str(key[1]) + ' packets'
             
-    def save(self, outfilename):
-        outfile = open(outfilename, 'wb')
-        pickle.dump(self.packdir, outfile)
-        outfile.close()
+    def save(self, outfilename=None):
+        """
+        Save the packdir to the map index file, see HSTB.drivers.mapindex.save_map_index.  Returns True if the map
+        index was written.
+        """
+        return save_map_index(self.infilename, self.packdir, outfilename)
         
-    def load(self,infilename):
-        infile = open(infilename, 'rb')
-        self.packdir = pickle.load(infile)
-        infile.close()
+    def load(self, mapfilename=None):
+        """
+        Load the packdir from the map index file if it is valid for the mapped file, see
+        HSTB.drivers.mapindex.load_map_index.  Returns True if the map was loaded.
+        """
+        packdir = load_map_index(self.infilename, mapfilename)
+        if packdir is None:
+            return False
+        self.packdir = packdir
+        return True
 
         
 def main():        
@@ -30,7 +30,6 @@ as RAW1.
 import glob
 import os.path
 import sys
-import pickle
 import xml.etree.ElementTree as et
 import numpy as np
 import copy
@@ -41,6 +40,8 @@ import cv2
 
 import warnings
 
+from HSTB.drivers.mapindex import map_index_path, save_map_index, load_map_index
+
 plt.ion()
 
 saildrone_vessel_draft = 1.96
@@ -176,7 +177,7 @@ class readraw:
         """
         progress = 0
         if not self.mapped:
-            self.map = mappack()
+            self.map = mappack(self.infilename)
             self.reset()
             print('Mapping file;           ', end='')
             while not self.eof:
@@ -202,30 +203,40 @@ class readraw:
         else:
             pass
 
-    def loadfilemap(self, mapfilename=''):
+    def loadfilemap(self, mapfilename='', save=True):
         """
-        Loads the packdir if the map object packdir has been saved previously.
+        Loads the packdir if the map object packdir has been saved previously
+        (see savefilemap).  If the map index is missing, out of date with the
+        file or unreadable, the file is mapped and, if save is True, the map
+        index rewritten.
         """
         if mapfilename == '':
-            mapfilename = self.infilename[:-3] + 'nav'
-        try:
-            self.map = mappack()
-            self.map.load(mapfilename)
+            mapfilename = map_index_path(self.infilename)
+        self.map = mappack(self.infilename)
+        if self.map.load(mapfilename):
             self.mapped = True
             print(f'loaded file map {mapfilename}')
-        except IOError:
-            print(f'{mapfilename} map file not found.')
+        else:
+            print(f'{mapfilename} map file not found or out of date, mapping file.')
+            self.mapped = False
+            self.mapfile()
+            if save:
+                self.savefilemap(mapfilename)
 
-    def savefilemap(self):
+    def savefilemap(self, mapfilename=''):
         """
         Saves the mappack packdir dictionary for faster operations on a file in
-        the future.  The file is saved under the same name as the loaded file
-        but with a 'par' extension.
+        the future.  The map is saved as a versioned map index (see
+        HSTB.drivers.mapindex) under the same name as the loaded file with a
+        '.map.npz' extension.
         """
         if self.mapped:
-            mapfilename = self.infilename[:-3] + 'nav'
-            self.map.save(mapfilename)
-            print(f'file map saved to {mapfilename}')
+            if mapfilename == '':
+                mapfilename = map_index_path(self.infilename)
+            if self.map.save(mapfilename):
+                print(f'file map saved to {mapfilename}')
+            else:
+                print(f'unable to save file map to {mapfilename}')
         else:
             print('no map to save.')
 
@@ -1905,9 +1916,10 @@ class mappack:
     Container for the file packet map.
     """
 
-    def __init__(self):
+    def __init__(self, infilename=None):
         """Constructor creates a packmap dictionary"""
         self.packdir = {}
+        self.infilename = infilename
 
     def add(self, type, location=0, time=0, optional=None):
         """Adds the location (byte in file) to the tuple for the value type"""
@@ -1932,10 +1944,12 @@ class mappack:
         for entry in fmap:
             print(f'{entry[0]} has {entry[1]} packets')
 
-    def save(self, outfilename):
-        outfile = open(outfilename, 'wb')
-        pickle.dump(self.packdir, outfile)
-        outfile.close()
+    def save(self, outfilename=None):
+        """
+        Save the packdir to the map index file, see HSTB.drivers.mapindex.save_map_index.  Returns True if the map
+        index was written.
+        """
+        return save_map_index(self.infilename, self.packdir, outfilename)
 
     def getnum(self, recordtype):
         """
@@ -1946,10 +1960,16 @@ class mappack:
         else:
             return 0
 
-    def load(self, infilename):
-        infile = open(infilename, 'rb')
-        self.packdir = pickle.load(infile)
-        infile.close()
+    def load(self, mapfilename=None):
+        """
+        Load the packdir from the map index file if it is valid for the mapped file, see
+        HSTB.drivers.mapindex.load_map_index.  Returns True if the map was loaded.
+        """
+        packdir = load_map_index(self.infilename, mapfilename)
+        if packdir is None:
+            return False
+        self.packdir = packdir
+        return True
 
 
 class useraw(readraw):
@@ -1982,7 +2002,7 @@ class useraw(readraw):
         """
         progress = 0
         if not self.mapped:
-            self.map = mappack()
+            self.map = mappack(self.infilename)
             self.reset()
             print('Mapping file;           ', end='')
             while not self.eof:
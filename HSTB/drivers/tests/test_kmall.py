@@ -0,0 +1,857 @@
+import copy
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from HSTB.drivers import kmall
+
+# synthetic kmall file used by the tests below, built from the datagram definitions in kmall.py rather than from real
+#  sonar data so that the tests are self contained
+install_text = 'EMXV:EM2040,\nPU_0,\nSN=53011,\nIP=157.237.20.40:0xffff0000,\nUDP=1997,\n' \
+               'TRAI_TX1:N=218;X=1.000;Y=0.000;Z=0.500;R=0.000;P=0.000;H=0.000,\n' \
+               'TRAI_RX1:N=219;X=1.100;Y=0.000;Z=0.500;R=0.000;P=0.000;H=0.000,\n'
+start_time = 1600000000.0
+ping_interval = 0.5
+skm_interval = 0.1
+num_beams = 16
+num_sectors = 2
+
+
+def _header(dgm_type: bytes, numbytes: int, dgtime: float, version: int = 1):
+    sec = int(dgtime)
+    nsec = int(round((dgtime - sec) * 1e9))
+    return struct.pack('<1I4s2B1H2I', numbytes, dgm_type, version, 0, 2040, sec, nsec)
+
+
+def _finish(dgm_type: bytes, dgtime: float, body: bytes, version: int = 1):
+    numbytes = 20 + len(body) + 4
+    return _header(dgm_type, numbytes, dgtime, version) + body + struct.pack('<I', numbytes)
+
+
+def build_iip(dgtime: float):
+    txt = install_text.encode()
+    body = struct.pack('<3H1B', 7 + len(txt), 0, 0, 0) + txt
+    return _finish(b'#IIP', dgtime, body)
+
+
+def build_soundings(ping_number: int, nbeams: int = num_beams, nsectors: int = num_sectors):
+    snd = np.zeros(nbeams, dtype=kmall.mrz_sounding_dtype)
+    snd['soundingIndex'] = np.arange(nbeams)
+    snd['txSectorNumb'] = np.arange(nbeams) * nsectors // nbeams
+    snd['detectionType'] = 0
+    snd['detectionMethod'] = 1 + (np.arange(nbeams) % 2)
+    snd['qualityFactor'] = 0.1
+    snd['detectionUncertaintyVer_m'] = 0.2
+    snd['detectionUncertaintyHor_m'] = 0.3
+    snd['meanAbsCoeff_dbPerkm'] = 50.0
+    snd['reflectivity1_dB'] = -20.0 - np.arange(nbeams) * 0.5
+    snd['reflectivity2_dB'] = -25.0 - np.arange(nbeams) * 0.5
+    snd['receiverSensitivityApplied_dB'] = 10.0
+    snd['sourceLevelApplied_dB'] = 200.0
+    snd['TVG_dB'] = 30.0
+    snd['beamAngleReRx_deg'] = np.linspace(-60, 60, nbeams)
+    snd['twoWayTravelTime_sec'] = 0.02 + 0.001 * ping_number + np.abs(np.linspace(-0.01, 0.01, nbeams))
+    snd['deltaLatitude_deg'] = np.linspace(-0.0001, 0.0001, nbeams)
+    snd['deltaLongitude_deg'] = np.linspace(-0.0002, 0.0002, nbeams)
+    snd['z_reRefPoint_m'] = 20.0 + np.arange(nbeams) * 0.1
+    snd['y_reRefPoint_m'] = np.linspace(-30, 30, nbeams)
+    snd['x_reRefPoint_m'] = 0.5
+    snd['SInumSamples'] = 2
+    return snd
+
+
+def build_mrz(dgtime: float, ping_number: int, nbeams: int = num_beams, nsectors: int = num_sectors,
+              lat: float = 43.0, lon: float = -70.0, sounding_stride: int = kmall.mrz_sounding_dtype.itemsize):
+    """ sounding_stride larger than the sounding struct pads each sounding, as in later datagram versions """
+    partition = struct.pack('<2H', 1, 1)
+    cmnpart = struct.pack('<2H8B', 12, ping_number, 1, 0, 1, 0, 0, 0, 1, 0)
+    pinginfo_vals = [0] * 45
+    pinginfo_vals[0] = 144  # numBytesInfoData
+    pinginfo_vals[2] = 2.0  # pingRate_Hz
+    pinginfo_vals[4] = 2  # depthMode
+    pinginfo_vals[8] = 0  # pulseForm
+    pinginfo_vals[10] = 300000.0  # frequencyMode_Hz
+    pinginfo_vals[23] = 1  # modeAndStabilisation
+    pinginfo_vals[33] = nsectors
+    pinginfo_vals[34] = 36
+    pinginfo_vals[35] = 90.0  # headingVessel_deg
+    pinginfo_vals[36] = 1500.0 + ping_number  # soundSpeedAtTxDepth_mPerSec
+    pinginfo_vals[38] = 1.5  # z_waterLevelReRefPoint_m
+    pinginfo = struct.pack('<2H1f6B1H11f2h2B1H1I3f2H1f2H6f4B', *pinginfo_vals)
+    pinginfo += struct.pack('<2d1f', lat + ping_number * 1e-5, lon, -30.0)
+    sectors = b''
+    for sec in range(nsectors):
+        sectors += struct.pack('<4B7f2B1H', sec, 0, sec, 0, 0.001 * sec, 1.0 * sec, 220.0, 0.0,
+                               290000.0 + 10000 * sec, 1000.0, 0.0005 * (sec + 1), 0, 0, 0)
+    rxinfo = struct.pack('<4H4f4H', 32, nbeams, nbeams, sounding_stride, 1000.0, 1000.0, -20.0, -30.0, 0, 0, 0, 4)
+    snd = build_soundings(ping_number, nbeams, nsectors)
+    imagery = np.arange(int(snd['SInumSamples'].sum()), dtype='<i2').tobytes()
+    padded = np.zeros((nbeams, sounding_stride), dtype=np.uint8)
+    padded[:, :snd.itemsize] = snd.view(np.uint8).reshape(nbeams, snd.itemsize)
+    body = partition + cmnpart + pinginfo + sectors + rxinfo + padded.tobytes() + imagery
+    return _finish(b'#MRZ', dgtime, body)
+
+
+def build_skm(dgtime: float, numsamples: int = 5, sample_interval: float = 0.02):
+    info = struct.pack('<1H2B4H', 12, 0, 0, 1, numsamples, 132, 0)
+    samples = b''
+    for cnt in range(numsamples):
+        stime = dgtime + cnt * sample_interval
+        sec = int(stime)
+        nsec = int(round((stime - sec) * 1e9))
+        samples += b'#KMB' + struct.pack('<2H3I', 120, 1, sec, nsec, 0)
+        samples += struct.pack('<2d', 43.0, -70.0)
+        fvals = [0.0] * 21
+        fvals[1] = 1.0 + cnt  # roll
+        fvals[2] = -1.0 - cnt  # pitch
+        fvals[3] = 90.0 + cnt  # heading
+        fvals[4] = 0.1 * cnt  # heave
+        samples += struct.pack('<21f', *fvals)
+        samples += struct.pack('<2I1f', sec, nsec, 0.01 * cnt)
+    return _finish(b'#SKM', dgtime, info + samples)
+
+
+def build_mwc(dgtime: float, ping_number: int, nbeams: int = num_beams, nsectors: int = num_sectors,
+              phase_flag: int = 0):
+    """ water column with beam i holding 10 + 3 * i samples, amplitude = sample number - 50 """
+    partition = struct.pack('<2H', 1, 1)
+    cmnpart = struct.pack('<2H8B', 12, ping_number, 1, 0, 1, 0, 0, 0, 1, 0)
+    txinfo = struct.pack('<3H1h1f', 12, nsectors, 16, 0, 0.25)
+    sectors = b''
+    for sec in range(nsectors):
+        sectors += struct.pack('<3f1H1h', 1.0 * sec, 290000.0 + 10000 * sec, 1.0, sec, 0)
+    rxinfo = struct.pack('<2H3B1b2f', 16, nbeams, 12, phase_flag, 30, 0, 15000.0, 1500.0)
+    beams = b''
+    for bm in range(nbeams):
+        nsamples = 10 + 3 * bm
+        beams += struct.pack('<1f4H', -60 + 120 * bm / (nbeams - 1), 0, nsamples - 2, bm * nsectors // nbeams, nsamples)
+        beams += (np.arange(nsamples) - 50).astype(np.int8).tobytes()
+        if phase_flag == 1:
+            beams += (np.arange(nsamples) % 100 - bm).astype(np.int8).tobytes()
+        elif phase_flag == 2:
+            beams += (np.arange(nsamples) * 100 - bm).astype('<i2').tobytes()
+    return _finish(b'#MWC', dgtime, partition + cmnpart + txinfo + sectors + rxinfo + beams)
+
+
+def set_mrz_strides(mrz: bytes, sounding_stride: int = None, sector_stride: int = None, num_tx_sectors: int = None):
+    """ overwrite numBytesPerSounding / numBytesPerTxSector / numTxSectors of a build_mrz datagram, as found in a
+    corrupt file """
+    mrz = bytearray(mrz)
+    sectors_at = 20 + 4 + 12 + kmall.mrz_pinginfo_dtype.fields['numTxSectors'][1]
+    nsectors, stride = struct.unpack('<2H', mrz[sectors_at:sectors_at + 4])
+    rxinfo_start = 20 + 4 + 12 + 144 + nsectors * stride
+    if sounding_stride is not None:
+        mrz[rxinfo_start + 6:rxinfo_start + 8] = struct.pack('<H', sounding_stride)
+    if sector_stride is not None:
+        mrz[sectors_at + 2:sectors_at + 4] = struct.pack('<H', sector_stride)
+    if num_tx_sectors is not None:
+        mrz[sectors_at:sectors_at + 2] = struct.pack('<H', num_tx_sectors)
+    return bytes(mrz)
+
+
+def build_kmall_file(pth, num_pings: int = 6, with_mwc: bool = False):
+    """ IIP, then interleaved SKM/MRZ datagrams, with a MWC datagram after each MRZ if with_mwc """
+    data = build_iip(start_time)
+    for png in range(num_pings):
+        ping_time = start_time + 1.0 + png * ping_interval
+        data += build_skm(ping_time - skm_interval)
+        data += build_mrz(ping_time, png)
+        if with_mwc:
+            data += build_mwc(ping_time, png)
+    with open(pth, 'wb') as fil:
+        fil.write(data)
+    return str(pth)
+
+
+def corrupt_mrz_strides(pth, ping_strides: dict):
+    """ rewrite the MRZ datagrams of a build_kmall_file file with the strides of ping_strides, see set_mrz_strides """
+    with open(pth, 'rb') as fil:
+        data = fil.read()
+    for png, strides in ping_strides.items():
+        mrz = build_mrz(start_time + 1.0 + png * ping_interval, png)
+        data = data.replace(mrz, set_mrz_strides(mrz, **strides))
+    with open(pth, 'wb') as fil:
+        fil.write(data)
+    return pth
+
+
+@pytest.fixture
+def kmall_file(tmp_path):
+    return build_kmall_file(tmp_path / '0000_test.kmall')
+
+
+def test_mrz_vectorized_matches_dict(kmall_file):
+    km = kmall.kmall(kmall_file)
+    km.OpenFiletoRead()
+    km.decode_datagram()
+    km.skip_datagram()  # IIP
+    km.decode_datagram()
+    km.skip_datagram()  # SKM
+    start = km.FID.tell()
+    dict_dg = km.read_EMdgmMRZ()
+    end = km.FID.tell()
+    km.FID.seek(start)
+    vec_dg = km.read_EMdgmMRZ(vectorized=True)
+    assert km.FID.tell() == end
+    assert isinstance(dict_dg['sounding']['twoWayTravelTime_sec'], list)
+    assert set(dict_dg['sounding'].keys()) == set(vec_dg['sounding'].keys())
+    for ky, val in dict_dg['sounding'].items():
+        assert isinstance(vec_dg['sounding'][ky], np.ndarray)
+        np.testing.assert_array_equal(np.array(val), vec_dg['sounding'][ky])
+    np.testing.assert_array_equal(np.array(dict_dg['SIsample_desidB']), vec_dg['SIsample_desidB'])
+    np.testing.assert_allclose(vec_dg['sounding']['beamAngleReRx_deg'], np.linspace(-60, 60, num_beams), atol=1e-5)
+    km.closeFile()
+
+
+def test_mrz_vectorized_sounding_stride(tmp_path):
+    # soundings longer than the sounding struct are read at numBytesPerSounding, the same by every decoder
+    pth = str(tmp_path / '0001_test.kmall')
+    with open(pth, 'wb') as fil:
+        fil.write(build_iip(start_time) + build_mrz(start_time + 1.0, 0, sounding_stride=128) +
+                  set_mrz_strides(build_mrz(start_time + 1.5, 1), sounding_stride=64))
+    km = kmall.kmall(pth)
+    km.OpenFiletoRead()
+    km.decode_datagram()
+    km.skip_datagram()  # IIP
+    km.decode_datagram()
+    dg = km.read_EMdgmMRZ(vectorized=True)
+    expected = build_soundings(0)
+    for ky in expected.dtype.names:
+        np.testing.assert_array_equal(dg['sounding'][ky], expected[ky])
+    np.testing.assert_array_equal(dg['SIsample_desidB'], np.arange(2 * num_beams))
+    km.decode_datagram()
+    with pytest.raises(kmall.CorruptPacketError):  # too short for the sounding struct
+        km.read_EMdgmMRZ(vectorized=True)
+    km.closeFile()
+
+    recs = kmall.kmall(pth).sequential_read_records(fields=['ping.traveltime'])
+    np.testing.assert_array_equal(recs['ping']['traveltime'], expected['twoWayTravelTime_sec'][None, :])
+    points = kmall.kmall(pth).extract_point_cloud()
+    np.testing.assert_allclose(points['z'], expected['z_reRefPoint_m'] - 1.5, atol=1e-5)
+
+
+def test_sequential_read_records(kmall_file):
+    km = kmall.kmall(kmall_file)
+    recs = km.sequential_read_records()
+    assert recs['format'] == 'kmall'
+    assert recs['ping']['time'].shape == (6,)
+    assert recs['ping']['traveltime'].shape == (6, num_beams)
+    assert recs['ping']['frequency'].shape == (6, num_beams)
+    np.testing.assert_array_equal(recs['ping']['frequency'][0], np.where(np.arange(num_beams) < 8, 290000, 300000))
+    np.testing.assert_array_equal(recs['ping']['counter'], np.arange(6))
+    assert recs['attitude']['time'].shape == (30,)
+    km.closeFile()
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_populate_rec_sector_gather(tmp_path, vectorized):
+    nsectors = 3
+    pth = str(tmp_path / '0004_test.kmall')
+    with open(pth, 'wb') as fil:
+        fil.write(build_iip(start_time) + build_mrz(start_time + 1.0, 0, nsectors=nsectors))
+    km = kmall.kmall(pth)
+    km.OpenFiletoRead()
+    km.decode_datagram()
+    km.skip_datagram()  # IIP
+    km.decode_datagram()
+    km.read_datagram(vectorized=vectorized)
+    original = copy.deepcopy(km.datagram_data)
+    beam_sectors = np.asarray(original['sounding']['txSectorNumb'], dtype=int)
+    assert len(np.unique(beam_sectors)) == nsectors
+
+    rec = km._populate_rec(copy.deepcopy(original))
+    for ky, dtyp in [('tiltAngleReTx_deg', np.float32), ('centreFreq_Hz', np.int32),
+                     ('sectorTransmitDelay_sec', np.float32), ('totalSignalLength_sec', np.float32)]:
+        beamwise = rec['txSectorInfo'][ky]
+        assert beamwise.shape == (num_beams,) and beamwise.dtype == dtyp
+        for sec in range(nsectors):
+            np.testing.assert_array_equal(beamwise[beam_sectors == sec], dtyp(original['txSectorInfo'][ky][sec]))
+    np.testing.assert_array_equal(rec['txSectorInfo']['centreFreq_Hz'], 290000 + 10000 * beam_sectors)
+
+    # a sounding pointing at a sector that is not in the ping drops the ping
+    bad = copy.deepcopy(original)
+    bad['sounding']['txSectorNumb'] = beam_sectors.copy()
+    bad['sounding']['txSectorNumb'][0] = nsectors
+    assert km._populate_rec(bad) is None
+    km.closeFile()
+
+
+def test_index_sidecar(kmall_file):
+    km = kmall.kmall(kmall_file)
+    km.index_file()
+    assert os.path.exists(km.index_sidecar_path())
+    first_index = km.Index.copy()
+    km.closeFile()
+
+    km = kmall.kmall(kmall_file)
+    assert km.load_index_sidecar()
+    km.index_file()
+    assert first_index.equals(km.Index)
+    assert km.msgtype.count("b'#MRZ'") == 6
+    km.closeFile()
+
+    # appending data makes the sidecar stale, it should be rebuilt on the next index
+    with open(kmall_file, 'ab') as fil:
+        fil.write(build_mrz(start_time + 10, 6))
+    km = kmall.kmall(kmall_file)
+    assert not km.load_index_sidecar()
+    km.index_file()
+    assert km.msgtype.count("b'#MRZ'") == 7
+    assert km.load_index_sidecar()
+    km.closeFile()
+
+
+def test_index_mmap_matches_file_reads(kmall_file):
+    km = kmall.kmall(kmall_file)
+    km.index_file(use_sidecar=False)
+    file_index = km.Index.copy()
+    km.index_file(use_sidecar=False, use_mmap=True)
+    assert file_index.equals(km.Index)
+    assert list(km.Index.MessageType[:3]) == ["b'#IIP'", "b'#SKM'", "b'#MRZ'"]
+    assert km.Index.MessageSize.sum() == os.path.getsize(kmall_file)
+    km.closeFile()
+
+
+def test_find_next_datagram_resync(tmp_path):
+    clean = build_kmall_file(tmp_path / '0003_clean.kmall', num_pings=4)
+    km = kmall.kmall(clean)
+    km.index_file(use_sidecar=False)
+    offsets = list(km.msgoffset)
+    km.closeFile()
+
+    # garbage with a false start (an identifier with a size that does not match the trailing length) after the 3rd
+    #  datagram, must be skipped when indexing and reading
+    with open(clean, 'rb') as fil:
+        data = fil.read()
+    garbage = b'\x05' * 50 + struct.pack('<I', 64) + b'#MRZ' + b'\x00' * 300
+    corrupt = str(tmp_path / '0004_corrupt.kmall')
+    with open(corrupt, 'wb') as fil:
+        fil.write(data[:offsets[3]] + garbage + data[offsets[3]:])
+    expected = offsets[:3] + [off + len(garbage) for off in offsets[3:]]
+
+    for use_mmap in [False, True]:
+        km = kmall.kmall(corrupt, use_mmap=use_mmap)
+        km.index_file(use_sidecar=False)
+        assert list(km.msgoffset) == expected
+        for window_size in [16, 100, kmall.resync_window_size]:
+            assert km.find_next_datagram(offsets[3], window_size=window_size) == expected[3]
+            assert km.find_next_datagram(expected[3] + 1, window_size=window_size) == expected[4]
+        assert km.find_next_datagram(offsets[3], expected[3]) is None
+        assert km.find_next_datagram(expected[-1] + 1) is None
+        km.closeFile()
+
+    recs = kmall.kmall(clean).sequential_read_records()
+    km = kmall.kmall(corrupt)
+    km.OpenFiletoRead()
+    km.FID.seek(offsets[3])
+    assert km.seek_next_startbyte(os.path.getsize(corrupt))
+    assert km.FID.tell() == expected[3]
+    km.closeFile()
+    chunk_recs = kmall.kmall(corrupt).sequential_read_records(start_ptr=offsets[3], end_ptr=os.path.getsize(corrupt))
+    np.testing.assert_array_equal(chunk_recs['ping']['counter'], recs['ping']['counter'][1:])
+
+
+def test_follow(tmp_path):
+    data = build_iip(start_time) + build_skm(start_time + 0.9)
+    mrz = build_mrz(start_time + 1.0, 0)
+    pth = str(tmp_path / '0005_live.kmall')
+    with open(pth, 'wb') as fil:
+        fil.write(data + mrz[:100])  # last datagram only partly written
+
+    km = kmall.kmall(pth)
+    live = km.follow(poll_interval=0.01, idle_timeout=1.0)
+    assert [next(live)[1] for _ in range(2)] == ['IIP', 'SKM']
+    assert km.follow_offset == len(data)
+    with open(pth, 'ab') as fil:
+        fil.write(mrz[100:] + b'\x00' * 10)  # trailing garbage is skipped, not yielded
+    offset, dgram_type, dgram = next(live)
+    assert (offset, dgram_type) == (len(data), 'MRZ')
+    assert dgram['cmnPart']['pingCnt'] == 0
+    live.close()
+
+    # a new follow picks up where the last one stopped
+    with open(pth, 'ab') as fil:
+        fil.write(build_skm(start_time + 1.4) + build_mrz(start_time + 1.5, 1))
+    dgrams = list(km.follow(poll_interval=0.01, datagram_types=['MRZ'], idle_timeout=0.05))
+    assert [d[1] for d in dgrams] == ['MRZ']
+    assert dgrams[0][2]['cmnPart']['pingCnt'] == 1
+    assert km.follow_offset == os.path.getsize(pth)
+
+    # corrupt data with a size field running past the end of the file is skipped, rather than waited on
+    with open(pth, 'ab') as fil:
+        fil.write(struct.pack('<I', 10 ** 6) + b'junk' * 10 + build_mrz(start_time + 2.0, 2))
+    dgrams = list(km.follow(poll_interval=0.01, datagram_types=['MRZ'], idle_timeout=0.05))
+    assert [d[2]['cmnPart']['pingCnt'] for d in dgrams] == [2]
+    assert km.follow_offset == os.path.getsize(pth)
+
+
+def test_mmap_backend_matches_file_reads(kmall_file):
+    recs = kmall.kmall(kmall_file).sequential_read_records()
+    km = kmall.kmall(kmall_file, use_mmap=True)
+    km.OpenFiletoRead()
+    assert isinstance(km.FID, kmall.MappedKmallFile)
+    mmap_recs = km.sequential_read_records()
+    for ky in recs['ping']:
+        np.testing.assert_array_equal(recs['ping'][ky], mmap_recs['ping'][ky])
+    for ky in recs['attitude']:
+        np.testing.assert_array_equal(recs['attitude'][ky], mmap_recs['attitude'][ky])
+    assert km.read_first_datagram('IIP')['install_txt'] == kmall.kmall(kmall_file).read_first_datagram('IIP')['install_txt']
+    km.closeFile()
+
+
+def test_decode_datagram_at_threads(kmall_file):
+    from concurrent.futures import ThreadPoolExecutor
+
+    km = kmall.kmall(kmall_file, use_mmap=True)
+    km.index_file(use_sidecar=False)
+    mrz_offsets = km.msgoffset[np.array(km.msgtype) == "b'#MRZ'"]
+    position = km.FID.tell()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        pings = list(pool.map(lambda off: km.decode_datagram_at(off, vectorized=True), list(mrz_offsets) * 4))
+    assert km.FID.tell() == position
+    assert [p['cmnPart']['pingCnt'] for p in pings] == list(range(6)) * 4
+    # zero copy, the sounding columns are read only views into the map
+    assert not pings[0]['sounding']['twoWayTravelTime_sec'].flags.writeable
+
+    file_km = kmall.kmall(kmall_file)
+    file_km.index_file(use_sidecar=False)
+    file_dg = file_km.decode_datagram_at(int(mrz_offsets[3]))
+    assert file_dg['cmnPart']['pingCnt'] == 3
+    np.testing.assert_array_equal(file_dg['sounding']['twoWayTravelTime_sec'], pings[3]['sounding']['twoWayTravelTime_sec'])
+    file_km.closeFile()
+    km.closeFile()
+
+
+def test_parallel_read_records(tmp_path):
+    pth = build_kmall_file(tmp_path / '0001_test.kmall', num_pings=20)
+    recs = kmall.kmall(pth).sequential_read_records()
+
+    km = kmall.kmall(pth)
+    km.index_file(use_sidecar=False)
+    chunks = km.plan_read_chunks(4)
+    assert len(chunks) == 4
+    assert chunks[0][0] == 0 and chunks[-1][1] == os.path.getsize(pth)
+    assert all(c[0] in km.msgoffset for c in chunks)
+    assert all(chunks[i][1] == chunks[i + 1][0] for i in range(len(chunks) - 1))
+
+    par_recs = km.parallel_read_records(num_workers=2, chunks_per_worker=2)
+    assert par_recs['format'] == 'kmall'
+    for rec in ['ping', 'attitude', 'navigation']:
+        assert recs[rec].keys() == par_recs[rec].keys()
+        for ky in recs[rec]:
+            np.testing.assert_array_equal(recs[rec][ky], par_recs[rec][ky])
+    np.testing.assert_array_equal(par_recs['ping']['counter'], np.arange(20))
+    km.closeFile()
+
+
+def test_sequential_read_records_fields(kmall_file):
+    recs = kmall.kmall(kmall_file).sequential_read_records()
+
+    nav = kmall.kmall(kmall_file).sequential_read_records(fields=['navigation'])
+    assert set(nav.keys()) == {'navigation', 'format'}
+    for ky in recs['navigation']:
+        np.testing.assert_array_equal(recs['navigation'][ky], nav['navigation'][ky])
+
+    ping = kmall.kmall(kmall_file).sequential_read_records(fields=['ping.traveltime', 'ping.fixedgain'])
+    assert set(ping['ping'].keys()) == {'time', 'traveltime', 'fixedgain'}
+    for ky in ping['ping']:
+        np.testing.assert_array_equal(recs['ping'][ky], ping['ping'][ky])
+
+    with pytest.raises(ValueError):
+        kmall.kmall(kmall_file).sequential_read_records(fields=['ping.notacolumn'])
+
+
+def test_corrupt_record_stride(tmp_path):
+    # a stride too short for the decoded fields is a corrupt packet, the ping is skipped rather than ending the read
+    with pytest.raises(kmall.CorruptPacketError):
+        kmall._partial_dtype(kmall.mrz_sounding_dtype, ['twoWayTravelTime_sec'], 16)
+    pth = corrupt_mrz_strides(build_kmall_file(tmp_path / '0003_test.kmall'),
+                              {2: {'sounding_stride': 16}, 4: {'sector_stride': 4}})
+    recs = kmall.kmall(pth).sequential_read_records(fields=['ping.traveltime', 'ping.frequency'])
+    np.testing.assert_allclose(recs['ping']['time'], start_time + 1.0 + np.array([0, 1, 3, 5]) * ping_interval,
+                               atol=1e-4)
+    assert recs['ping']['traveltime'].shape == (4, num_beams)
+
+
+def test_corrupt_mrz_offsets(tmp_path):
+    # offsets read from a corrupt datagram that point past its end skip the ping in extract_point_cloud
+    pth = corrupt_mrz_strides(build_kmall_file(tmp_path / '0003_test.kmall', num_pings=4),
+                              {1: {'num_tx_sectors': 60000}, 2: {'sector_stride': 60000}})
+    points = kmall.kmall(pth).extract_point_cloud()
+    assert points['z'].shape == (2 * num_beams,)
+    np.testing.assert_allclose(points['latitude'][num_beams:].mean(), 43.0 + 3e-5, atol=1e-9)
+    good = build_kmall_file(tmp_path / '0004_test.kmall', num_pings=2)
+    allpoints = kmall.extract_point_clouds([pth, good], num_workers=2)
+    np.testing.assert_array_equal(np.bincount(allpoints['file_index']), [2 * num_beams, 2 * num_beams])
+
+
+def test_read_time_range(tmp_path):
+    pth = build_kmall_file(tmp_path / '0006_test.kmall', num_pings=10)
+    recs = kmall.kmall(pth).sequential_read_records()
+    t0, t1 = start_time + 1.0 + 3 * ping_interval, start_time + 1.0 + 6 * ping_interval
+
+    km = kmall.kmall(pth)
+    window = km.read_time_range(t0, t1)
+    assert window['format'] == 'kmall'
+    np.testing.assert_array_equal(window['ping']['counter'], np.arange(3, 7))
+    ping_idx = np.arange(3, 7)
+    for ky in recs['ping']:
+        if ky != 'time':  # the first time is nudged by _ensure_unique_starttime in the full read
+            np.testing.assert_array_equal(recs['ping'][ky][ping_idx], window['ping'][ky])
+    # the SKM datagrams (5 samples each) are written skm_interval before each ping, only pings 4-6 have theirs in t0-t1
+    for ky in recs['attitude']:
+        np.testing.assert_array_equal(recs['attitude'][ky][4 * 5:7 * 5], window['attitude'][ky])
+    assert window['installation_params']['installation_settings'] == recs['installation_params']['installation_settings']
+
+    mrz_only = km.read_time_range(t0, t1, datagram_types=['MRZ'])
+    assert mrz_only['attitude']['time'].size == 0
+    np.testing.assert_array_equal(mrz_only['ping']['counter'], np.arange(3, 7))
+    with pytest.raises(ValueError):
+        km.read_time_range(t0, t1, datagram_types=['XYZ'])
+    km.closeFile()
+
+
+def test_kmall_collection(tmp_path):
+    # two consecutive lines, the second starting where the first ends
+    first = build_kmall_file(tmp_path / '0007_line.kmall', num_pings=6)
+    data = build_iip(start_time + 10)
+    for png in range(6, 10):
+        ping_time = start_time + 1.0 + png * ping_interval + 10
+        data += build_skm(ping_time - skm_interval) + build_mrz(ping_time, png)
+    second = str(tmp_path / '0008_line.kmall')
+    with open(second, 'wb') as fil:
+        fil.write(data)
+    kmall.kmall(first).index_file()  # first file has a sidecar, the second is indexed by the collection
+
+    kc = kmall.KmallCollection(str(tmp_path), max_open_files=1)
+    assert kc.filenames == [first, second]
+    assert len(kc) == 10
+    assert np.all(np.diff(kc.Index.Time.values) >= 0)
+    assert os.path.exists(second + '.index.npz')
+
+    mrz = list(kc.iter_datagrams(datagram_types=['MRZ']))
+    assert [dg[3]['cmnPart']['pingCnt'] for dg in mrz] == list(range(10))
+    assert [dg[0] for dg in mrz] == [first] * 6 + [second] * 4
+    assert len(kc._open_files) == 1
+
+    recs = kc.read_ping_range(4, 8)
+    np.testing.assert_array_equal(recs['ping']['counter'], np.arange(4, 8))
+    assert len(recs['installation_params']['time']) == 2
+    single = kmall.kmall(first).read_time_range(*kc.ping_time_range(4, 6))
+    for ky in single['ping']:
+        np.testing.assert_array_equal(single['ping'][ky], recs['ping'][ky][:2])
+    with pytest.raises(IndexError):
+        kc.ping_time_range(20, 30)
+    kc.close()
+    assert not kc._open_files
+
+
+def read_mrz_dicts(pth):
+    """ the full (non vectorized) dict of each MRZ datagram in the file """
+    km = kmall.kmall(pth)
+    km.index_file(use_sidecar=False)
+    mrz_offsets = np.asarray(km.msgoffset)[np.asarray(km.msgtype) == "b'#MRZ'"]
+    dgrams = [km.decode_datagram_at(int(offset)) for offset in mrz_offsets]
+    km.closeFile()
+    return dgrams
+
+
+@pytest.mark.parametrize('codec', sorted(kmall.sounding_codecs))
+def test_compressed_soundings_codecs(tmp_path, codec):
+    pth = build_kmall_file(tmp_path / '0009_test.kmall', num_pings=4)
+    mrz = read_mrz_dicts(pth)
+    cz_pth = str(tmp_path / '0009_test_cz.kmall')
+    writer = kmall.kmall(pth)
+    writer.FID = open(cz_pth, 'wb')
+    for cnt, dg in enumerate(mrz):
+        if cnt % 2:
+            writer.write_EMdgmCZ1(copy.deepcopy(dg), codec=codec)
+        else:
+            writer.write_EMdgmCZ0(copy.deepcopy(dg), codec=codec)
+    writer.closeFile()
+
+    cz = kmall.kmall(cz_pth, use_mmap=True).decode_compressed_pings(num_workers=2)
+    assert [dg['header']['dgmType'] for dg in cz] == [b'#CZ0', b'#CZ1'] * 2
+    for dg, orig in zip(cz, mrz):
+        assert dg['header']['numBytesDgm'] == orig['header']['numBytesDgm'] - (0 if dg['header']['dgmType'] == b'#CZ0' else 2 * num_beams * 2)
+        np.testing.assert_array_equal(dg['sounding']['soundingIndex'], orig['sounding']['soundingIndex'])
+        np.testing.assert_array_equal(dg['sounding']['txSectorNumb'], orig['sounding']['txSectorNumb'])
+        np.testing.assert_allclose(dg['sounding']['twoWayTravelTime_sec'], orig['sounding']['twoWayTravelTime_sec'], atol=1e-6)
+        np.testing.assert_allclose(dg['sounding']['z_reRefPoint_m'], orig['sounding']['z_reRefPoint_m'], atol=1e-3)
+        np.testing.assert_allclose(dg['sounding']['meanAbsCoeff_dbPerkm'], orig['sounding']['meanAbsCoeff_dbPerkm'], atol=0.01)
+    np.testing.assert_array_equal(cz[0]['SIsample_desidB'], mrz[0]['SIsample_desidB'])
+
+    with pytest.raises(ValueError):
+        kmall._compress_block(b'1234', codec='notacodec')
+
+
+@pytest.mark.parametrize('level', [0, 1])
+def test_compress_kmall_file(tmp_path, level):
+    pth = build_kmall_file(tmp_path / '0010_test.kmall', num_pings=6)
+    mrz = read_mrz_dicts(pth)
+
+    stats = kmall.compress_kmall_file(pth, level=level, codec='zlib', num_workers=2, task_bytes=4000)
+    assert stats['output_file'] == pth + '.{}z'.format(level)
+    assert stats['converted'] == 6
+    assert stats['ratio'] > 1
+    km = kmall.kmall(stats['output_file'])
+    km.index_file(use_sidecar=False)
+    assert km.msgtype.count("b'#CZ{}'".format(level)) == 6
+    km.closeFile()
+
+    restored = str(tmp_path / '0010_restored.kmall')
+    stats = kmall.decompress_kmall_file(stats['output_file'], restored, num_workers=1)
+    assert stats['converted'] == 6
+    restored_mrz = read_mrz_dicts(restored)
+    assert len(restored_mrz) == 6
+    for dg, orig in zip(restored_mrz, mrz):
+        assert dg['cmnPart']['pingCnt'] == orig['cmnPart']['pingCnt']
+        np.testing.assert_allclose(dg['sounding']['twoWayTravelTime_sec'], orig['sounding']['twoWayTravelTime_sec'], atol=1e-6)
+        np.testing.assert_allclose(dg['sounding']['z_reRefPoint_m'], orig['sounding']['z_reRefPoint_m'], atol=1e-3)
+        if level == 0:
+            np.testing.assert_array_equal(dg['SIsample_desidB'], orig['SIsample_desidB'])
+    # everything but the MRZ datagrams is copied unchanged
+    recs, restored_recs = kmall.kmall(pth).sequential_read_records(), kmall.kmall(restored).sequential_read_records()
+    for ky in recs['attitude']:
+        np.testing.assert_array_equal(recs['attitude'][ky], restored_recs['attitude'][ky])
+
+
+def test_compress_main(tmp_path):
+    pth = build_kmall_file(tmp_path / '0011_test.kmall', num_pings=3)
+    kmall.main(['-f', pth, '-z', '-c', 'zlib', '-j', '1'])
+    assert os.path.exists(pth + '.0z')
+    os.remove(pth)
+    for fil in os.listdir(str(tmp_path)):
+        if fil.endswith('.index.npz'):
+            os.remove(str(tmp_path / fil))
+
+    # directory decompression finds the compressed files, and leaves no index next to them
+    kmall.main(['-d', str(tmp_path), '-Z', '-j', '1'])
+    assert sorted(os.listdir(str(tmp_path))) == ['0011_test.kmall', '0011_test.kmall.0z']
+    assert len(read_mrz_dicts(pth)) == 3
+
+
+def test_iter_pings(tmp_path):
+    pth = build_kmall_file(tmp_path / '0002_test.kmall', num_pings=10)
+    recs = kmall.kmall(pth).sequential_read_records()
+
+    batches = list(kmall.kmall(pth).iter_pings(batch_size=4))
+    assert [b['time'].shape[0] for b in batches] == [4, 4, 2]
+    assert set(batches[0].keys()) == set(recs['ping'].keys())
+    for ky in recs['ping']:
+        if ky == 'time':  # sequential_read_records nudges the first time, see _ensure_unique_starttime
+            np.testing.assert_allclose(np.concatenate([b[ky] for b in batches]), recs['ping'][ky], atol=1e-4)
+        else:
+            np.testing.assert_array_equal(np.concatenate([b[ky] for b in batches]), recs['ping'][ky])
+
+    batches = list(kmall.kmall(pth).iter_pings(fields=['traveltime', 'fixedgain'], batch_size=20))
+    assert len(batches) == 1
+    assert set(batches[0].keys()) == {'time', 'traveltime', 'fixedgain'}
+    assert batches[0]['traveltime'].shape == (10, num_beams)
+
+    with pytest.raises(ValueError):
+        next(kmall.kmall(pth).iter_pings(fields=['not_a_field']))
+
+
+@pytest.mark.parametrize('phase_flag', [0, 1, 2])
+def test_mwc_vectorized_matches_dict(tmp_path, phase_flag):
+    pth = str(tmp_path / '0003_test.kmall')
+    with open(pth, 'wb') as fil:
+        fil.write(build_mwc(start_time, 0, phase_flag=phase_flag))
+    km = kmall.kmall(pth)
+    km.OpenFiletoRead()
+    dict_dg = km.read_EMdgmMWC()
+    end = km.FID.tell()
+    km.FID.seek(0)
+    vec_dg = km.read_EMdgmMWC(vectorized=True)
+    assert km.FID.tell() == end
+
+    numsamples = np.array(dict_dg['beamData']['numSampleData'])
+    np.testing.assert_array_equal(vec_dg['beamData']['numSampleData'], numsamples)
+    for ky in ['beamPointAngReVertical_deg', 'startRangeSampleNum', 'detectedRangeInSamples', 'beamTxSectorNum']:
+        np.testing.assert_array_equal(vec_dg['beamData'][ky], np.array(dict_dg['beamData'][ky]))
+    amplitude = vec_dg['beamData']['sampleAmplitude05dB_p']
+    assert amplitude.dtype == np.int8
+    assert amplitude.shape == (num_beams, numsamples.max())
+    for bm in range(num_beams):
+        np.testing.assert_array_equal(amplitude[bm, :numsamples[bm]], dict_dg['beamData']['sampleAmplitude05dB_p'][bm])
+        assert (amplitude[bm, numsamples[bm]:] == kmall.mwc_amplitude_fill).all()
+    if phase_flag:
+        phase = vec_dg['phaseInfo']['rxBeamPhase']
+        assert phase.dtype == (np.int8 if phase_flag == 1 else np.int16)
+        for bm in range(num_beams):
+            np.testing.assert_array_equal(phase[bm, :numsamples[bm]], dict_dg['phaseInfo']['rxBeamPhase'][bm])
+    else:
+        assert 'phaseInfo' not in vec_dg
+    km.closeFile()
+
+
+def test_watercolumn_accessor(tmp_path):
+    pth = build_kmall_file(tmp_path / '0004_test.kmall', num_pings=5, with_mwc=True)
+    # second head for the last ping, same time
+    with open(pth, 'ab') as fil:
+        fil.write(build_mwc(start_time + 1.0 + 4 * ping_interval, 4, nbeams=4))
+    km = kmall.kmall(pth, use_mmap=True)
+    wc = km.watercolumn
+    wc.cache_size = 2
+    assert len(wc) == 5
+    np.testing.assert_allclose(wc.times, start_time + 1.0 + np.arange(5) * ping_interval)
+
+    ping = wc[1]
+    assert ping['cmnPart']['pingCnt'] == 1
+    assert ping['beamData']['sampleAmplitude05dB_p'].shape == (num_beams, 10 + 3 * (num_beams - 1))
+    assert wc[1] is ping  # cached
+    wc[2]
+    wc[3]
+    assert wc[1] is not ping  # evicted, only the 2 most recent pings are kept
+    assert list(wc._cache.keys()) == [3, 1]
+
+    last = wc[-1]
+    assert len(wc.datagram_offsets(4)) == 2
+    assert last['rxInfo']['numBeams'] == num_beams + 4
+    assert last['beamData']['sampleAmplitude05dB_p'].shape[0] == num_beams + 4
+    assert last['beamData']['numSampleData'].shape == (num_beams + 4,)
+    assert len(wc[1:3]) == 2
+    with pytest.raises(IndexError):
+        wc[5]
+    km.closeFile()
+
+
+def test_column_accumulator():
+    col = kmall.ColumnAccumulator(initial_capacity=1)
+    rows = [np.arange(3, dtype=np.float32), np.arange(5, dtype=np.float32), np.arange(2, dtype=np.float32)]
+    for row in rows:
+        col.append(row)
+    assert len(col) == 3
+    assert col.ragged
+    np.testing.assert_array_equal(col.offsets, [0, 3, 8, 10])
+    padded = col.to_array(maxlen=6, fill=-1)
+    assert padded.shape == (3, 6)
+    np.testing.assert_array_equal(padded[0], [0, 1, 2, -1, -1, -1])
+    np.testing.assert_array_equal(padded[1], [0, 1, 2, 3, 4, -1])
+
+    other = kmall.ColumnAccumulator()
+    other.append([7.5, 8.5])
+    col.extend(other)
+    assert col.to_array().shape == (4, 5)
+    np.testing.assert_array_equal(col.to_array()[3], [7.5, 8.5, 0, 0, 0])
+
+    scalars = kmall.ColumnAccumulator(initial_capacity=2)
+    for val in [1, 2, 3.5]:  # dtype promoted to float on the last value
+        scalars.append(val)
+    np.testing.assert_array_equal(np.array(scalars), [1.0, 2.0, 3.5])
+    with pytest.raises(ValueError):
+        scalars.append([1, 2])
+
+
+def test_extract_point_cloud(tmp_path):
+    pth = build_kmall_file(tmp_path / '0005_test.kmall', num_pings=4)
+    km = kmall.kmall(pth)
+    points = km.extract_point_cloud(include_uncertainty=True, include_flags=True)
+    assert points['z'].shape == (4 * num_beams,)
+    np.testing.assert_allclose(points['z'][:num_beams], 20.0 + np.arange(num_beams) * 0.1 - 1.5, atol=1e-5)
+    np.testing.assert_allclose(points['latitude'][num_beams:2 * num_beams],
+                               43.0 + 1e-5 + np.linspace(-0.0001, 0.0001, num_beams), atol=1e-9)
+    np.testing.assert_allclose(points['tvu'], 0.2, atol=1e-6)
+    np.testing.assert_array_equal(points['detectionMethod'][:num_beams], 1 + (np.arange(num_beams) % 2))
+
+    # extractLonLatZ keeps its output, compare against decoding each ping with read_EMdgmMRZ
+    lon, lat, z = km.extractLonLatZ()
+    expected_z = []
+    for offset in km.msgoffset[np.array(km.msgtype) == "b'#MRZ'"]:
+        km.FID.seek(offset)
+        dg = km.read_EMdgmMRZ()
+        expected_z.append(np.array(dg['sounding']['z_reRefPoint_m']) - dg['pingInfo']['z_waterLevelReRefPoint_m'])
+    np.testing.assert_array_equal(z, np.concatenate(expected_z))
+    km.closeFile()
+
+    second = build_kmall_file(tmp_path / '0006_test.kmall', num_pings=2)
+    allpoints = kmall.extract_point_clouds([pth, second], include_uncertainty=True)
+    assert allpoints['z'].shape == (6 * num_beams,)
+    np.testing.assert_array_equal(np.bincount(allpoints['file_index']), [4 * num_beams, 2 * num_beams])
+
+    outfile = str(tmp_path / 'points.bin')
+    dtype = kmall.extract_point_clouds([pth, second], output_file=outfile, num_workers=2)
+    written = np.fromfile(outfile, dtype=dtype)
+    np.testing.assert_array_equal(written['z'], allpoints['z'])
+    np.testing.assert_array_equal(written['file_index'], allpoints['file_index'])
+
+    # a ping with a corrupt numBytesPerSounding is skipped, the rest of the batch is extracted
+    corrupt = corrupt_mrz_strides(build_kmall_file(tmp_path / '0007_test.kmall', num_pings=3),
+                                  {1: {'sounding_stride': 16}})
+    for workers in [1, 2]:
+        somepoints = kmall.extract_point_clouds([pth, corrupt], num_workers=workers)
+        np.testing.assert_array_equal(np.bincount(somepoints['file_index']), [4 * num_beams, 2 * num_beams])
+
+
+def test_skm_vectorized_matches_dict(kmall_file):
+    km = kmall.kmall(kmall_file)
+    km.OpenFiletoRead()
+    km.decode_datagram()
+    km.skip_datagram()  # IIP
+    start = km.FID.tell()
+    dict_dg = km.read_EMdgmSKM()
+    end = km.FID.tell()
+    km.FID.seek(start)
+    vec_dg = km.read_EMdgmSKM(vectorized=True)
+    assert km.FID.tell() == end
+    for blk in ['KMdefault', 'delayedHeave']:
+        assert list(dict_dg['sample'][blk].keys()) == list(vec_dg['sample'][blk].keys())
+        for ky, val in dict_dg['sample'][blk].items():
+            if ky == 'datetime':  # datetime objects only have microsecond resolution
+                diff = np.array(val, dtype='datetime64[ns]') - vec_dg['sample'][blk][ky]
+                assert (np.abs(diff) <= np.timedelta64(1, 'us')).all()
+            else:
+                np.testing.assert_array_equal(np.array(val), vec_dg['sample'][blk][ky])
+
+    att = km.extract_attitude()
+    assert att is km.att
+    assert att['roll_deg'].shape == (30,)
+    np.testing.assert_allclose(att['roll_deg'][:5], 1.0 + np.arange(5))
+    np.testing.assert_allclose(np.diff(att['dgtime'][:5]), 0.02, atol=1e-6)
+    km.closeFile()
+
+
+def test_backscatter_corrections(tmp_path):
+    from HSTB.drivers import kmall_backscatter_reader
+
+    pth = build_kmall_file(tmp_path / '0007_test.kmall', num_pings=3)
+    second = build_kmall_file(tmp_path / '0008_test.kmall', num_pings=2)
+    columns = kmall_backscatter_reader.read_backscatter_columns(pth)
+    assert columns['reflectivity1'].shape == (3 * num_beams,)
+    np.testing.assert_array_equal(columns['ping'], np.repeat(np.arange(3), num_beams))
+    sectors = np.arange(num_beams) * num_sectors // num_beams
+    np.testing.assert_array_equal(columns['sector'][:num_beams], sectors)
+    np.testing.assert_array_equal(columns['frequency'][:num_beams], 290000.0 + 10000 * sectors)
+    np.testing.assert_array_equal(columns['depth_mode'], 2)
+
+    result = kmall_backscatter_reader.compute_corrections([pth, second])
+    refl = -20.0 - np.arange(num_beams) * 0.5
+    assert result['reference'] == pytest.approx(refl.mean())
+    np.testing.assert_array_equal(result['sector'], np.arange(num_sectors))
+    np.testing.assert_array_equal(result['frequency'], 290000 + 10000 * np.arange(num_sectors))
+    # every beam falls in its own one degree bin, corrections are the beam reflectivity less the reference
+    angles = np.linspace(-60, 60, num_beams)
+    bins = np.digitize(angles, result['angle_bins']) - 1
+    np.testing.assert_allclose(result['corrections'][sectors, bins], refl - refl.mean(), atol=1e-5)
+    np.testing.assert_array_equal(result['counts'][sectors, bins], 5)
+    assert np.isnan(result['corrections']).sum() == result['corrections'].size - num_beams
+
+    parallel = kmall_backscatter_reader.compute_corrections([pth, second], num_workers=2)
+    np.testing.assert_array_equal(parallel['corrections'], result['corrections'])
+
+    # pings with a corrupt sounding or tx sector stride are skipped, the rest of the survey is used
+    corrupt = corrupt_mrz_strides(build_kmall_file(tmp_path / '0009_test.kmall', num_pings=3),
+                                  {0: {'sounding_stride': 16}, 1: {'sector_stride': 4}})
+    np.testing.assert_array_equal(kmall_backscatter_reader.read_backscatter_columns(corrupt)['ping'], 2)
+    withcorrupt = kmall_backscatter_reader.compute_corrections([pth, second, corrupt], num_workers=2)
+    np.testing.assert_array_equal(withcorrupt['counts'][sectors, bins], 6)
+
+    # as are pings with a numTxSectors running past the end of the datagram
+    corrupt = corrupt_mrz_strides(build_kmall_file(tmp_path / '0010_test.kmall', num_pings=3),
+                                  {1: {'num_tx_sectors': 60000}})
+    np.testing.assert_array_equal(np.unique(kmall_backscatter_reader.read_backscatter_columns(corrupt)['ping']), [0, 2])
+    withcorrupt = kmall_backscatter_reader.compute_corrections([pth, second, corrupt], num_workers=2)
+    np.testing.assert_array_equal(withcorrupt['counts'][sectors, bins], 7)
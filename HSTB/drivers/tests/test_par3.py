@@ -0,0 +1,301 @@
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+from HSTB.drivers import mapindex, par3
+
+# synthetic .all file used by the tests below, built from the datagram definitions in par3.py rather than from real
+#  sonar data so that the tests are self contained
+model = 2040
+date = 20200913
+start_ms = 43200000  # noon
+start_time = 1599998400.0  # POSIX time of date at noon
+ping_interval = 0.5
+num_beams = 8
+num_wc_parts = 2
+
+
+def _datagram(dtype: int, ms: int, counter: int, body: bytes):
+    """ size, STX, type, model, date, time, counter, serial, body, ETX, checksum """
+    block = struct.pack('<2B1H2I2H', 2, dtype, model, date, ms, counter, 100) + body
+    if (len(block) + 3) % 2:
+        block += b'\x00'  # spare byte so the datagram has an even length, as in the Kongsberg definition
+    block += b'\x03' + struct.pack('<H', sum(block[1:]) & 0xffff)
+    return struct.pack('<I', len(block)) + block
+
+
+def build_position(ms: int, counter: int, lat: float, lon: float, heading: float = 90.0, system: int = 1):
+    raw = b'$GPZDA,120000.00,13,09,2020,,*00\r\n'
+    body = struct.pack('<2i4H2B', int(round(lat * 20000000)), int(round(lon * 10000000)), 10, 100, 9000,
+                       int(round(heading * 100)), system, len(raw)) + raw
+    return _datagram(80, ms, counter, body)
+
+
+def build_attitude(ms: int, counter: int, numsamples: int = 10, sample_interval: int = 10, descriptor: int = 0):
+    body = struct.pack('<H', numsamples)
+    for cnt in range(numsamples):
+        tm = cnt * sample_interval
+        body += struct.pack('<2H3hH', tm, 0, int(100 + tm), int(-50 - tm), int(tm // 2), (35900 + tm * 10) % 36000)
+    return _datagram(65, ms, counter, body + struct.pack('B', descriptor))
+
+
+def build_watercolumn(ms: int, ping: int, part: int, nbeams: int = num_beams, nparts: int = num_wc_parts):
+    """ beams part * nbeams // nparts onward, beam b with 5 + 2 * b samples of amplitude (sample - b) """
+    beams = range(part * nbeams // nparts, (part + 1) * nbeams // nparts)
+    body = struct.pack('<6H1I1h3B3B', nparts, part + 1, 1, nbeams, len(beams), 15000, 1000000, 0, 20, 0, 0,
+                       0, 0, 0)
+    body += struct.pack('<hH2B', 0, 30000, 0, 0)
+    for bm in beams:
+        nsamples = 5 + 2 * bm
+        angle = int(round((60 - 120 * bm / (nbeams - 1)) * 100))
+        body += struct.pack('<h3H2B', angle, 0, nsamples, nsamples - 1, 0, bm)
+        body += (np.arange(nsamples) - bm).astype(np.int8).tobytes()
+    return _datagram(107, ms, ping, body)
+
+
+def build_all_file(pth, num_pings: int = 4, with_wc: bool = True, garbage: bytes = b''):
+    """ interleaved position, attitude and water column datagrams, with garbage bytes after the first position """
+    data = b''
+    for png in range(num_pings):
+        ms = start_ms + int(png * ping_interval * 1000)
+        data += build_position(ms, png, 43.0 + png * 1e-5, -70.0 + png * 2e-5)
+        if png == 0:
+            data += garbage
+        data += build_attitude(ms + 100, png)
+        if with_wc:
+            for part in reversed(range(num_wc_parts)):
+                data += build_watercolumn(ms + 200, png, part)
+    with open(pth, 'wb') as fil:
+        fil.write(data)
+    return str(pth)
+
+
+def slow_map(pth):
+    ar = par3.AllRead(pth)
+    ar.mapfile(show_progress=False, quick=False)
+    ar.close()
+    return ar.map
+
+
+def test_quickmap_matches_mapfile(tmp_path):
+    pth = build_all_file(tmp_path / '0000_test.all')
+    expected = slow_map(pth)
+    ar = par3.AllRead(pth)
+    ar.quickmap()
+    assert sorted(ar.map.packdir) == sorted(expected.packdir) == ['107', '65', '80']
+    for key in expected.packdir:
+        np.testing.assert_array_equal(ar.map.packdir[key], expected.packdir[key])
+        assert ar.map.sizedir[key] == expected.sizedir[key]
+    assert ar.map.numwc == expected.numwc == 4
+    np.testing.assert_allclose(ar.map.packdir['80'][:, 1], start_time + np.arange(4) * ping_interval)
+
+    # the water column is reassembled from the quick map as from the slow one
+    wc = ar.getwatercolumn(1)
+    np.testing.assert_array_equal(wc.rx['Beam#'], np.arange(num_beams)[::-1])
+    assert wc.ampdata.shape == (5 + 2 * (num_beams - 1), num_beams)
+    ar.close()
+
+    ar = par3.AllRead(pth)
+    ar.quickmap(record_types=[80])
+    assert list(ar.map.packdir) == ['80']
+    ar.close()
+
+
+def test_quickmap_resync(tmp_path):
+    garbage = b'\x02\x50junk' * 3 + b'\x00' * 7 + struct.pack('<I2BH', 40, 2, 80, model)
+    clean = slow_map(build_all_file(tmp_path / '0000_test.all'))
+    ar = par3.AllRead(build_all_file(tmp_path / '0001_test.all', garbage=garbage))
+    ar.quickmap()
+    for key in clean.packdir:
+        shifted = clean.packdir[key].copy()
+        shifted[shifted[:, 0] > 0, 0] += len(garbage)
+        np.testing.assert_array_equal(ar.map.packdir[key], shifted)
+
+    # starting part way into a datagram finds the next one
+    ar.close()
+    ar = par3.AllRead(str(tmp_path / '0000_test.all'), start_ptr=3)
+    ar.quickmap()
+    np.testing.assert_array_equal(ar.map.packdir['80'], clean.packdir['80'][1:])
+    ar.close()
+
+
+def test_quickmap_byteswap(tmp_path):
+    pth = build_all_file(tmp_path / '0000_test.all')
+    ar = par3.AllRead(pth)
+    ar.quickmap()
+    ar.close()
+    # the same file with the header fields in the other byte order, mapped with byteswap=True
+    with open(pth, 'rb') as fil:
+        data = bytearray(fil.read())
+    native = '<' if sys.byteorder == 'little' else '>'
+    swapped = '>' if native == '<' else '<'
+    for key in ar.map.packdir:
+        for offset in ar.map.packdir[key][:, 0].astype(int):
+            fields = struct.unpack_from(native + 'I2BH2I2H', data, offset)
+            struct.pack_into(swapped + 'I2BH2I2H', data, offset, *fields)
+    swapped_pth = str(tmp_path / '0001_test.all')
+    with open(swapped_pth, 'wb') as fil:
+        fil.write(data)
+
+    for start_ptr in [0, 3]:  # from the start of a datagram, and resyncing from part way into one
+        swapped_ar = par3.AllRead(swapped_pth, start_ptr=start_ptr, byteswap=True)
+        swapped_ar.mapfile()
+        assert swapped_ar.mapped and sorted(swapped_ar.map.packdir) == sorted(ar.map.packdir)
+        for key in ar.map.packdir:
+            expected = ar.map.packdir[key][1:] if start_ptr and key == '80' else ar.map.packdir[key]
+            np.testing.assert_array_equal(swapped_ar.map.packdir[key], expected)
+        swapped_ar.close()
+
+    # without byteswap, no datagram of the swapped file is valid
+    wrong = par3.AllRead(swapped_pth)
+    wrong.quickmap()
+    assert wrong.map.packdir == {}
+    wrong.close()
+
+
+def test_map_index(tmp_path):
+    pth = build_all_file(tmp_path / '0000_test.all')
+    ar = par3.AllRead(pth)
+    ar.mapfile()
+    ar.savefilemap()
+    assert os.path.exists(mapindex.map_index_path(pth))
+
+    loaded = par3.AllRead(pth)
+    loaded.loadfilemap()
+    assert loaded.mapped
+    for key in ar.map.packdir:
+        np.testing.assert_array_equal(loaded.map.packdir[key], ar.map.packdir[key])
+    assert loaded.map.sizedir == ar.map.sizedir
+    assert loaded.map.numwc == ar.map.numwc
+    loaded.close()
+    ar.close()
+
+    # appending to the file makes the map stale, it is rebuilt and saved again unless asked not to
+    with open(pth, 'ab') as fil:
+        fil.write(build_position(start_ms + 10000, 10, 43.0, -70.0))
+    assert mapindex.load_map_index(pth) is None
+    ar = par3.AllRead(pth)
+    ar.loadfilemap(save=False)
+    assert ar.mapped and mapindex.load_map_index(pth) is None
+    ar.close()
+    ar = par3.AllRead(pth)
+    ar.loadfilemap()
+    assert len(ar.map.packdir['80']) == 5
+    assert len(mapindex.load_map_index(pth)['80']) == 5
+    ar.close(clean=True)
+    assert not os.path.exists(mapindex.map_index_path(pth))
+
+    # integer and bytes record types survive the round trip, ragged maps are not saved
+    for packdir in [{3: np.arange(6.0).reshape(3, 2)}, {b'RAW0': np.zeros((0, 2))}]:
+        assert mapindex.save_map_index(pth, packdir)
+        loaded = mapindex.load_map_index(pth)
+        assert list(loaded) == list(packdir)
+        np.testing.assert_array_equal(loaded[list(packdir)[0]], list(packdir.values())[0])
+    assert not mapindex.save_map_index(pth, {'1': [[1, 2], [3]]})
+
+
+def test_getnav(tmp_path):
+    ar = par3.AllRead(build_all_file(tmp_path / '0000_test.all', with_wc=False))
+    tstamps = np.linspace(start_time - 1, start_time + 2.5, 500)
+    navpts = ar.getnav(tstamps)
+    pos = ar.navarray['80']
+    att = ar.navarray['65']
+
+    # against the point by point interpolation
+    inside = (tstamps > att[0, 0]) & (tstamps < att[-1, 0]) & (tstamps > pos[0, 0]) & (tstamps < pos[-1, 0])
+    assert inside.sum() > 100
+    for i in np.nonzero(inside)[0]:
+        prev = np.nonzero(pos[:, 0] <= tstamps[i])[0][-1]
+        np.testing.assert_allclose(navpts[i, :3], ar._interp_points(tstamps[i], pos[prev], pos[prev + 1]))
+        prev = np.nonzero(att[:, 0] <= tstamps[i])[0][-1]
+        expected = ar._interp_points(tstamps[i], att[prev], att[prev + 1])[1:]
+        np.testing.assert_allclose(navpts[i, 3:6], expected[:3])
+    outside = (tstamps < max(pos[0, 0], att[0, 0])) | (tstamps > min(pos[-1, 0], att[-1, 0]))
+    np.testing.assert_array_equal(navpts[outside], 0)
+
+    # heading goes 359 -> 0 -> 1 in each attitude record, interpolate across the wrap rather than through 180
+    first = att[0, 0]
+    wrapped = ar.getnav([first + 0.005, first + 0.015])
+    np.testing.assert_allclose(wrapped[:, 6], [359.5, 0.5], atol=1e-4)
+    np.testing.assert_allclose(ar.getnav(first + 0.005, degrees=False)[0, 6], np.deg2rad(359.5), atol=1e-6)
+    ar.close()
+
+
+def test_build_navarray(tmp_path):
+    pth = build_all_file(tmp_path / '0000_test.all', with_wc=False)
+    with open(pth, 'ab') as fil:
+        # secondary positioning system and attitude sensor records, left out of the navarray, and height records
+        fil.write(build_position(start_ms + 2100, 9, 44.0, -71.0, system=2))
+        fil.write(build_attitude(start_ms + 2200, 9, descriptor=16))
+        for cnt in range(3):
+            fil.write(_datagram(104, start_ms + cnt * 500, cnt, struct.pack('<iB', 1234 + cnt, 0)))
+    ar = par3.AllRead(pth)
+    ar._build_navarray()
+
+    expected_pos = []
+    for i in range(len(ar.map.packdir['80'])):
+        sub = ar.getrecord(80, i)
+        if (sub.header['System'] & 3) == 1:
+            expected_pos.append([ar.packet.time, sub.header[3], sub.header[2]])
+    np.testing.assert_array_equal(ar.navarray['80'], np.array(expected_pos))
+    assert len(ar.navarray['80']) == 4
+
+    expected_att = []
+    for i in range(len(ar.map.packdir['65'])):
+        sub = ar.getrecord(65, i)
+        if (sub.sensor_descriptor & 16) == 0:
+            expected_att += list(zip(sub.data['Time'], sub.data['Roll'], sub.data['Pitch'], sub.data['Heave'],
+                                     sub.data['Heading']))
+    np.testing.assert_array_equal(ar.navarray['65'], np.asarray(expected_att))
+    assert len(ar.navarray['65']) == 40
+
+    np.testing.assert_allclose(ar.navarray['104'][:, 1], [12.34, 12.35, 12.36], rtol=1e-6)
+    np.testing.assert_array_equal(ar.navarray['104'][:, 0], ar.map.packdir['104'][:, 1])
+
+    # the navarray is saved as a map index, only loaded back while it matches the file
+    ar.save_navarray()
+    loaded = par3.AllRead(pth)
+    assert loaded.load_navarray()
+    assert sorted(loaded.navarray) == sorted(ar.navarray)
+    for key in ar.navarray:
+        np.testing.assert_array_equal(loaded.navarray[key], ar.navarray[key])
+    loaded.close()
+    with open(pth, 'ab') as fil:
+        fil.write(build_position(start_ms + 10000, 10, 43.0, -70.0))
+    stale = par3.AllRead(pth)
+    assert not stale.load_navarray()
+    stale.close()
+    ar.close(clean=True)
+    assert not os.path.exists(ar.navarray_path())
+
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_extract_watercolumn(tmp_path, num_workers):
+    ar = par3.AllRead(build_all_file(tmp_path / '0000_test.all', num_pings=5))
+    outfile = str(tmp_path / 'wc.npy')
+    cube = ar.extract_watercolumn(outfile, start_ping=1, num_workers=num_workers)
+    assert cube['amplitude'].shape == (4, 5 + 2 * (num_beams - 1), num_beams)
+    np.testing.assert_array_equal(np.load(outfile), cube['amplitude'])
+    with np.load(str(tmp_path / 'wc_beams.npz')) as beams:
+        np.testing.assert_array_equal(beams['beam_angle'], cube['beam_angle'])
+    np.testing.assert_array_equal(cube['ping_counter'], [1, 2, 3, 4])
+    np.testing.assert_allclose(cube['ping_time'], start_time + 0.2 + np.arange(1, 5) * ping_interval)
+    np.testing.assert_allclose(cube['sound_speed'], 1500.0)
+    np.testing.assert_allclose(cube['sampling_frequency'], 10000.0)
+
+    # matches the ping by ping reassembly
+    for png in range(4):
+        wc = ar.getwatercolumn(png + 1)
+        np.testing.assert_array_equal(cube['amplitude'][png], wc.ampdata)
+        np.testing.assert_array_equal(cube['beam_angle'][png], wc.rx['BeamPointingAngle'])
+        np.testing.assert_array_equal(cube['detected_range'][png], wc.rx['DetectedRange'])
+
+    part = ar.extract_watercolumn(str(tmp_path / 'part.npy'), start_ping=2, end_ping=3, num_workers=num_workers)
+    np.testing.assert_array_equal(part['amplitude'][0], cube['amplitude'][1])
+    with pytest.raises(ValueError):
+        ar.extract_watercolumn(str(tmp_path / 'none.npy'), start_ping=10)
+    del cube, part
+    ar.close()